@@ -0,0 +1,124 @@
+"""Serialization benchmark for the largest list responses.
+
+Compares what a route cost before (jsonable_encoder + stdlib json, FastAPI's default) with the
+ORJSONResponse default class (jsonable_encoder + orjson) and with json_response() (orjson only),
+and shows the gzip saving on the wire. Payloads are synthetic but shaped like real documents, so
+no database is needed:
+
+    python bench_serialization.py [--rounds 200]
+"""
+import argparse
+import gzip
+import json
+import time
+import uuid
+from datetime import datetime, timezone
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+
+
+def make_product(i: int) -> dict:
+    now = datetime.now(timezone.utc).isoformat()
+    return {
+        "id": str(uuid.uuid4()),
+        "name": f"Elite Performance Jersey {i}",
+        "description": "Premium moisture-wicking fabric engineered for peak athletic performance. " * 4,
+        "price": 45000 + i,
+        "compare_price": 55000,
+        "category": "jerseys",
+        "sport": "Football",
+        "sizes": ["S", "M", "L", "XL", "XXL"],
+        "colors": ["Black", "White", "Red"],
+        "images": [f"https://images.example.com/products/{i}/{n}.jpeg" for n in range(4)],
+        "video_url": None,
+        "stock": 100,
+        "featured": i % 3 == 0,
+        "collection": "Elite Series",
+        "average_rating": 4.5,
+        "review_count": 12,
+        "sold_count": 40,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+def make_order(i: int) -> dict:
+    now = datetime.now(timezone.utc).isoformat()
+    items = [
+        {
+            "product_id": str(uuid.uuid4()),
+            "quantity": 2,
+            "size": "M",
+            "color": "Black",
+            "product_name": f"Jersey {n}",
+            "product_image": f"https://images.example.com/products/{n}/0.jpeg",
+            "unit_price": 45000,
+            "item_total": 90000,
+        }
+        for n in range(3)
+    ]
+    return {
+        "id": str(uuid.uuid4()),
+        "reference": f"GSP-{i:08X}",
+        "user_id": str(uuid.uuid4()),
+        "user_email": f"customer{i}@example.com",
+        "items": items,
+        "shipping_address": {
+            "full_name": "Ada Obi", "address": "12 Allen Avenue", "city": "Ikeja",
+            "state": "Lagos", "country": "Nigeria", "phone": "+2348000000000",
+            "email": f"customer{i}@example.com",
+        },
+        "payment_method": "paystack",
+        "subtotal": 270000,
+        "shipping_fee": 0,
+        "total": 270000,
+        "status": "confirmed",
+        "payment_status": "paid",
+        "notes": None,
+        "tracking_history": [
+            {"status": "confirmed", "timestamp": now, "description": "Order status updated to confirmed"}
+        ],
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+PAYLOADS = {
+    "GET /products (50)": lambda: {"products": [make_product(i) for i in range(50)], "total": 50, "next_cursor": None},
+    "GET /admin/orders (50)": lambda: {"orders": [make_order(i) for i in range(50)], "total": 5000, "next_cursor": "x"},
+    "GET /admin/orders (200)": lambda: {"orders": [make_order(i) for i in range(200)], "total": 5000, "next_cursor": "x"},
+}
+
+STRATEGIES = {
+    "encoder+json (before)": lambda p: json.dumps(jsonable_encoder(p), ensure_ascii=False).encode(),
+    "encoder+orjson": lambda p: orjson.dumps(jsonable_encoder(p)),
+    "orjson only": lambda p: orjson.dumps(p),
+}
+
+
+def time_strategy(fn, payload, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn(payload)
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    for name, build in PAYLOADS.items():
+        payload = build()
+        body = orjson.dumps(payload)
+        print(f"\n{name}: {len(body) / 1024:.1f} KiB raw, {len(gzip.compress(body, 6)) / 1024:.1f} KiB gzip")
+        baseline = None
+        for label, fn in STRATEGIES.items():
+            ms = time_strategy(fn, payload, args.rounds)
+            baseline = baseline or ms
+            print(f"  {label:<24} {ms:8.3f} ms/response  ({baseline / ms:4.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
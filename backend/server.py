@@ -1,15 +1,19 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Request, UploadFile, File, Form, BackgroundTasks
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Request, Response, UploadFile, File, Form, BackgroundTasks
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import ORJSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, TEXT, DeleteMany, IndexModel, ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
 import os
 import logging
 import shutil
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Literal
 import uuid
 from datetime import datetime, timezone, timedelta
 from passlib.context import CryptContext
@@ -17,9 +21,30 @@ from jose import JWTError, jwt
 import httpx
 import hmac
 import hashlib
+import re
+import json
+import base64
 import asyncio
+import random
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
 import resend
 
+try:
+    # Optional: serve brotli to clients that accept it, gzip to everyone else
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
+
+try:
+    # Optional: lets the provider clients negotiate HTTP/2 when HTTP_CLIENT_HTTP2 is on
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
 ROOT_DIR = Path(__file__).parent
 UPLOADS_DIR = ROOT_DIR / "uploads"
 UPLOADS_DIR.mkdir(exist_ok=True)
@@ -38,9 +63,53 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
 # Paystack Settings
 PAYSTACK_SECRET_KEY = os.environ.get('PAYSTACK_SECRET_KEY', '')
 PAYSTACK_PUBLIC_KEY = os.environ.get('PAYSTACK_PUBLIC_KEY', '')
+PAYSTACK_BASE_URL = os.environ.get('PAYSTACK_BASE_URL', 'https://api.paystack.co')
+PAYSTACK_TIMEOUT_SECONDS = float(os.environ.get('PAYSTACK_TIMEOUT_SECONDS', '10'))
+# Webhook events are queued and applied by a worker, woken on arrival or every poll interval
+PAYMENT_EVENT_POLL_SECONDS = float(os.environ.get('PAYMENT_EVENT_POLL_SECONDS', '5'))
+PAYMENT_EVENT_BATCH_SIZE = int(os.environ.get('PAYMENT_EVENT_BATCH_SIZE', '100'))
+# Handled events are kept this long (past Paystack's retry window, so redeliveries still dedupe)
+PAYMENT_EVENT_RETENTION_DAYS = float(os.environ.get('PAYMENT_EVENT_RETENTION_DAYS', '7'))
+# Pending Paystack orders between RECONCILE_MIN_AGE_MINUTES and RECONCILE_MAX_AGE_HOURS old are
+# re-verified every RECONCILE_INTERVAL_SECONDS (0 disables), at most RECONCILE_CONCURRENCY at once
+# and RECONCILE_RATE_PER_SECOND overall; an order checked less than RECONCILE_RECHECK_MINUTES
+# ago (or one interval, if longer) is skipped
+RECONCILE_INTERVAL_SECONDS = float(os.environ.get('RECONCILE_INTERVAL_SECONDS', '600'))
+RECONCILE_RECHECK_MINUTES = float(os.environ.get('RECONCILE_RECHECK_MINUTES', '60'))
+RECONCILE_MIN_AGE_MINUTES = float(os.environ.get('RECONCILE_MIN_AGE_MINUTES', '15'))
+RECONCILE_MAX_AGE_HOURS = float(os.environ.get('RECONCILE_MAX_AGE_HOURS', '72'))
+RECONCILE_BATCH_SIZE = int(os.environ.get('RECONCILE_BATCH_SIZE', '100'))
+RECONCILE_CONCURRENCY = int(os.environ.get('RECONCILE_CONCURRENCY', '5'))
+RECONCILE_RATE_PER_SECOND = float(os.environ.get('RECONCILE_RATE_PER_SECOND', '10'))
 
 # CoinGecko API
 COINGECKO_API_KEY = os.environ.get('COINGECKO_API_KEY', '')
+COINGECKO_BASE_URL = os.environ.get('COINGECKO_BASE_URL', 'https://api.coingecko.com/api/v3')
+COINGECKO_TIMEOUT_SECONDS = float(os.environ.get('COINGECKO_TIMEOUT_SECONDS', '5'))
+
+# Crypto rates are refreshed in the background every CRYPTO_RATE_REFRESH_SECONDS and served
+# from memory; past CRYPTO_RATE_MAX_AGE_SECONDS a request waits for a fresh fetch instead
+CRYPTO_RATE_REFRESH_SECONDS = float(os.environ.get('CRYPTO_RATE_REFRESH_SECONDS', '60'))
+CRYPTO_RATE_MAX_AGE_SECONDS = float(os.environ.get('CRYPTO_RATE_MAX_AGE_SECONDS', '900'))
+# How long the crypto amount quoted at checkout is honoured
+CRYPTO_QUOTE_MINUTES = float(os.environ.get('CRYPTO_QUOTE_MINUTES', '30'))
+
+# Outbound HTTP connection pool, per provider
+HTTP_POOL_MAX_CONNECTIONS = int(os.environ.get('HTTP_POOL_MAX_CONNECTIONS', '20'))
+HTTP_POOL_MAX_KEEPALIVE = int(os.environ.get('HTTP_POOL_MAX_KEEPALIVE', '10'))
+HTTP_POOL_KEEPALIVE_SECONDS = float(os.environ.get('HTTP_POOL_KEEPALIVE_SECONDS', '30'))
+HTTP_CLIENT_HTTP2 = os.environ.get('HTTP_CLIENT_HTTP2', 'false').lower() == 'true'
+
+# A provider's circuit opens after PROVIDER_FAILURE_THRESHOLD consecutive failures and lets a
+# probe through after PROVIDER_CIRCUIT_RESET_SECONDS. Safe (GET) calls are retried up to
+# PROVIDER_MAX_RETRIES times with jittered backoff, while retries stay under
+# PROVIDER_RETRY_BUDGET_RATIO of recent requests
+PROVIDER_FAILURE_THRESHOLD = int(os.environ.get('PROVIDER_FAILURE_THRESHOLD', '5'))
+PROVIDER_CIRCUIT_RESET_SECONDS = float(os.environ.get('PROVIDER_CIRCUIT_RESET_SECONDS', '30'))
+PROVIDER_MAX_RETRIES = int(os.environ.get('PROVIDER_MAX_RETRIES', '2'))
+PROVIDER_RETRY_BUDGET_RATIO = float(os.environ.get('PROVIDER_RETRY_BUDGET_RATIO', '0.2'))
+PROVIDER_RETRY_BACKOFF_SECONDS = float(os.environ.get('PROVIDER_RETRY_BACKOFF_SECONDS', '0.2'))
+PROVIDER_RETRY_BACKOFF_MAX_SECONDS = float(os.environ.get('PROVIDER_RETRY_BACKOFF_MAX_SECONDS', '2'))
 
 # Resend Email
 RESEND_API_KEY = os.environ.get('RESEND_API_KEY', '')
@@ -66,11 +135,57 @@ BANK_DETAILS = {
 # Inventory Alert Threshold
 LOW_STOCK_THRESHOLD = 10
 
+# Shop page price facet buckets (NGN); prices above the last boundary fall into an open bucket
+PRICE_BUCKET_BOUNDARIES = [0, 20000, 40000, 60000, 80000, 100000, 200000]
+
+# Most products one /products/batch call may resolve
+PRODUCT_BATCH_LIMIT = int(os.environ.get('PRODUCT_BATCH_LIMIT', '100'))
+
+# Product Cache Settings (TTL in seconds; a size or TTL of 0 disables that cache)
+PRODUCT_CACHE_SIZE = int(os.environ.get('PRODUCT_CACHE_SIZE', '5000'))
+PRODUCT_CACHE_TTL = float(os.environ.get('PRODUCT_CACHE_TTL', '300'))
+PRODUCT_LIST_CACHE_SIZE = int(os.environ.get('PRODUCT_LIST_CACHE_SIZE', '500'))
+PRODUCT_LIST_CACHE_TTL = float(os.environ.get('PRODUCT_LIST_CACHE_TTL', '30'))
+CATALOG_VERSION_CHECK_SECONDS = float(os.environ.get('CATALOG_VERSION_CHECK_SECONDS', '2'))
+
+# Responses smaller than this many bytes are sent uncompressed
+COMPRESSION_MINIMUM_SIZE = int(os.environ.get('COMPRESSION_MINIMUM_SIZE', '1000'))
+
+# Cache-Control for public catalog routes; static config routes can be cached much longer
+CATALOG_CACHE_CONTROL = os.environ.get('CATALOG_CACHE_CONTROL', 'public, max-age=60, stale-while-revalidate=300')
+STATIC_CACHE_CONTROL = os.environ.get('STATIC_CACHE_CONTROL', 'public, max-age=3600, stale-while-revalidate=86400')
+
+# List totals are cached this many seconds per normalized query (0 always counts exactly)
+COUNT_CACHE_TTL = float(os.environ.get('COUNT_CACHE_TTL', '15'))
+
+# Most counter shards one size/colour variant can be split into for high-contention drops
+MAX_INVENTORY_SHARDS = int(os.environ.get('MAX_INVENTORY_SHARDS', '16'))
+
+# Carts untouched for CART_IDLE_DAYS are swept every CART_SWEEP_INTERVAL_SECONDS (0 disables);
+# with CART_ARCHIVE they are copied to carts_archive before being deleted
+CART_IDLE_DAYS = float(os.environ.get('CART_IDLE_DAYS', '30'))
+CART_SWEEP_INTERVAL_SECONDS = float(os.environ.get('CART_SWEEP_INTERVAL_SECONDS', '3600'))
+CART_SWEEP_BATCH_SIZE = int(os.environ.get('CART_SWEEP_BATCH_SIZE', '500'))
+CART_ARCHIVE = os.environ.get('CART_ARCHIVE', 'false').lower() == 'true'
+
+# Bank transfer / crypto orders still awaiting payment after UNPAID_ORDER_EXPIRY_HOURS are
+# cancelled and their stock returned; checked every ORDER_EXPIRY_INTERVAL_SECONDS (0 disables)
+UNPAID_ORDER_EXPIRY_HOURS = float(os.environ.get('UNPAID_ORDER_EXPIRY_HOURS', '48'))
+ORDER_EXPIRY_INTERVAL_SECONDS = float(os.environ.get('ORDER_EXPIRY_INTERVAL_SECONDS', '300'))
+ORDER_EXPIRY_BATCH_SIZE = int(os.environ.get('ORDER_EXPIRY_BATCH_SIZE', '200'))
+# Cancelled orders that can be taken back (stock re-reserved) when their payment turns up late
+REINSTATABLE_PAYMENT_STATUSES = ["expired", "failed"]
+
+# Responses to requests sent with an Idempotency-Key are replayed for this many hours
+IDEMPOTENCY_TTL_HOURS = float(os.environ.get('IDEMPOTENCY_TTL_HOURS', '24'))
+# A key still processing after this long is treated as abandoned and can be claimed by a retry
+IDEMPOTENCY_LOCK_SECONDS = float(os.environ.get('IDEMPOTENCY_LOCK_SECONDS', '120'))
+
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
 
-app = FastAPI(title="Gs Premier Fit Fan API")
+app = FastAPI(title="Gs Premier Fit Fan API", default_response_class=ORJSONResponse)
 api_router = APIRouter(prefix="/api")
 
 # Configure logging
@@ -132,6 +247,9 @@ class ProductUpdate(BaseModel):
     featured: Optional[bool] = None
     collection: Optional[str] = None
 
+class ProductBatchRequest(BaseModel):
+    ids: List[str] = Field(..., min_length=1)
+
 class CartItem(BaseModel):
     product_id: str
     quantity: int
@@ -144,6 +262,16 @@ class AddToCart(BaseModel):
     size: str
     color: Optional[str] = None
 
+class CartOperation(BaseModel):
+    op: Literal["add", "set", "remove"]
+    product_id: str
+    size: str
+    color: Optional[str] = None
+    quantity: int = 1
+
+class CartBatch(BaseModel):
+    operations: List[CartOperation] = Field(..., min_length=1, max_length=100)
+
 class ShippingAddress(BaseModel):
     full_name: str
     address: str
@@ -186,6 +314,212 @@ class TrackingUpdate(BaseModel):
     location: Optional[str] = None
     description: str
 
+# ==================== HTTP CLIENTS ====================
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider whose circuit is open"""
+
+class CircuitBreaker:
+    """closed -> open after threshold consecutive failures -> half_open (one probe) after reset_seconds"""
+
+    def __init__(self, threshold: int, reset_seconds: float):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.opened_count = 0
+        self.rejected = 0
+        self._probing = False
+
+    def allow(self) -> Optional[Literal["call", "probe"]]:
+        """None when the call is refused, "probe" for the one trial call while half open, else "call" """
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_seconds:
+                self.rejected += 1
+                return None
+            self.state = "half_open"
+        if self.state == "half_open":
+            if self._probing:
+                self.rejected += 1
+                return None
+            self._probing = True
+            return "probe"
+        return "call"
+
+    def record_success(self):
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == "half_open" or self.consecutive_failures >= self.threshold:
+            # Failures of calls still in flight when it opened don't push the reset further out
+            if self.state != "open":
+                self.opened_count += 1
+                self.opened_at = time.monotonic()
+            self.state = "open"
+        self._probing = False
+
+    def release_probe(self):
+        """A probe that ended without an outcome (cancelled) frees the slot for the next one.
+
+        Only the call allow() answered "probe" may release it.
+        """
+        self._probing = False
+
+    def stats(self) -> dict:
+        retry_in = self.reset_seconds - (time.monotonic() - self.opened_at) if self.state == "open" else 0
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "opened_count": self.opened_count,
+            "rejected": self.rejected,
+            "retry_in_seconds": round(max(retry_in, 0), 1)
+        }
+
+class RetryBudget:
+    """Each successful call earns `ratio` of a retry token and each retry spends one, so retries
+    stay a bounded share of healthy traffic and can't multiply load on a struggling provider"""
+
+    def __init__(self, ratio: float, reserve: float = 3.0):
+        self.ratio = ratio
+        self.reserve = reserve
+        self.tokens = reserve
+
+    def deposit(self):
+        self.tokens = min(self.tokens + self.ratio, max(self.reserve, 10.0))
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+def is_provider_failure(response: Optional[httpx.Response]) -> bool:
+    """Transport errors, 5xx and 429 count against a provider; other 4xx mean it's healthy"""
+    return response is None or response.status_code >= 500 or response.status_code == 429
+
+class ProviderClient:
+    """Pooled keep-alive HTTP client for one external API.
+
+    Opened at startup and closed at shutdown so connections (and their TLS sessions) are reused
+    across requests. Opens lazily too, for scripts that never run the app's startup hooks.
+    """
+
+    def __init__(self, name: str, base_url: str, timeout: float, headers: Optional[dict] = None):
+        self.name = name
+        self.base_url = base_url
+        self.timeout = timeout
+        self.headers = headers or {}
+        self.client: Optional[httpx.AsyncClient] = None
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.total_ms = 0.0
+        self.retries = 0
+        self.breaker = CircuitBreaker(PROVIDER_FAILURE_THRESHOLD, PROVIDER_CIRCUIT_RESET_SECONDS)
+        self.retry_budget = RetryBudget(PROVIDER_RETRY_BUDGET_RATIO)
+
+    def open(self) -> httpx.AsyncClient:
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=self.headers,
+                timeout=httpx.Timeout(self.timeout, connect=min(self.timeout, 5.0)),
+                limits=httpx.Limits(
+                    max_connections=HTTP_POOL_MAX_CONNECTIONS,
+                    max_keepalive_connections=HTTP_POOL_MAX_KEEPALIVE,
+                    keepalive_expiry=HTTP_POOL_KEEPALIVE_SECONDS
+                ),
+                http2=HTTP_CLIENT_HTTP2 and HTTP2_AVAILABLE
+            )
+        return self.client
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def _send(self, method: str, path: str, **kwargs) -> httpx.Response:
+        client = self.open()
+        self.requests += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        start = time.perf_counter()
+        try:
+            return await client.request(method, path, **kwargs)
+        except httpx.HTTPError:
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self.total_ms += (time.perf_counter() - start) * 1000
+
+    async def request(self, method: str, path: str, retry: Optional[bool] = None, **kwargs) -> httpx.Response:
+        """Call the provider through its circuit breaker, raising CircuitOpenError without a network
+        call while the circuit is open. Only GETs are retried unless retry says otherwise."""
+        retry = method == "GET" if retry is None else retry
+        attempt = 0
+        while True:
+            permit = self.breaker.allow()
+            if permit is None:
+                raise CircuitOpenError(f"{self.name} is unavailable (circuit open)")
+            response, error = None, None
+            try:
+                response = await self._send(method, path, **kwargs)
+            except httpx.TransportError as e:
+                error = e
+            except BaseException:
+                if permit == "probe":
+                    self.breaker.release_probe()
+                raise
+            if not is_provider_failure(response):
+                self.breaker.record_success()
+                self.retry_budget.deposit()
+                return response
+            self.breaker.record_failure()
+            
+            attempt += 1
+            if not retry or attempt > PROVIDER_MAX_RETRIES or not self.retry_budget.withdraw():
+                if error is not None:
+                    raise error
+                return response
+            self.retries += 1
+            # Full jitter: spread retries so callers that failed together don't retry together
+            backoff = min(PROVIDER_RETRY_BACKOFF_MAX_SECONDS, PROVIDER_RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1))
+            await asyncio.sleep(random.uniform(0, backoff))
+
+    def stats(self) -> dict:
+        # httpx doesn't expose pool occupancy publicly; read it defensively from the transport
+        pool = getattr(getattr(self.client, "_transport", None), "_pool", None)
+        connections = getattr(pool, "connections", None)
+        return {
+            "base_url": self.base_url,
+            "open": self.client is not None,
+            "http2": HTTP_CLIENT_HTTP2 and HTTP2_AVAILABLE,
+            "timeout_seconds": self.timeout,
+            "max_connections": HTTP_POOL_MAX_CONNECTIONS,
+            "pooled_connections": len(connections) if connections is not None else 0,
+            "requests": self.requests,
+            "errors": self.errors,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "avg_ms": round(self.total_ms / self.requests, 2) if self.requests else 0,
+            "retries": self.retries,
+            "retry_budget_tokens": round(self.retry_budget.tokens, 2),
+            "circuit": self.breaker.stats()
+        }
+
+paystack_client = ProviderClient(
+    "paystack", PAYSTACK_BASE_URL, PAYSTACK_TIMEOUT_SECONDS,
+    headers={"Authorization": f"Bearer {PAYSTACK_SECRET_KEY}"}
+)
+coingecko_client = ProviderClient("coingecko", COINGECKO_BASE_URL, COINGECKO_TIMEOUT_SECONDS)
+PROVIDER_CLIENTS = [paystack_client, coingecko_client]
+
 # ==================== EMAIL HELPERS ====================
 
 async def send_order_confirmation_email(order: dict, user_email: str):
@@ -469,6 +803,544 @@ async def get_admin_user(current_user: dict = Depends(get_current_user)):
         raise HTTPException(status_code=403, detail="Admin access required")
     return current_user
 
+# ==================== DATABASE INDEXES & MIGRATIONS ====================
+
+# MongoDB error code for a missing index (dropping one, or $text without a text index)
+INDEX_NOT_FOUND_CODE = 27
+
+# Bump INDEX_VERSION whenever INDEXES changes so every deployment re-applies them once
+INDEX_VERSION = 13
+
+INDEXES = {
+    "products": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("sport", ASCENDING), ("category", ASCENDING)], name="sport_category"),
+        IndexModel([("category", ASCENDING)], name="category"),
+        IndexModel([("collection", ASCENDING)], name="collection"),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="created_at_id"),
+        IndexModel([("sport", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="sport_created_at_id"),
+        IndexModel([("featured", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="featured_created_at_id"),
+        IndexModel([("price", ASCENDING), ("id", ASCENDING)], name="price_id"),
+        IndexModel([("average_rating", DESCENDING), ("id", DESCENDING)], name="average_rating_id"),
+        IndexModel([("sold_count", DESCENDING), ("id", DESCENDING)], name="sold_count_id"),
+        IndexModel([("name", ASCENDING), ("id", ASCENDING)], name="name_id"),
+        IndexModel([("colors", ASCENDING)], name="colors"),
+        IndexModel([("sizes", ASCENDING)], name="sizes"),
+        IndexModel([("stock", ASCENDING)], name="stock"),
+        # Stemmed, weighted full-text index backing the search parameter of /products
+        IndexModel(
+            [("name", TEXT), ("sport", TEXT), ("collection", TEXT), ("category", TEXT), ("description", TEXT)],
+            name="catalog_text",
+            weights={"name": 10, "sport": 5, "collection": 5, "category": 3, "description": 1},
+            default_language="english"
+        ),
+    ],
+    "users": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("is_admin", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="is_admin_created_at_id"),
+    ],
+    "carts": [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+        IndexModel([("updated_at", ASCENDING)], name="updated_at"),
+    ],
+    "orders": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("reference", ASCENDING)], name="reference_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)], name="user_id_created_at"),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="created_at_id"),
+        IndexModel([("status", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="status_created_at_id"),
+        IndexModel(
+            [("payment_status", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+            name="payment_status_created_at_id"
+        ),
+        IndexModel([("user_id", ASCENDING), ("payment_status", ASCENDING)], name="user_id_payment_status"),
+        IndexModel([("stock_release_pending", ASCENDING)], name="stock_release_pending", sparse=True),
+        IndexModel([("stock_restock_claim", ASCENDING)], name="stock_restock_claim", sparse=True),
+        IndexModel([("stock_commit_pending", ASCENDING)], name="stock_commit_pending", sparse=True),
+        IndexModel([("payment_review", ASCENDING)], name="payment_review", sparse=True),
+    ],
+    "reviews": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel(
+            [("product_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+            name="product_id_created_at_id"
+        ),
+        IndexModel([("product_id", ASCENDING), ("user_id", ASCENDING)], name="product_id_user_id_unique", unique=True),
+    ],
+    "settings": [
+        IndexModel([("type", ASCENDING)], name="type_unique", unique=True),
+    ],
+    "idempotency": [
+        IndexModel([("key", ASCENDING)], name="key_unique", unique=True),
+        # TTL indexes only work on BSON dates, so expires_at is stored as a datetime, not an ISO string
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "payment_events": [
+        IndexModel([("event_id", ASCENDING)], name="event_id_unique", unique=True),
+        IndexModel([("status", ASCENDING), ("received_at", ASCENDING)], name="status_received_at"),
+        # Set once an event is handled; pending events have no expires_at and are never removed
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "locks": [
+        IndexModel([("name", ASCENDING)], name="name_unique", unique=True),
+    ],
+    "inventory": [
+        IndexModel(
+            [("product_id", ASCENDING), ("size", ASCENDING), ("color", ASCENDING), ("shard", ASCENDING)],
+            name="variant_shard_unique",
+            unique=True
+        ),
+    ],
+}
+
+# Indexes superseded by a later INDEX_VERSION; dropped when that version is applied
+RETIRED_INDEXES = {
+    "products": ["featured_created_at", "price"],
+    "users": ["is_admin"],
+    "orders": ["created_at", "status_created_at", "payment_status_created_at"],
+    "reviews": ["product_id_created_at"],
+}
+
+async def migrate_merge_duplicate_carts():
+    """Merge carts that were created twice for the same user before user_id was unique"""
+    pipeline = [
+        {"$group": {"_id": "$user_id", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ]
+    duplicates = await db.carts.aggregate(pipeline).to_list(None)
+    for dup in duplicates:
+        carts = await db.carts.find({"_id": {"$in": dup["ids"]}}).sort("created_at", 1).to_list(None)
+        merged = {}
+        for cart in carts:
+            for item in cart.get("items", []):
+                key = (item["product_id"], item["size"], item.get("color"))
+                if key in merged:
+                    merged[key]["quantity"] += item["quantity"]
+                else:
+                    merged[key] = dict(item)
+        keeper = carts[0]
+        await db.carts.update_one({"_id": keeper["_id"]}, {"$set": {"items": list(merged.values())}})
+        await db.carts.delete_many({"_id": {"$in": [c["_id"] for c in carts[1:]]}})
+    return len(duplicates)
+
+async def migrate_backfill_product_sort_fields():
+    """Give every product the numeric fields the rating/popular sorts page over"""
+    updated = 0
+    for field in ("average_rating", "review_count", "sold_count"):
+        result = await db.products.update_many({field: {"$exists": False}}, {"$set": {field: 0}})
+        updated += result.modified_count
+    return updated
+
+async def migrate_backfill_product_versions():
+    """Start every product at version 1 so cart snapshots have something to compare against"""
+    result = await db.products.update_many({"version": {"$exists": False}}, {"$set": {"version": 1}})
+    return result.modified_count
+
+async def migrate_backfill_cart_updated_at():
+    """Date carts written before updated_at was tracked by their creation time"""
+    now = datetime.now(timezone.utc).isoformat()
+    result = await db.carts.update_many(
+        {"updated_at": {"$exists": False}},
+        [{"$set": {"updated_at": {"$ifNull": ["$created_at", now]}}}]
+    )
+    return result.modified_count
+
+async def migrate_expire_handled_payment_events():
+    """Give events handled before retention existed an expiry, counted from now"""
+    expires_at = datetime.now(timezone.utc) + timedelta(days=PAYMENT_EVENT_RETENTION_DAYS)
+    result = await db.payment_events.update_many(
+        {"status": {"$ne": "pending"}, "expires_at": {"$exists": False}}, {"$set": {"expires_at": expires_at}}
+    )
+    return result.modified_count
+
+# Data migrations run once, in order, before indexes are created. Append only; never renumber.
+MIGRATIONS = [
+    (1, "merge duplicate carts", migrate_merge_duplicate_carts),
+    (2, "backfill product sort fields", migrate_backfill_product_sort_fields),
+    (3, "backfill product versions", migrate_backfill_product_versions),
+    (4, "backfill cart updated_at", migrate_backfill_cart_updated_at),
+    (5, "expire handled payment events", migrate_expire_handled_payment_events),
+]
+
+async def run_migrations():
+    """Apply pending data migrations recorded in the settings collection"""
+    state = await db.settings.find_one({"type": "schema_migrations"}, {"_id": 0})
+    applied = state.get("version", 0) if state else 0
+    for version, description, migration in MIGRATIONS:
+        if version <= applied:
+            continue
+        result = await migration()
+        logger.info(f"Applied migration {version} ({description}): {result}")
+        await db.settings.update_one(
+            {"type": "schema_migrations"},
+            {"$set": {"version": version, "applied_at": datetime.now(timezone.utc).isoformat()}},
+            upsert=True
+        )
+        applied = version
+    return applied
+
+async def ensure_indexes(force: bool = False):
+    """Create declared indexes if the stored index version is behind INDEX_VERSION"""
+    state = await db.settings.find_one({"type": "index_version"}, {"_id": 0})
+    current = state.get("version", 0) if state else 0
+    if current >= INDEX_VERSION and not force:
+        return current
+
+    failed = []
+    for collection, names in RETIRED_INDEXES.items():
+        for name in names:
+            try:
+                await db[collection].drop_index(name)
+                logger.info(f"Dropped retired index {collection}.{name}")
+            except OperationFailure as e:
+                if e.code != INDEX_NOT_FOUND_CODE:
+                    logger.error(f"Failed to drop index {collection}.{name}: {e}")
+    for collection, models in INDEXES.items():
+        # One index at a time so a single conflict doesn't block the rest
+        for model in models:
+            try:
+                await db[collection].create_indexes([model])
+            except OperationFailure as e:
+                failed.append(f"{collection}.{model.document['name']}")
+                logger.error(f"Failed to create index {collection}.{model.document['name']}: {e}")
+
+    if failed:
+        # Leave the version behind so the next startup retries
+        return current
+    await db.settings.update_one(
+        {"type": "index_version"},
+        {"$set": {"version": INDEX_VERSION, "applied_at": datetime.now(timezone.utc).isoformat()}},
+        upsert=True
+    )
+    logger.info(f"Database indexes at version {INDEX_VERSION}")
+    return INDEX_VERSION
+
+async def bootstrap_database():
+    """Run pending migrations, then make sure declared indexes exist"""
+    migration_version = await run_migrations()
+    index_version = await ensure_indexes()
+    return {"migration_version": migration_version, "index_version": index_version}
+
+async def index_report():
+    """Describe existing indexes per collection with their on-disk size"""
+    existing_collections = await db.list_collection_names()
+    report = {}
+    for collection in sorted(set(INDEXES) | set(existing_collections)):
+        declared = {model.document["name"] for model in INDEXES.get(collection, [])}
+        if collection not in existing_collections:
+            report[collection] = {"documents": 0, "indexes": [], "missing": sorted(declared)}
+            continue
+        stats = await db.command("collStats", collection)
+        index_sizes = stats.get("indexSizes", {})
+        info = await db[collection].index_information()
+        indexes = [
+            {
+                "name": name,
+                "keys": [list(k) for k in spec["key"]],
+                "unique": spec.get("unique", False),
+                "size_bytes": index_sizes.get(name, 0),
+                "declared": name in declared or name == "_id_"
+            }
+            for name, spec in info.items()
+        ]
+        report[collection] = {
+            "documents": stats.get("count", 0),
+            "data_size_bytes": stats.get("size", 0),
+            "total_index_size_bytes": stats.get("totalIndexSize", 0),
+            "indexes": indexes,
+            "missing": sorted(declared - set(info))
+        }
+    return report
+
+# ==================== PRODUCT CACHE ====================
+
+class TTLCache:
+    """Bounded LRU cache whose entries also expire ttl seconds after being stored"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0 and self.ttl > 0
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if not self.enabled:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0
+        }
+
+product_cache = TTLCache(PRODUCT_CACHE_SIZE, PRODUCT_CACHE_TTL)
+product_list_cache = TTLCache(PRODUCT_LIST_CACHE_SIZE, PRODUCT_LIST_CACHE_TTL)
+product_version_cache = TTLCache(PRODUCT_CACHE_SIZE, PRODUCT_CACHE_TTL)
+
+# version mirrors the shared catalog version in db.settings; stock_version counts the lighter
+# stock/rating-only changes that listing ETags also depend on; generation counts local
+# invalidations so a read that raced an admin write never repopulates the cache
+catalog_state = {"version": None, "stock_version": None, "checked_at": 0.0, "generation": 0}
+
+def _clear_catalog_caches(product_ids=None):
+    if product_ids is None:
+        product_cache.clear()
+        product_version_cache.clear()
+    else:
+        for product_id in product_ids:
+            product_cache.pop(product_id)
+            product_version_cache.pop(product_id)
+    product_list_cache.clear()
+    catalog_state["generation"] += 1
+
+async def sync_catalog_version():
+    """Drop cached catalog data once another worker has bumped the shared catalog version"""
+    now = time.monotonic()
+    if now - catalog_state["checked_at"] < CATALOG_VERSION_CHECK_SECONDS:
+        return catalog_state["version"]
+    doc = await db.settings.find_one({"type": "catalog_version"}, {"_id": 0, "version": 1, "stock_version": 1})
+    version = doc.get("version", 0) if doc else 0
+    stock_version = doc.get("stock_version", 0) if doc else 0
+    if version != catalog_state["version"]:
+        if catalog_state["version"] is not None:
+            _clear_catalog_caches()
+        catalog_state["version"] = version
+    elif stock_version != catalog_state["stock_version"] and catalog_state["stock_version"] is not None:
+        # Stock and ratings live in cached products and listing pages alike; versions didn't move
+        product_cache.clear()
+        product_list_cache.clear()
+        catalog_state["generation"] += 1
+    catalog_state["stock_version"] = stock_version
+    catalog_state["checked_at"] = now
+    return version
+
+async def listing_version() -> tuple:
+    """(catalog version, stock version) for ETags on listings that show stock or ratings"""
+    version = await sync_catalog_version()
+    return version, catalog_state["stock_version"]
+
+async def invalidate_catalog(product_ids: Optional[List[str]] = None, broadcast: bool = True):
+    """Evict changed products; broadcast bumps the shared version so every worker drops its cache.
+
+    Without broadcast (stock and rating changes) only the stock version moves, which expires
+    cached products, listing pages and their ETags everywhere but keeps the version caches, so
+    carts don't re-snapshot their lines.
+    """
+    _clear_catalog_caches(product_ids)
+    counter = "version" if broadcast else "stock_version"
+    doc = await db.settings.find_one_and_update(
+        {"type": "catalog_version"},
+        {"$inc": {counter: 1}, "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}},
+        projection={"_id": 0, "version": 1, "stock_version": 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    catalog_state["version"] = doc.get("version", 0)
+    catalog_state["stock_version"] = doc.get("stock_version", 0)
+    catalog_state["checked_at"] = time.monotonic()
+    return catalog_state["version"]
+
+# reservations holds the in-flight order tags written by reserve_stock; never sent to clients
+PRODUCT_PROJECTION = {"_id": 0, "reservations": 0}
+
+async def get_products_by_ids(product_ids: List[str]) -> Dict[str, dict]:
+    """Resolve products by id from the cache, fetching all misses with one $in query.
+
+    Returned documents are shared with the cache and must be treated as read-only.
+    """
+    await sync_catalog_version()
+    found = {}
+    missing = []
+    for product_id in dict.fromkeys(product_ids):
+        product = product_cache.get(product_id)
+        if product is None:
+            missing.append(product_id)
+        else:
+            found[product_id] = product
+
+    if missing:
+        generation = catalog_state["generation"]
+        docs = await db.products.find({"id": {"$in": missing}}, PRODUCT_PROJECTION).to_list(len(missing))
+        for doc in docs:
+            found[doc["id"]] = doc
+            if generation == catalog_state["generation"]:
+                product_cache.set(doc["id"], doc)
+    return found
+
+async def get_cached_product(product_id: str) -> Optional[dict]:
+    return (await get_products_by_ids([product_id])).get(product_id)
+
+async def get_product_versions(product_ids: List[str]) -> Dict[str, int]:
+    """Map existing product ids to their version, fetching only {id, version} for cache misses"""
+    await sync_catalog_version()
+    versions = {}
+    missing = []
+    for product_id in dict.fromkeys(product_ids):
+        product = product_cache.get(product_id)
+        version = product.get("version", 0) if product else product_version_cache.get(product_id)
+        if version is None:
+            missing.append(product_id)
+        else:
+            versions[product_id] = version
+
+    if missing:
+        generation = catalog_state["generation"]
+        docs = await db.products.find(
+            {"id": {"$in": missing}}, {"_id": 0, "id": 1, "version": 1}
+        ).to_list(len(missing))
+        for doc in docs:
+            versions[doc["id"]] = doc.get("version", 0)
+            if generation == catalog_state["generation"]:
+                product_version_cache.set(doc["id"], versions[doc["id"]])
+    return versions
+
+# ==================== PAGINATION ====================
+
+def encode_cursor(sort_value, doc_id: str) -> str:
+    """Opaque keyset cursor for the (sort key, id) position of the last document on a page"""
+    raw = json.dumps([sort_value, doc_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        decoded = json.loads(base64.urlsafe_b64decode(padded))
+        if not isinstance(decoded, list):
+            raise ValueError("cursor is not a list")
+        sort_value, doc_id = decoded
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # Both halves go straight into a query, so anything but a scalar (e.g. {"$regex": ...}) is rejected
+    if not isinstance(doc_id, str) or not (sort_value is None or isinstance(sort_value, (str, int, float))):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return sort_value, doc_id
+
+def keyset_query(query: dict, sort_field: str, direction: int, cursor: Optional[str]) -> dict:
+    """Restrict query to documents that come after the cursor in (sort_field, id) order"""
+    if not cursor:
+        return query
+    sort_value, doc_id = decode_cursor(cursor)
+    op = "$lt" if direction == DESCENDING else "$gt"
+    after = {"$or": [{sort_field: {op: sort_value}}, {sort_field: sort_value, "id": {op: doc_id}}]}
+    return {"$and": [query, after]} if query else after
+
+def next_page_cursor(docs: list, limit: int, sort_field: str) -> Optional[str]:
+    if not docs or len(docs) < limit:
+        return None
+    return encode_cursor(docs[-1].get(sort_field), docs[-1]["id"])
+
+count_cache = TTLCache(1000, COUNT_CACHE_TTL)
+
+def count_cache_key(collection, query: dict) -> tuple:
+    return (collection.name, json.dumps(query, sort_keys=True, default=str))
+
+async def count_matching(collection, query: dict, include_total: bool = True) -> Optional[int]:
+    """Total for a list endpoint: skipped on request, estimated when unfiltered, briefly cached otherwise"""
+    if not include_total:
+        return None
+    if not query:
+        # Collection metadata, no scan
+        return await collection.estimated_document_count()
+    key = count_cache_key(collection, query)
+    total = count_cache.get(key)
+    if total is None:
+        total = await collection.count_documents(query)
+        count_cache.set(key, total)
+    return total
+
+async def fetch_page(
+    collection,
+    query: dict,
+    projection: dict,
+    sort_field: str,
+    limit: int,
+    skip: int = 0,
+    cursor: Optional[str] = None,
+    direction: int = DESCENDING
+):
+    """Fetch one page in (sort_field, id) order; a cursor seeks by index, skip is the legacy fallback"""
+    cursor_query = keyset_query(query, sort_field, direction, cursor)
+    find = collection.find(cursor_query, projection).sort([(sort_field, direction), ("id", direction)])
+    if not cursor and skip:
+        find = find.skip(skip)
+    docs = await find.limit(limit).to_list(limit)
+    return docs, next_page_cursor(docs, limit, sort_field)
+
+# ==================== HTTP CACHING ====================
+
+def make_etag(*parts) -> str:
+    digest = hashlib.sha1("|".join(str(p) for p in parts).encode()).hexdigest()[:24]
+    return f'W/"{digest}"'
+
+def catalog_etag(request: Request, catalog_version) -> str:
+    """Version-based ETag: the catalog version plus the exact route and query"""
+    return make_etag(catalog_version, request.url.path, sorted(request.query_params.multi_items()))
+
+def body_etag(payload) -> str:
+    """Content-based ETag for responses that have no cheap version to key on"""
+    return make_etag(json.dumps(payload, sort_keys=True, default=str))
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    # Weak comparison, as If-None-Match requires
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+def apply_etag(request: Request, response: Response, etag: str, cache_control: str = None) -> Optional[Response]:
+    """Return a 304 if the client already has etag; otherwise stamp the caching headers on response"""
+    headers = {"ETag": etag, "Cache-Control": cache_control or CATALOG_CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+def json_response(payload: dict, response: Optional[Response] = None) -> ORJSONResponse:
+    """Serialize a plain-JSON payload with orjson directly, skipping FastAPI's jsonable_encoder pass.
+
+    Only for payloads of plain dicts/lists/str/numbers (Mongo docs fetched without _id). Headers
+    already set on the injected response (ETag, Cache-Control) are carried over.
+    """
+    return ORJSONResponse(payload, headers=dict(response.headers) if response is not None else None)
+
 # ==================== AUTH ROUTES ====================
 
 @api_router.post("/auth/register", response_model=TokenResponse)
@@ -489,7 +1361,11 @@ async def register(user_data: UserCreate):
         "wishlist": [],
         "addresses": []
     }
-    await db.users.insert_one(user)
+    try:
+        await db.users.insert_one(user)
+    except DuplicateKeyError:
+        # Lost a race with a concurrent registration for the same email
+        raise HTTPException(status_code=400, detail="Email already registered")
     
     token = create_access_token({"sub": user_id})
     user_response = UserResponse(
@@ -536,8 +1412,7 @@ async def admin_login(login_data: UserLogin):
 
 # ==================== PRODUCT ROUTES ====================
 
-@api_router.get("/products")
-async def get_products(
+def build_product_query(
     sport: Optional[str] = None,
     category: Optional[str] = None,
     color: Optional[str] = None,
@@ -547,9 +1422,9 @@ async def get_products(
     featured: Optional[bool] = None,
     collection: Optional[str] = None,
     search: Optional[str] = None,
-    limit: int = 50,
-    skip: int = 0
-):
+    text_search: bool = True
+) -> dict:
+    """Build the products filter shared by the listing endpoints"""
     query = {}
     if sport: query["sport"] = sport
     if category: query["category"] = category
@@ -559,35 +1434,363 @@ async def get_products(
     if collection: query["collection"] = collection
     if min_price is not None or max_price is not None:
         query["price"] = {}
-        if min_price: query["price"]["$gte"] = min_price
-        if max_price: query["price"]["$lte"] = max_price
+        if min_price is not None: query["price"]["$gte"] = min_price
+        if max_price is not None: query["price"]["$lte"] = max_price
     if search:
-        query["$or"] = [
-            {"name": {"$regex": search, "$options": "i"}},
-            {"description": {"$regex": search, "$options": "i"}}
+        if text_search:
+            query["$text"] = {"$search": search}
+        else:
+            # Fallback while the text index is still building; escape so input is matched literally
+            pattern = re.escape(search)
+            query["$or"] = [
+                {"name": {"$regex": pattern, "$options": "i"}},
+                {"description": {"$regex": pattern, "$options": "i"}}
+            ]
+    return query
+
+def is_missing_text_index(error: OperationFailure) -> bool:
+    return error.code == INDEX_NOT_FOUND_CODE or "text index required" in str(error)
+
+# sort option -> (field, direction); each one is backed by a (field, id) index for keyset paging
+PRODUCT_SORTS = {
+    "newest": ("created_at", DESCENDING),
+    "price_asc": ("price", ASCENDING),
+    "price_desc": ("price", DESCENDING),
+    "rating": ("average_rating", DESCENDING),
+    "popular": ("sold_count", DESCENDING),
+    "name": ("name", ASCENDING),
+}
+
+# What ProductCard renders; only the first image is sent
+PRODUCT_CARD_FIELDS = [
+    "id", "name", "price", "compare_price", "images", "sport", "category", "colors",
+    "featured", "average_rating", "review_count", "created_at"
+]
+
+def resolve_product_sort(sort: Optional[str], search: Optional[str]):
+    """(field, direction) for a sort option; None means relevance order for a search"""
+    if sort is None:
+        return None if search else PRODUCT_SORTS["newest"]
+    if sort not in PRODUCT_SORTS:
+        raise HTTPException(status_code=400, detail=f"Invalid sort. Allowed: {', '.join(PRODUCT_SORTS)}")
+    return PRODUCT_SORTS[sort]
+
+def product_projection(view: str, fields: Optional[str], sort_field: Optional[str]) -> dict:
+    """find() projection for a listing; explicit fields win over the view"""
+    if fields:
+        names = {name.strip() for name in fields.split(",") if name.strip()}
+        if not all(re.fullmatch(r"[a-z_]+", name) for name in names):
+            raise HTTPException(status_code=400, detail="Invalid fields")
+        include = (names - set(PRODUCT_PROJECTION)) | {"id"}
+    elif view == "card":
+        include = set(PRODUCT_CARD_FIELDS)
+    elif view == "full":
+        return dict(PRODUCT_PROJECTION)
+    else:
+        raise HTTPException(status_code=400, detail="Invalid view. Allowed: card, full")
+    if sort_field:
+        # The cursor for the next page is read from the sort field
+        include.add(sort_field)
+    projection = {"_id": 0, **{name: 1 for name in include}}
+    if "images" in include and not fields:
+        projection["images"] = {"$slice": 1}
+    return projection
+
+def listing_cache_key(kind: str, filters: dict, **options) -> tuple:
+    normalized = {**filters, **options}
+    if normalized.get("search"):
+        normalized["search"] = " ".join(normalized["search"].lower().split())
+    return (kind, tuple(sorted(normalized.items())))
+
+async def find_products_page(
+    query: dict,
+    skip: int,
+    limit: int,
+    cursor: Optional[str] = None,
+    include_total: bool = True,
+    sort_spec: Optional[tuple] = PRODUCT_SORTS["newest"],
+    projection: Optional[dict] = None
+):
+    """Fetch one page of products, the match count and the next cursor.
+
+    Without a sort_spec a text search comes back ranked by relevance and pages with skip.
+    """
+    projection = projection or PRODUCT_PROJECTION
+    if sort_spec is None:
+        find = db.products.find(query, {**projection, "score": {"$meta": "textScore"}})
+        find = find.sort([("score", {"$meta": "textScore"})])
+        products = await find.skip(skip).limit(limit).to_list(limit)
+        for product in products:
+            product.pop("score", None)
+        next_cursor = None
+    else:
+        sort_field, direction = sort_spec
+        products, next_cursor = await fetch_page(
+            db.products, query, projection, sort_field, limit, skip=skip, cursor=cursor, direction=direction
+        )
+    total = await count_matching(db.products, query, include_total)
+    return products, total, next_cursor
+
+@api_router.get("/products")
+async def get_products(
+    request: Request,
+    response: Response,
+    sport: Optional[str] = None,
+    category: Optional[str] = None,
+    color: Optional[str] = None,
+    size: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    featured: Optional[bool] = None,
+    collection: Optional[str] = None,
+    search: Optional[str] = None,
+    limit: int = 50,
+    skip: int = 0,
+    cursor: Optional[str] = None,
+    include_total: bool = True,
+    sort: Optional[str] = None,
+    view: str = "full",
+    fields: Optional[str] = None
+):
+    filters = dict(
+        sport=sport, category=category, color=color, size=size, min_price=min_price,
+        max_price=max_price, featured=featured, collection=collection, search=search
+    )
+    sort_spec = resolve_product_sort(sort, search)
+    projection = product_projection(view, fields, sort_spec[0] if sort_spec else None)
+    
+    not_modified = apply_etag(request, response, catalog_etag(request, await listing_version()))
+    if not_modified:
+        return not_modified
+    cache_key = listing_cache_key(
+        "products", filters, limit=limit, skip=skip, cursor=cursor, include_total=include_total,
+        sort=sort, view=view, fields=fields
+    )
+    cached = product_list_cache.get(cache_key)
+    if cached is not None:
+        return json_response(cached, response)
+    
+    generation = catalog_state["generation"]
+    try:
+        products, total, next_cursor = await find_products_page(
+            build_product_query(**filters), skip, limit, cursor, include_total, sort_spec, projection
+        )
+    except OperationFailure as e:
+        if not search or not is_missing_text_index(e):
+            raise
+        logger.warning("Text index missing, falling back to regex product search")
+        query = build_product_query(**filters, text_search=False)
+        products, total, next_cursor = await find_products_page(
+            query, skip, limit, cursor, include_total, sort_spec or PRODUCT_SORTS["newest"], projection
+        )
+    result = {"products": products, "total": total, "next_cursor": next_cursor}
+    if generation == catalog_state["generation"]:
+        product_list_cache.set(cache_key, result)
+    return json_response(result, response)
+
+# Facet name -> (build_product_query filter it ignores, product field, whether the field is an array)
+BROWSE_FACETS = {
+    "sport": ("sport", "sport", False),
+    "category": ("category", "category", False),
+    "collection": ("collection", "collection", False),
+    "color": ("color", "colors", True),
+    "size": ("size", "sizes", True),
+}
+
+def build_browse_pipeline(filters: dict, text_search: bool = True) -> list:
+    """One $facet aggregation with the disjunctive facet counts for the shop page.
+
+    Each facet ignores its own filter so the shop page can still offer the other values. The
+    page of products itself is fetched separately with an index-backed find, since nothing
+    inside $facet can use an index.
+    """
+    search = filters.get("search")
+    pipeline = []
+    if search and text_search:
+        # $text has to be the first stage, so the search applies to every facet
+        pipeline.append({"$match": {"$text": {"$search": search}}})
+
+    def match(**overrides):
+        query = build_product_query(**{**filters, **overrides}, text_search=text_search)
+        query.pop("$text", None)
+        return {"$match": query}
+
+    facets = {
+        "price": [
+            match(min_price=None, max_price=None),
+            {"$bucket": {
+                "groupBy": "$price",
+                "boundaries": PRICE_BUCKET_BOUNDARIES,
+                "default": "over",
+                "output": {"count": {"$sum": 1}}
+            }}
+        ],
+    }
+    for name, (filter_name, field, is_array) in BROWSE_FACETS.items():
+        stages = [match(**{filter_name: None})]
+        if is_array:
+            stages.append({"$unwind": f"${field}"})
+        stages += [
+            {"$match": {field: {"$nin": [None, ""]}}},
+            {"$group": {"_id": f"${field}", "count": {"$sum": 1}}},
+            {"$sort": {"_id": 1}}
         ]
+        facets[name] = stages
+    pipeline.append({"$facet": facets})
+    return pipeline
+
+def format_price_buckets(buckets: list) -> list:
+    counts = {b["_id"]: b["count"] for b in buckets}
+    formatted = []
+    for low, high in zip(PRICE_BUCKET_BOUNDARIES, PRICE_BUCKET_BOUNDARIES[1:]):
+        formatted.append({"min": low, "max": high, "count": counts.get(low, 0)})
+    formatted.append({"min": PRICE_BUCKET_BOUNDARIES[-1], "max": None, "count": counts.get("over", 0)})
+    return formatted
+
+@api_router.get("/products/browse")
+async def browse_products(
+    request: Request,
+    response: Response,
+    sport: Optional[str] = None,
+    category: Optional[str] = None,
+    color: Optional[str] = None,
+    size: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    featured: Optional[bool] = None,
+    collection: Optional[str] = None,
+    search: Optional[str] = None,
+    limit: int = 50,
+    skip: int = 0,
+    cursor: Optional[str] = None,
+    include_total: bool = True,
+    sort: Optional[str] = None,
+    view: str = "card",
+    fields: Optional[str] = None
+):
+    """Shop page in one call: a page of products, the match total and facet counts.
+
+    The page (keyset or skip over the sort index) and the facet aggregation run concurrently.
+    """
+    filters = dict(
+        sport=sport, category=category, color=color, size=size, min_price=min_price,
+        max_price=max_price, featured=featured, collection=collection, search=search
+    )
+    sort_spec = resolve_product_sort(sort, search)
+    projection = product_projection(view, fields, sort_spec[0] if sort_spec else None)
+    
+    not_modified = apply_etag(request, response, catalog_etag(request, await listing_version()))
+    if not_modified:
+        return not_modified
+    cache_key = listing_cache_key(
+        "browse", filters, limit=limit, skip=skip, cursor=cursor, include_total=include_total,
+        sort=sort, view=view, fields=fields
+    )
+    cached = product_list_cache.get(cache_key)
+    if cached is not None:
+        return json_response(cached, response)
+    
+    async def fetch(text_search: bool, page_sort: Optional[tuple]):
+        return await asyncio.gather(
+            find_products_page(
+                build_product_query(**filters, text_search=text_search),
+                skip, limit, cursor, include_total, page_sort, projection
+            ),
+            db.products.aggregate(build_browse_pipeline(filters, text_search)).to_list(1)
+        )
+    
+    generation = catalog_state["generation"]
+    try:
+        page, facet_result = await fetch(True, sort_spec)
+    except OperationFailure as e:
+        if not search or not is_missing_text_index(e):
+            raise
+        logger.warning("Text index missing, falling back to regex product search")
+        page, facet_result = await fetch(False, sort_spec or PRODUCT_SORTS["newest"])
     
-    products = await db.products.find(query, {"_id": 0}).skip(skip).limit(limit).to_list(limit)
-    total = await db.products.count_documents(query)
-    return {"products": products, "total": total}
+    products, total, next_cursor = page
+    data = facet_result[0] if facet_result else {}
+    result = {
+        "products": products,
+        "total": total,
+        "next_cursor": next_cursor,
+        "facets": {
+            **{
+                name: [{"value": f["_id"], "count": f["count"]} for f in data.get(name, [])]
+                for name in BROWSE_FACETS
+            },
+            "price": format_price_buckets(data.get("price", []))
+        }
+    }
+    if generation == catalog_state["generation"]:
+        product_list_cache.set(cache_key, result)
+    return json_response(result, response)
+
+async def resolve_product_batch(product_ids: List[str]) -> dict:
+    """Products in request order (duplicates dropped) plus the ids that didn't resolve"""
+    ids = list(dict.fromkeys(pid for pid in product_ids if pid))
+    if len(ids) > PRODUCT_BATCH_LIMIT:
+        raise HTTPException(status_code=400, detail=f"At most {PRODUCT_BATCH_LIMIT} products per batch")
+    products = await get_products_by_ids(ids)
+    return {
+        "products": [products[pid] for pid in ids if pid in products],
+        "missing": [pid for pid in ids if pid not in products]
+    }
+
+@api_router.get("/products/batch")
+async def get_products_batch(ids: str):
+    """Comma-separated ids, e.g. /products/batch?ids=a,b,c"""
+    return await resolve_product_batch([pid.strip() for pid in ids.split(",")])
+
+@api_router.post("/products/batch")
+async def post_products_batch(data: ProductBatchRequest):
+    return await resolve_product_batch(data.ids)
 
 @api_router.get("/products/{product_id}")
-async def get_product(product_id: str):
-    product = await db.products.find_one({"id": product_id}, {"_id": 0})
+async def get_product(product_id: str, request: Request, response: Response):
+    product = await get_cached_product(product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
+    # Stock and rating change without touching updated_at, so they are part of the version
+    etag = make_etag(
+        product_id, product.get("updated_at"), product.get("stock"),
+        product.get("average_rating"), product.get("review_count")
+    )
+    not_modified = apply_etag(request, response, etag)
+    if not_modified:
+        return not_modified
     return product
 
+@api_router.get("/products/{product_id}/stock")
+async def get_product_stock(product_id: str):
+    """Available stock per size/colour; sharded variants are summed across their counters"""
+    product = await get_cached_product(product_id)
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    if not tracked_variants(product):
+        return {"product_id": product_id, "stock": product.get("stock", 0), "variants": []}
+    return {
+        "product_id": product_id,
+        "stock": product.get("stock", 0),
+        "shared_stock": product.get("shared_stock", 0),
+        "variants": await variant_stock_levels([product_id])
+    }
+
 @api_router.post("/admin/products")
 async def create_product(product: ProductCreate, admin: dict = Depends(get_admin_user)):
     product_id = str(uuid.uuid4())
     product_data = {
         "id": product_id,
         **product.model_dump(),
+        "average_rating": 0,
+        "review_count": 0,
+        "sold_count": 0,
+        "version": 1,
         "created_at": datetime.now(timezone.utc).isoformat(),
         "updated_at": datetime.now(timezone.utc).isoformat()
     }
     await db.products.insert_one(product_data)
+    await invalidate_catalog([product_id])
     return {"id": product_id, "message": "Product created successfully"}
 
 @api_router.put("/admin/products/{product_id}")
@@ -595,9 +1798,11 @@ async def update_product(product_id: str, product: ProductUpdate, admin: dict =
     update_data = {k: v for k, v in product.model_dump().items() if v is not None}
     update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
     
-    result = await db.products.update_one({"id": product_id}, {"$set": update_data})
+    # version tells carts holding a snapshot of this product to refresh it
+    result = await db.products.update_one({"id": product_id}, {"$set": update_data, "$inc": {"version": 1}})
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
+    await invalidate_catalog([product_id])
     return {"message": "Product updated successfully"}
 
 @api_router.delete("/admin/products/{product_id}")
@@ -605,6 +1810,8 @@ async def delete_product(product_id: str, admin: dict = Depends(get_admin_user))
     result = await db.products.delete_one({"id": product_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
+    await db.inventory.delete_many({"product_id": product_id})
+    await invalidate_catalog([product_id])
     return {"message": "Product deleted successfully"}
 
 @api_router.post("/admin/upload-image")
@@ -642,90 +1849,205 @@ async def upload_image(
 
 # ==================== CART ROUTES ====================
 
-@api_router.get("/cart")
-async def get_cart(current_user: dict = Depends(get_current_user)):
-    cart = await db.carts.find_one({"user_id": current_user["id"]}, {"_id": 0})
+def cart_snapshot(product: dict) -> dict:
+    """Product fields copied onto a cart line so the cart renders without loading the product"""
+    images = product.get("images") or []
+    return {
+        "product_name": product["name"],
+        "unit_price": product["price"],
+        "product_image": images[0] if images else None,
+        "product_version": product.get("version", 0)
+    }
+
+async def refresh_cart_snapshots(user_id: str, snapshots: Dict[str, dict]):
+    """Rewrite stale snapshots on every line of each product in one bulk write"""
+    await db.carts.bulk_write([
+        UpdateOne(
+            {"user_id": user_id},
+            {"$set": {f"items.$[line].{field}": value for field, value in snapshot.items()}},
+            array_filters=[{"line.product_id": product_id}]
+        )
+        for product_id, snapshot in snapshots.items()
+    ], ordered=False)
+
+async def hydrate_cart(cart: Optional[dict]) -> dict:
+    """Price cart lines from their product snapshots, checked against the product version map.
+
+    Only products whose version moved (or lines saved before snapshots existed) are loaded in
+    full, and their snapshots are written back. Lines whose product no longer exists are
+    reported under unavailable_items instead of being dropped silently.
+    """
     if not cart:
-        return {"items": [], "total": 0}
+        return {"items": [], "total": 0, "unavailable_items": []}
+    
+    lines = cart.get("items", [])
+    versions = await get_product_versions([item["product_id"] for item in lines])
+    stale_ids = [
+        item["product_id"] for item in lines
+        if item["product_id"] in versions and item.get("product_version") != versions[item["product_id"]]
+    ]
+    snapshots = {}
+    if stale_ids:
+        products = await get_products_by_ids(stale_ids)
+        snapshots = {product_id: cart_snapshot(product) for product_id, product in products.items()}
+        if snapshots:
+            await refresh_cart_snapshots(cart["user_id"], snapshots)
     
-    # Populate product details
     items_with_details = []
+    unavailable_items = []
     total = 0
-    for item in cart.get("items", []):
-        product = await db.products.find_one({"id": item["product_id"]}, {"_id": 0})
-        if product:
-            item_total = product["price"] * item["quantity"]
-            total += item_total
-            items_with_details.append({
-                **item,
-                "product": product,
-                "item_total": item_total
-            })
-    
-    return {"items": items_with_details, "total": total}
-
-@api_router.post("/cart/add")
-async def add_to_cart(item: AddToCart, current_user: dict = Depends(get_current_user)):
-    product = await db.products.find_one({"id": item.product_id}, {"_id": 0})
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
+    for item in lines:
+        product_id = item["product_id"]
+        if product_id not in versions or (product_id in stale_ids and product_id not in snapshots):
+            unavailable_items.append({**item, "reason": "product_unavailable"})
+            continue
+        line = {**item, **snapshots.get(product_id, {})}
+        item_total = line["unit_price"] * line["quantity"]
+        total += item_total
+        items_with_details.append({
+            **line,
+            "product": {
+                "id": product_id,
+                "name": line["product_name"],
+                "price": line["unit_price"],
+                "images": [line["product_image"]] if line["product_image"] else []
+            },
+            "item_total": item_total
+        })
     
-    cart = await db.carts.find_one({"user_id": current_user["id"]})
-    cart_item = {
-        "product_id": item.product_id,
-        "quantity": item.quantity,
+    return {"items": items_with_details, "total": total, "unavailable_items": unavailable_items}
+
+@api_router.get("/cart")
+async def get_cart(current_user: dict = Depends(get_current_user)):
+    cart = await db.carts.find_one({"user_id": current_user["id"]}, {"_id": 0})
+    return await hydrate_cart(cart)
+
+CART_SNAPSHOT_FIELDS = ("product_name", "unit_price", "product_image", "product_version")
+
+def cart_line_filter(product_id: str, size: str, color: Optional[str]) -> dict:
+    """Query filter for one cart line; a null color also matches lines stored without one"""
+    return {"product_id": product_id, "size": size, "color": color}
+
+def cart_line_matches(product_id: str, size: str, color: Optional[str]) -> dict:
+    """Aggregation expression, true for the $$line with this product/size/color.
+
+    Values are wrapped in $literal so ids that start with "$" aren't read as field paths.
+    """
+    return {"$and": [
+        {"$eq": ["$$line.product_id", {"$literal": product_id}]},
+        {"$eq": ["$$line.size", {"$literal": size}]},
+        {"$eq": [{"$ifNull": ["$$line.color", None]}, {"$literal": color}]}
+    ]}
+
+def cart_line_stage(cart_item: dict, increment: bool = True) -> dict:
+    """$set stage that adds to (or, without increment, replaces) the matching line's quantity,
+    appending the line when the cart doesn't have it yet. The line's snapshot is refreshed too."""
+    items = {"$ifNull": ["$items", []]}
+    matches = cart_line_matches(cart_item["product_id"], cart_item["size"], cart_item["color"])
+    quantity = {"$add": ["$$line.quantity", cart_item["quantity"]]} if increment else cart_item["quantity"]
+    snapshot = {field: {"$literal": cart_item[field]} for field in CART_SNAPSHOT_FIELDS if field in cart_item}
+    return {"$set": {
+        "items": {"$cond": [
+            {"$in": [True, {"$map": {"input": items, "as": "line", "in": matches}}]},
+            {"$map": {"input": items, "as": "line", "in": {"$cond": [
+                matches,
+                {"$mergeObjects": ["$$line", {"quantity": quantity, **snapshot}]},
+                "$$line"
+            ]}}},
+            {"$concatArrays": [items, [{"$literal": cart_item}]]}
+        ]}
+    }}
+
+def cart_remove_stage(product_id: str, size: str, color: Optional[str]) -> dict:
+    items = {"$ifNull": ["$items", []]}
+    matches = cart_line_matches(product_id, size, color)
+    return {"$set": {"items": {"$filter": {"input": items, "as": "line", "cond": {"$not": [matches]}}}}}
+
+def cart_timestamps_stage() -> dict:
+    now = datetime.now(timezone.utc).isoformat()
+    return {"$set": {"created_at": {"$ifNull": ["$created_at", now]}, "updated_at": now}}
+
+def cart_add_pipeline(cart_item: dict) -> list:
+    """Pipeline update that bumps the matching line's quantity or appends the line, in one atomic write"""
+    return [cart_line_stage(cart_item), cart_timestamps_stage()]
+
+async def upsert_cart(user_id: str, update, return_cart: bool = False):
+    """Apply update to the user's cart, creating it if needed; optionally return the updated cart"""
+    async def apply(upsert: bool):
+        if return_cart:
+            return await db.carts.find_one_and_update(
+                {"user_id": user_id}, update, projection={"_id": 0},
+                upsert=upsert, return_document=ReturnDocument.AFTER
+            )
+        await db.carts.update_one({"user_id": user_id}, update, upsert=upsert)
+    
+    try:
+        return await apply(upsert=True)
+    except DuplicateKeyError:
+        # Another request created the cart between our match and insert; it exists now
+        return await apply(upsert=False)
+
+@api_router.post("/cart/add")
+async def add_to_cart(item: AddToCart, current_user: dict = Depends(get_current_user)):
+    product = await get_cached_product(item.product_id)
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    
+    cart_item = {
+        "product_id": item.product_id,
+        "quantity": item.quantity,
         "size": item.size,
-        "color": item.color
+        "color": item.color,
+        **cart_snapshot(product)
     }
-    
-    if cart:
-        # Check if item exists
-        existing_idx = None
-        for idx, ci in enumerate(cart.get("items", [])):
-            if ci["product_id"] == item.product_id and ci["size"] == item.size and ci["color"] == item.color:
-                existing_idx = idx
-                break
-        
-        if existing_idx is not None:
-            await db.carts.update_one(
-                {"user_id": current_user["id"]},
-                {"$inc": {f"items.{existing_idx}.quantity": item.quantity}}
-            )
-        else:
-            await db.carts.update_one(
-                {"user_id": current_user["id"]},
-                {"$push": {"items": cart_item}}
-            )
-    else:
-        await db.carts.insert_one({
-            "user_id": current_user["id"],
-            "items": [cart_item],
-            "created_at": datetime.now(timezone.utc).isoformat()
-        })
+    await upsert_cart(current_user["id"], cart_add_pipeline(cart_item))
     
     return {"message": "Item added to cart"}
 
 @api_router.put("/cart/update")
 async def update_cart_item(item: CartItem, current_user: dict = Depends(get_current_user)):
-    cart = await db.carts.find_one({"user_id": current_user["id"]})
-    if not cart:
-        raise HTTPException(status_code=404, detail="Cart not found")
-    
-    for idx, ci in enumerate(cart.get("items", [])):
-        if ci["product_id"] == item.product_id and ci["size"] == item.size and ci["color"] == item.color:
-            if item.quantity <= 0:
-                await db.carts.update_one(
-                    {"user_id": current_user["id"]},
-                    {"$pull": {"items": {"product_id": item.product_id, "size": item.size, "color": item.color}}}
-                )
-            else:
-                await db.carts.update_one(
-                    {"user_id": current_user["id"]},
-                    {"$set": {f"items.{idx}.quantity": item.quantity}}
-                )
-            return {"message": "Cart updated"}
+    line = cart_line_filter(item.product_id, item.size, item.color)
+    cart_filter = {"user_id": current_user["id"], "items": {"$elemMatch": line}}
+    now = datetime.now(timezone.utc).isoformat()
+    if item.quantity <= 0:
+        result = await db.carts.update_one(cart_filter, {"$pull": {"items": line}, "$set": {"updated_at": now}})
+    else:
+        result = await db.carts.update_one(
+            cart_filter, {"$set": {"items.$.quantity": item.quantity, "updated_at": now}}
+        )
     
-    raise HTTPException(status_code=404, detail="Item not found in cart")
+    if result.matched_count == 0:
+        if not await db.carts.count_documents({"user_id": current_user["id"]}, limit=1):
+            raise HTTPException(status_code=404, detail="Cart not found")
+        raise HTTPException(status_code=404, detail="Item not found in cart")
+    return {"message": "Cart updated"}
+
+@api_router.post("/cart/batch")
+async def cart_batch(batch: CartBatch, current_user: dict = Depends(get_current_user)):
+    """Apply add/set/remove operations in order as one atomic cart write and return the hydrated cart.
+
+    Operations on products that no longer exist are skipped and listed under rejected.
+    """
+    products = await get_products_by_ids([op.product_id for op in batch.operations if op.op != "remove"])
+    stages = []
+    rejected = []
+    for op in batch.operations:
+        if op.op != "remove" and op.product_id not in products:
+            rejected.append({**op.model_dump(), "reason": "product_not_found"})
+        elif op.op == "remove" or (op.op == "set" and op.quantity <= 0):
+            stages.append(cart_remove_stage(op.product_id, op.size, op.color))
+        elif op.quantity > 0:
+            cart_item = {
+                "product_id": op.product_id, "quantity": op.quantity, "size": op.size, "color": op.color,
+                **cart_snapshot(products[op.product_id])
+            }
+            stages.append(cart_line_stage(cart_item, increment=op.op == "add"))
+    
+    if stages:
+        cart = await upsert_cart(current_user["id"], stages + [cart_timestamps_stage()], return_cart=True)
+    else:
+        cart = await db.carts.find_one({"user_id": current_user["id"]}, {"_id": 0})
+    return {**await hydrate_cart(cart), "rejected": rejected}
 
 @api_router.delete("/cart/clear")
 async def clear_cart(current_user: dict = Depends(get_current_user)):
@@ -736,13 +2058,13 @@ async def clear_cart(current_user: dict = Depends(get_current_user)):
 
 @api_router.get("/wishlist")
 async def get_wishlist(current_user: dict = Depends(get_current_user)):
-    wishlist_ids = current_user.get("wishlist", [])
-    products = await db.products.find({"id": {"$in": wishlist_ids}}, {"_id": 0}).to_list(100)
-    return {"items": products}
+    wishlist_ids = current_user.get("wishlist", [])[:100]
+    products = await get_products_by_ids(wishlist_ids)
+    return {"items": [products[pid] for pid in wishlist_ids if pid in products]}
 
 @api_router.post("/wishlist/{product_id}")
 async def add_to_wishlist(product_id: str, current_user: dict = Depends(get_current_user)):
-    product = await db.products.find_one({"id": product_id})
+    product = await get_cached_product(product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
@@ -760,15 +2082,651 @@ async def remove_from_wishlist(product_id: str, current_user: dict = Depends(get
     )
     return {"message": "Removed from wishlist"}
 
+# ==================== INVENTORY ====================
+
+# Stock is kept on the product unless the product lists inventory_variants; then each listed
+# (size, color) has its stock in db.inventory, split across `shards` counter documents so
+# concurrent orders for one hot variant update different documents. Sizes/colours that are not
+# listed keep selling from the product's shared_stock. product.stock stays the total (tracked
+# variants plus shared_stock), for display and filtering.
+
+def tracked_variants(product: dict) -> Dict[tuple, int]:
+    """(size, color) -> shard count for the variants with their own inventory"""
+    return {(v["size"], v.get("color")): v.get("shards", 1) for v in product.get("inventory_variants") or []}
+
+def variant_filter(product_id: str, size: str, color: Optional[str]) -> dict:
+    return {"product_id": product_id, "size": size, "color": color}
+
+def product_stock_field(product: dict) -> str:
+    """Product field that product-level orders draw from"""
+    return "shared_stock" if tracked_variants(product) else "stock"
+
+def product_stock_delta(product: dict, delta: int) -> dict:
+    """$inc for moving delta units in (positive) or out of product-level stock"""
+    change = {"stock": delta, "sold_count": -delta}
+    if tracked_variants(product):
+        change["shared_stock"] = delta
+    return change
+
+def split_order_quantities(items, products: Dict[str, dict]):
+    """Sum ordered quantities per product (product-level stock) or per variant (tracked variants)"""
+    product_quantities = {}
+    variant_quantities = {}
+    for item in items:
+        product_id = item["product_id"]
+        if (item["size"], item.get("color")) in tracked_variants(products[product_id]):
+            key = (product_id, item["size"], item.get("color"))
+            variant_quantities[key] = variant_quantities.get(key, 0) + item["quantity"]
+        else:
+            product_quantities[product_id] = product_quantities.get(product_id, 0) + item["quantity"]
+    return product_quantities, variant_quantities
+
+async def reserve_product_stock(order_id: str, quantities: Dict[str, int], products: Dict[str, dict]) -> bool:
+    """Decrement product-level stock with one conditional bulk write, tagging each product with the order"""
+    if not quantities:
+        return True
+    marker = f"reservations.{order_id}"
+    result = await db.products.bulk_write([
+        UpdateOne(
+            {"id": product_id, product_stock_field(products[product_id]): {"$gte": quantity}, marker: {"$exists": False}},
+            {"$inc": product_stock_delta(products[product_id], -quantity), "$set": {marker: quantity}}
+        )
+        for product_id, quantity in quantities.items()
+    ], ordered=False)
+    return result.modified_count == len(quantities)
+
+async def reserve_variant_stock(order_id: str, quantities: Dict[tuple, int], products: Dict[str, dict]) -> bool:
+    """Take each variant's quantity from one random shard in a single bulk write.
+
+    Variants whose chosen shard was short fall back to draining their shards largest first.
+    """
+    if not quantities:
+        return True
+    marker = f"reservations.{order_id}"
+    shards = {}
+    for key in quantities:
+        product_id, size, color = key
+        if (size, color) not in tracked_variants(products[product_id]):
+            return False
+        shards[key] = tracked_variants(products[product_id])[(size, color)]
+    
+    result = await db.inventory.bulk_write([
+        UpdateOne(
+            {**variant_filter(*key), "shard": random.randrange(shards[key]),
+             "stock": {"$gte": quantity}, marker: {"$exists": False}},
+            {"$inc": {"stock": -quantity}, "$set": {marker: quantity}}
+        )
+        for key, quantity in quantities.items()
+    ], ordered=False)
+    if result.modified_count == len(quantities):
+        return True
+    
+    reserved = await db.inventory.find(
+        {"product_id": {"$in": list({key[0] for key in quantities})}, marker: {"$exists": True}},
+        {"_id": 0, "product_id": 1, "size": 1, "color": 1}
+    ).to_list(None)
+    reserved_keys = {(doc["product_id"], doc["size"], doc.get("color")) for doc in reserved}
+    for key, quantity in quantities.items():
+        if key in reserved_keys:
+            continue
+        remaining = quantity
+        candidates = await db.inventory.find(
+            {**variant_filter(*key), "stock": {"$gt": 0}}, {"_id": 1, "stock": 1}
+        ).sort("stock", DESCENDING).to_list(MAX_INVENTORY_SHARDS)
+        for shard in candidates:
+            take = min(remaining, shard["stock"])
+            taken = await db.inventory.update_one(
+                {"_id": shard["_id"], "stock": {"$gte": take}, marker: {"$exists": False}},
+                {"$inc": {"stock": -take}, "$set": {marker: take}}
+            )
+            remaining -= take if taken.modified_count else 0
+            if remaining == 0:
+                break
+        if remaining > 0:
+            return False
+    return True
+
+async def reserve_stock(order_id: str, items, products: Dict[str, dict]) -> bool:
+    """Reserve stock for every order line, all or nothing.
+
+    Each counter is only decremented while it still has enough stock and is tagged with the
+    order, so a partial failure is rolled back exactly. Returns False (with nothing reserved)
+    when any line ran out.
+    """
+    product_quantities, variant_quantities = split_order_quantities(items, products)
+    reserved = await asyncio.gather(
+        reserve_product_stock(order_id, product_quantities, products),
+        reserve_variant_stock(order_id, variant_quantities, products)
+    )
+    if all(reserved):
+        return True
+    await release_stock(order_id, items, products)
+    return False
+
+async def release_stock(order_id: str, items, products: Dict[str, dict]):
+    """Give back whatever reserve_stock tagged with this order; untagged counters are left alone"""
+    marker = f"reservations.{order_id}"
+    product_ids = list({item["product_id"] for item in items})
+    product_quantities, _ = split_order_quantities(items, products)
+    if product_quantities:
+        await db.products.bulk_write([
+            UpdateOne(
+                {"id": product_id, marker: {"$exists": True}},
+                {"$inc": product_stock_delta(products[product_id], quantity), "$unset": {marker: ""}}
+            )
+            for product_id, quantity in product_quantities.items()
+        ], ordered=False)
+    await db.inventory.update_many(
+        {"product_id": {"$in": product_ids}, marker: {"$exists": True}},
+        [{"$set": {"stock": {"$add": ["$stock", f"${marker}"]}}}, {"$project": {marker: 0}}]
+    )
+
+async def commit_stock(order_id: str, items, products: Dict[str, dict]):
+    """Drop the reservation tags once the order is stored, and roll variant sales up to the product"""
+    marker = f"reservations.{order_id}"
+    product_ids = list({item["product_id"] for item in items})
+    _, variant_quantities = split_order_quantities(items, products)
+    rollup = {}
+    for (product_id, _size, _color), quantity in variant_quantities.items():
+        rollup[product_id] = rollup.get(product_id, 0) + quantity
+    await asyncio.gather(
+        db.products.update_many({"id": {"$in": product_ids}}, {"$unset": {marker: ""}}),
+        db.inventory.update_many({"product_id": {"$in": product_ids}, marker: {"$exists": True}}, {"$unset": {marker: ""}})
+    )
+    if rollup:
+        await db.products.bulk_write([
+            UpdateOne({"id": product_id}, {"$inc": {"stock": -quantity, "sold_count": quantity}})
+            for product_id, quantity in rollup.items()
+        ], ordered=False)
+
+async def restock_order_items(items):
+    """Return the stock of cancelled order lines in one bulk write per collection.
+
+    Tracked variants get their units back on shard 0; products deleted since are skipped.
+    """
+    products = await get_products_by_ids(list({item["product_id"] for item in items}))
+    items = [item for item in items if item["product_id"] in products]
+    product_quantities, variant_quantities = split_order_quantities(items, products)
+    changes = {
+        product_id: product_stock_delta(products[product_id], quantity)
+        for product_id, quantity in product_quantities.items()
+    }
+    for (product_id, _size, _color), quantity in variant_quantities.items():
+        change = changes.setdefault(product_id, {"stock": 0, "sold_count": 0})
+        change["stock"] += quantity
+        change["sold_count"] -= quantity
+    if variant_quantities:
+        await db.inventory.bulk_write([
+            UpdateOne({**variant_filter(*key), "shard": 0}, {"$inc": {"stock": quantity}}, upsert=True)
+            for key, quantity in variant_quantities.items()
+        ], ordered=False)
+    if changes:
+        await db.products.bulk_write([
+            UpdateOne({"id": product_id}, {"$inc": change})
+            for product_id, change in changes.items()
+        ], ordered=False)
+        await invalidate_catalog(list(changes), broadcast=False)
+    return sum(product_quantities.values()) + sum(variant_quantities.values())
+
+async def variant_stock_levels(product_ids: List[str]) -> List[dict]:
+    """Per-variant stock summed across shards"""
+    return await db.inventory.aggregate([
+        {"$match": {"product_id": {"$in": product_ids}}},
+        {"$group": {
+            "_id": {"product_id": "$product_id", "size": "$size", "color": "$color"},
+            "stock": {"$sum": "$stock"}
+        }},
+        {"$project": {"_id": 0, "product_id": "$_id.product_id", "size": "$_id.size", "color": "$_id.color", "stock": 1}},
+        {"$sort": {"product_id": 1, "size": 1, "color": 1}}
+    ]).to_list(None)
+
+async def short_stock_names(items, products: Dict[str, dict]) -> List[str]:
+    """Names of ordered products that don't have enough stock left, for the checkout error"""
+    product_quantities, variant_quantities = split_order_quantities(items, products)
+    short = set()
+    if product_quantities:
+        levels = await db.products.find(
+            {"id": {"$in": list(product_quantities)}}, {"_id": 0, "id": 1, "stock": 1, "shared_stock": 1}
+        ).to_list(len(product_quantities))
+        short |= {
+            p["id"] for p in levels
+            if p.get(product_stock_field(products[p["id"]]), 0) < product_quantities[p["id"]]
+        }
+    if variant_quantities:
+        levels = await variant_stock_levels(list({key[0] for key in variant_quantities}))
+        available = {(v["product_id"], v["size"], v.get("color")): v["stock"] for v in levels}
+        short |= {key[0] for key, quantity in variant_quantities.items() if available.get(key, 0) < quantity}
+    return sorted(products[product_id]["name"] for product_id in short)
+
+# ==================== IDEMPOTENCY ====================
+
+# Set by run_idempotent while its handler runs: stores a response for the key being handled
+idempotent_store: ContextVar = ContextVar("idempotent_store", default=None)
+
+async def store_idempotent_result(body):
+    """Store body as the replayed response before the handler returns.
+
+    For handlers whose side effect is done before the rest of their work: from here on a
+    failure or cancellation no longer frees the key, so a retry replays body rather than
+    repeating the side effect. Does nothing outside run_idempotent.
+    """
+    store = idempotent_store.get()
+    if store is not None:
+        await store(200, body)
+
+async def run_idempotent(request: Request, scope: str, user_id: str, payload: dict, handler, keep=None):
+    """Run handler once per Idempotency-Key header and replay its stored result on retries.
+
+    Requests without the header run normally. The key is claimed with a unique insert before the
+    handler runs, so a concurrent retry gets 409 instead of a second execution, and reusing a
+    key with a different body is rejected with 422. Client errors are stored and replayed like
+    results; server errors, cancellation and results keep() rejects free the key so a retry runs
+    again, unless the handler already stored its result with store_idempotent_result. The claim
+    is a lease (locked_until): a key left processing by a killed worker is taken over by the
+    first retry after IDEMPOTENCY_LOCK_SECONDS.
+    """
+    header = request.headers.get("Idempotency-Key")
+    if not header:
+        return await handler()
+    if len(header) > 255:
+        raise HTTPException(status_code=400, detail="Idempotency-Key is too long")
+    
+    key = f"{scope}:{user_id}:{header}"
+    fingerprint = hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+    lock = str(uuid.uuid4())
+    now = datetime.now(timezone.utc)
+    locked_until = now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)
+    try:
+        await db.idempotency.insert_one({
+            "key": key,
+            "fingerprint": fingerprint,
+            "state": "processing",
+            "lock": lock,
+            "locked_until": locked_until,
+            "created_at": now.isoformat(),
+            "expires_at": now + timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+        })
+    except DuplicateKeyError:
+        # Take over a processing claim whose lease ran out; the owner can no longer store or free it
+        reclaimed = await db.idempotency.find_one_and_update(
+            {"key": key, "fingerprint": fingerprint, "state": "processing", "locked_until": {"$lt": now}},
+            {"$set": {"lock": lock, "locked_until": locked_until}}
+        )
+        if reclaimed is None:
+            record = await db.idempotency.find_one({"key": key}, {"_id": 0})
+            if record is None:
+                # Expired between our insert and read; let the client retry
+                raise HTTPException(status_code=409, detail="Idempotency-Key conflict, please retry")
+            if record["fingerprint"] != fingerprint:
+                raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+            if record["state"] != "completed":
+                raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+            return ORJSONResponse(
+                record["body"], status_code=record["status_code"], headers={"Idempotent-Replayed": "true"}
+            )
+    
+    owned = {"key": key, "lock": lock}
+    # Freeing leaves a result stored early by the handler in place
+    unsettled = {**owned, "state": "processing"}
+    
+    stored = []
+    
+    async def store(status_code: int, body):
+        await db.idempotency.update_one(
+            owned,
+            {"$set": {"state": "completed", "status_code": status_code, "body": body}, "$unset": {"locked_until": ""}}
+        )
+        stored.append(status_code)
+    
+    token = idempotent_store.set(store)
+    try:
+        result = await handler()
+    except HTTPException as e:
+        if e.status_code < 500:
+            await store(e.status_code, {"detail": e.detail})
+        else:
+            await db.idempotency.delete_one(unsettled)
+        raise
+    except BaseException:
+        # Includes CancelledError, so a cancelled request doesn't hold the key until its lease ends
+        await asyncio.shield(db.idempotency.delete_one(unsettled))
+        raise
+    finally:
+        idempotent_store.reset(token)
+    if stored:
+        return result
+    if keep is None or keep(result):
+        await store(200, result)
+    else:
+        await db.idempotency.delete_one(unsettled)
+    return result
+
+# ==================== CRYPTO RATES ====================
+
+# Payment method suffix -> CoinGecko id, and decimals the amount is quoted to
+CRYPTO_ASSETS = {
+    "btc": ("bitcoin", 8),
+    "eth": ("ethereum", 6),
+    "usdt": ("tether", 2),
+    "usdc": ("usd-coin", 2),
+}
+
+FALLBACK_CRYPTO_RATES = {
+    "bitcoin": {"ngn": 150000000},
+    "ethereum": {"ngn": 6000000},
+    "tether": {"ngn": 1600},
+    "usd-coin": {"ngn": 1600}
+}
+
+class CryptoRateService:
+    """NGN crypto rates kept in memory and refreshed in the background.
+
+    Reads never wait while the rates are younger than CRYPTO_RATE_MAX_AGE_SECONDS; past the
+    refresh interval they return the held rates and revalidate in the background. Concurrent
+    refreshes share one upstream call.
+    """
+
+    def __init__(self):
+        self.rates: Optional[dict] = None
+        self.fetched_at: Optional[float] = None
+        self.as_of: Optional[str] = None
+        self._inflight: Optional[asyncio.Future] = None
+        self.upstream_calls = 0
+        self.upstream_failures = 0
+        self.collapsed = 0
+        self.stale_served = 0
+        self.fallback_served = 0
+
+    def age(self) -> Optional[float]:
+        return time.monotonic() - self.fetched_at if self.fetched_at is not None else None
+
+    async def _fetch(self) -> dict:
+        self.upstream_calls += 1
+        try:
+            response = await coingecko_client.request(
+                "GET",
+                "/simple/price",
+                params={
+                    "ids": ",".join(coin for coin, _ in CRYPTO_ASSETS.values()),
+                    "vs_currencies": "ngn",
+                    "x_cg_demo_api_key": COINGECKO_API_KEY
+                }
+            )
+            response.raise_for_status()
+            data = response.json()
+            rates = {coin: {"ngn": data[coin]["ngn"]} for coin, _ in CRYPTO_ASSETS.values()}
+        except Exception:
+            self.upstream_failures += 1
+            raise
+        self.rates = rates
+        self.fetched_at = time.monotonic()
+        self.as_of = datetime.now(timezone.utc).isoformat()
+        return rates
+
+    async def refresh(self) -> dict:
+        """Fetch upstream, joining a fetch that is already running instead of starting another"""
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._fetch())
+            self._inflight.add_done_callback(self._clear_inflight)
+        else:
+            self.collapsed += 1
+        # shield: one caller being cancelled mustn't cancel the fetch the others are waiting on
+        return await asyncio.shield(self._inflight)
+
+    def _clear_inflight(self, future: asyncio.Future):
+        self._inflight = None
+        if not future.cancelled():
+            future.exception()  # mark retrieved; failures are counted and logged by callers
+
+    async def refresh_in_background(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.error(f"Crypto rate refresh failed: {e}")
+
+    async def get(self) -> dict:
+        """Current rates with their age; falls back to held (or built-in) rates when upstream fails"""
+        age = self.age()
+        if age is not None and age < CRYPTO_RATE_MAX_AGE_SECONDS:
+            if age >= CRYPTO_RATE_REFRESH_SECONDS and self._inflight is None:
+                self.stale_served += 1
+                defer(self.refresh_in_background())
+            return self.snapshot("coingecko")
+        try:
+            await self.refresh()
+            return self.snapshot("coingecko")
+        except Exception as e:
+            logger.error(f"CoinGecko error: {e}")
+        if self.rates is not None:
+            self.stale_served += 1
+            return self.snapshot("stale")
+        self.fallback_served += 1
+        return {"rates": FALLBACK_CRYPTO_RATES, "as_of": None, "age_seconds": None, "source": "fallback"}
+
+    def snapshot(self, source: str) -> dict:
+        return {"rates": self.rates, "as_of": self.as_of, "age_seconds": round(self.age(), 1), "source": source}
+
+    def stats(self) -> dict:
+        age = self.age()
+        return {
+            "as_of": self.as_of,
+            "age_seconds": round(age, 1) if age is not None else None,
+            "upstream_calls": self.upstream_calls,
+            "upstream_failures": self.upstream_failures,
+            "collapsed_refreshes": self.collapsed,
+            "stale_served": self.stale_served,
+            "fallback_served": self.fallback_served
+        }
+
+crypto_rates = CryptoRateService()
+
+async def crypto_quote(payment_method: str, total: float) -> Optional[dict]:
+    """Lock the crypto amount for an order total at the current cached rate.
+
+    No quote (None) when only stale or built-in rates are available: the order then shows an
+    approximate amount rather than asking the customer to send an exact figure from old prices.
+    """
+    asset = CRYPTO_ASSETS.get(payment_method.replace("crypto_", ""))
+    if asset is None:
+        return None
+    coin, decimals = asset
+    current = await crypto_rates.get()
+    if current["source"] != "coingecko" or current["age_seconds"] >= CRYPTO_RATE_MAX_AGE_SECONDS:
+        logger.warning(f"No {coin} quote: only {current['source']} rates are available")
+        return None
+    rate = current["rates"][coin]["ngn"]
+    now = datetime.now(timezone.utc)
+    return {
+        "crypto_amount": round(total / rate, decimals),
+        "rate_ngn": rate,
+        "rate_as_of": current["as_of"],
+        "rate_age_seconds": current["age_seconds"],
+        "rate_source": current["source"],
+        "quoted_at": now.isoformat(),
+        "expires_at": (now + timedelta(minutes=CRYPTO_QUOTE_MINUTES)).isoformat()
+    }
+
 # ==================== ORDER & PAYMENT ROUTES ====================
 
+class PhaseStats:
+    """Rolling latency samples (ms) per named phase, summarized for /admin/metrics"""
+
+    def __init__(self, window: int = 500):
+        self.window = window
+        self._samples = {}
+        self._counts = {}
+
+    def record(self, phase: str, ms: float):
+        self._samples.setdefault(phase, deque(maxlen=self.window)).append(ms)
+        self._counts[phase] = self._counts.get(phase, 0) + 1
+
+    def stats(self) -> dict:
+        report = {}
+        for phase, samples in self._samples.items():
+            ordered = sorted(samples)
+            report[phase] = {
+                "count": self._counts[phase],
+                "avg_ms": round(sum(ordered) / len(ordered), 2),
+                "p50_ms": round(ordered[len(ordered) // 2], 2),
+                "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 2),
+                "max_ms": round(ordered[-1], 2)
+            }
+        return report
+
+class PhaseTimer:
+    """Times the phases of one request into a PhaseStats and a Server-Timing header"""
+
+    def __init__(self, stats: PhaseStats):
+        self.stats = stats
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            ms = (time.perf_counter() - start) * 1000
+            self.phases[name] = ms
+            self.stats.record(name, ms)
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{name};dur={ms:.1f}" for name, ms in self.phases.items())
+
+checkout_timings = PhaseStats()
+
+# Strong references to fire-and-forget tasks so they aren't garbage collected mid-run
+deferred_tasks = set()
+
+def defer(coro):
+    task = asyncio.create_task(coro)
+    deferred_tasks.add(task)
+    task.add_done_callback(deferred_tasks.discard)
+    return task
+
 @api_router.post("/orders")
-async def create_order(order_data: OrderCreate, current_user: dict = Depends(get_current_user)):
+async def create_order(
+    request: Request,
+    response: Response,
+    order_data: OrderCreate,
+    current_user: dict = Depends(get_current_user)
+):
+    timer = PhaseTimer(checkout_timings)
+    result = await run_idempotent(
+        request, "orders", current_user["id"], order_data.model_dump(),
+        lambda: place_order(order_data, current_user, timer)
+    )
+    if timer.phases:
+        response.headers["Server-Timing"] = timer.server_timing()
+    return result
+
+async def initialize_payment(
+    payment_method: str, email: str, reference: str, total: float, quote: Optional[dict] = None
+) -> dict:
+    """Payment instructions for a new order; for Paystack this opens the transaction"""
+    payment_info = {}
+    if payment_method == "paystack":
+        # Initialize Paystack transaction
+        try:
+            response = await paystack_client.request(
+                "POST",
+                "/transaction/initialize",
+                json={
+                    "email": email,
+                    "amount": int(total * 100),  # Convert to kobo
+                    "reference": reference,
+                    "callback_url": f"{os.environ.get('FRONTEND_URL', '')}/checkout/verify"
+                }
+            )
+            paystack_data = response.json()
+            if paystack_data.get("status"):
+                payment_info = {
+                    "authorization_url": paystack_data["data"]["authorization_url"],
+                    "access_code": paystack_data["data"]["access_code"],
+                    "reference": reference
+                }
+            else:
+                # Paystack returned an error (e.g., invalid key)
+                logger.error(f"Paystack init failed: {paystack_data}")
+                payment_info = {
+                    "error": paystack_data.get("message", "Payment initialization failed"),
+                    "reference": reference
+                }
+        except CircuitOpenError:
+            payment_info = {"error": "Card payments are temporarily unavailable, please try again shortly", "reference": reference}
+        except Exception as e:
+            logger.error(f"Paystack error: {e}")
+            payment_info = {"error": "Failed to initialize payment", "reference": reference}
+    
+    elif payment_method.startswith("crypto_"):
+        crypto_type = payment_method.replace("crypto_", "")
+        wallet_map = {"btc": "btc", "eth": "eth", "usdt": "usdt_trc20", "usdc": "usdc_erc20"}
+        wallet_key = wallet_map.get(crypto_type, crypto_type)
+        payment_info = {
+            "wallet_address": CRYPTO_WALLETS.get(wallet_key, ""),
+            "crypto_type": crypto_type.upper(),
+            "amount_ngn": total,
+            "reference": reference,
+            **({"quote": quote} if quote else {})
+        }
+    
+    elif payment_method == "bank_transfer":
+        payment_info = {
+            **BANK_DETAILS,
+            "amount": total,
+            "reference": reference
+        }
+    return payment_info
+
+async def after_order_committed(order: dict, email: str):
+    """Notifications that don't decide the checkout response, run after it has been sent"""
+    timer = PhaseTimer(checkout_timings)
+    try:
+        with timer.phase("post_commit"):
+            ordered_ids = list({item["product_id"] for item in order["items"]})
+            # Send low stock alerts for products this order pushed under the threshold
+            low_stock = await db.products.find(
+                {"id": {"$in": ordered_ids}, "stock": {"$gt": 0, "$lte": LOW_STOCK_THRESHOLD}}, PRODUCT_PROJECTION
+            ).to_list(len(ordered_ids))
+            for product in low_stock:
+                defer(send_low_stock_alert(product))
+            defer(send_order_confirmation_email(order, email))
+            defer(send_admin_new_order_notification(order))
+    except Exception as e:
+        logger.error(f"Post-commit work for order {order['id']} failed: {e}")
+
+async def finalize_order(order: dict, products: Dict[str, dict]):
+    """Commit a stored order's stock reservation and empty the buyer's cart, logging failures.
+
+    Not deferred: commit_stock is what rolls variant sales up to product.stock and drops the
+    reservation tags. A commit that fails is flagged stock_commit_pending and retried by the
+    order expiry job (commit_pending_order_stock).
+    """
+    committed, emptied = await asyncio.gather(
+        commit_stock(order["id"], order["items"], products),
+        db.carts.delete_one({"user_id": order["user_id"]}),
+        return_exceptions=True
+    )
+    if isinstance(emptied, Exception):
+        logger.error(f"Emptying the cart for order {order['id']} failed: {emptied}")
+    try:
+        if isinstance(committed, Exception):
+            logger.error(f"Committing stock for order {order['id']} failed, will retry: {committed}")
+            await db.orders.update_one({"id": order["id"]}, {"$set": {"stock_commit_pending": True}})
+            return
+        # Stock only changed, prices didn't: cart snapshots stay valid
+        await invalidate_catalog(list(products), broadcast=False)
+    except Exception as e:
+        logger.error(f"Finalizing order {order['id']} failed: {e}")
+
+async def place_order(order_data: OrderCreate, current_user: dict, timer: PhaseTimer) -> dict:
     # Calculate total
     total = 0
     order_items = []
+    with timer.phase("price"):
+        products = await get_products_by_ids([item.product_id for item in order_data.items])
     for item in order_data.items:
-        product = await db.products.find_one({"id": item.product_id}, {"_id": 0})
+        product = products.get(item.product_id)
         if not product:
             raise HTTPException(status_code=404, detail=f"Product {item.product_id} not found")
         
@@ -794,6 +2752,11 @@ async def create_order(order_data: OrderCreate, current_user: dict = Depends(get
         payment_status = "pending"
         order_status = "pending"
     
+    quote = None
+    if order_data.payment_method.startswith("crypto_"):
+        with timer.phase("quote"):
+            quote = await crypto_quote(order_data.payment_method, total)
+    
     order = {
         "id": order_id,
         "reference": reference,
@@ -808,87 +2771,32 @@ async def create_order(order_data: OrderCreate, current_user: dict = Depends(get
         "status": order_status,
         "payment_status": payment_status,
         "notes": order_data.notes,
+        "crypto_quote": quote,
         "created_at": datetime.now(timezone.utc).isoformat(),
         "updated_at": datetime.now(timezone.utc).isoformat()
     }
     
-    await db.orders.insert_one(order)
-    
-    # Clear user's cart
-    await db.carts.delete_one({"user_id": current_user["id"]})
+    with timer.phase("reserve"):
+        reserved = await reserve_stock(order_id, order_items, products)
+    if not reserved:
+        short = await short_stock_names(order_items, products)
+        raise HTTPException(status_code=409, detail=f"Insufficient stock for: {', '.join(short) or 'some items'}")
     
-    # Generate payment info based on method
-    payment_info = {}
-    if order_data.payment_method == "paystack":
-        # Initialize Paystack transaction
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    "https://api.paystack.co/transaction/initialize",
-                    json={
-                        "email": current_user["email"],
-                        "amount": int(total * 100),  # Convert to kobo
-                        "reference": reference,
-                        "callback_url": f"{os.environ.get('FRONTEND_URL', '')}/checkout/verify"
-                    },
-                    headers={"Authorization": f"Bearer {PAYSTACK_SECRET_KEY}"}
-                )
-                paystack_data = response.json()
-                if paystack_data.get("status"):
-                    payment_info = {
-                        "authorization_url": paystack_data["data"]["authorization_url"],
-                        "access_code": paystack_data["data"]["access_code"],
-                        "reference": reference
-                    }
-                else:
-                    # Paystack returned an error (e.g., invalid key)
-                    logger.error(f"Paystack init failed: {paystack_data}")
-                    payment_info = {
-                        "error": paystack_data.get("message", "Payment initialization failed"),
-                        "reference": reference
-                    }
-        except Exception as e:
-            logger.error(f"Paystack error: {e}")
-            payment_info = {"error": "Failed to initialize payment", "reference": reference}
-    
-    elif order_data.payment_method.startswith("crypto_"):
-        crypto_type = order_data.payment_method.replace("crypto_", "")
-        wallet_map = {"btc": "btc", "eth": "eth", "usdt": "usdt_trc20", "usdc": "usdc_erc20"}
-        wallet_key = wallet_map.get(crypto_type, crypto_type)
-        payment_info = {
-            "wallet_address": CRYPTO_WALLETS.get(wallet_key, ""),
-            "crypto_type": crypto_type.upper(),
-            "amount_ngn": total,
-            "reference": reference
-        }
-    
-    elif order_data.payment_method == "bank_transfer":
-        payment_info = {
-            **BANK_DETAILS,
-            "amount": total,
-            "reference": reference
-        }
-    
-    # Send order confirmation email to customer (non-blocking)
-    asyncio.create_task(send_order_confirmation_email(order, current_user["email"]))
-    
-    # Send new order notification to admin (non-blocking)
-    asyncio.create_task(send_admin_new_order_notification(order))
-    
-    # Check and update inventory, send low stock alerts
-    for item in order_data.items:
-        product = await db.products.find_one({"id": item.product_id}, {"_id": 0})
-        if product:
-            new_stock = product.get("stock", 0) - item.quantity
-            await db.products.update_one(
-                {"id": item.product_id},
-                {"$set": {"stock": max(0, new_stock)}}
-            )
-            # Send low stock alert if below threshold
-            if new_stock <= LOW_STOCK_THRESHOLD and new_stock > 0:
-                asyncio.create_task(send_low_stock_alert({**product, "stock": new_stock}))
+    # The order insert and the payment provider call don't depend on each other
+    with timer.phase("commit"):
+        inserted, payment_info = await asyncio.gather(
+            db.orders.insert_one(order),
+            initialize_payment(order_data.payment_method, current_user["email"], reference, total, quote),
+            return_exceptions=True
+        )
+    if isinstance(inserted, BaseException):
+        await release_stock(order_id, order_items, products)
+        raise inserted
+    if isinstance(payment_info, BaseException):
+        logger.error(f"Payment initialization error: {payment_info}")
+        payment_info = {"error": "Failed to initialize payment", "reference": reference}
     
-    return {
+    result = {
         "order_id": order_id,
         "reference": reference,
         "total": total,
@@ -897,6 +2805,15 @@ async def create_order(order_data: OrderCreate, current_user: dict = Depends(get
         "payment_method": order_data.payment_method,
         "payment_info": payment_info
     }
+    # The order exists now: a retry with the same Idempotency-Key must get it back, not place another
+    await store_idempotent_result(result)
+    
+    # Shielded so a client disconnect can't stop it halfway; finalize_order never raises
+    with timer.phase("finalize"):
+        await asyncio.shield(finalize_order(order, products))
+    defer(after_order_committed(order, current_user["email"]))
+    
+    return result
 
 @api_router.get("/orders")
 async def get_user_orders(current_user: dict = Depends(get_current_user)):
@@ -911,83 +2828,94 @@ async def get_order(order_id: str, current_user: dict = Depends(get_current_user
     return order
 
 @api_router.post("/payments/verify")
-async def verify_payment(data: PaymentVerify, current_user: dict = Depends(get_current_user)):
+async def verify_payment(request: Request, data: PaymentVerify, current_user: dict = Depends(get_current_user)):
+    # Only a successful verification is final; anything else may succeed on a later retry
+    return await run_idempotent(
+        request, "payments.verify", current_user["id"], data.model_dump(),
+        lambda: verify_paystack_payment(data),
+        keep=lambda result: result.get("status") == "success"
+    )
+
+async def verify_paystack_payment(data: PaymentVerify) -> dict:
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"https://api.paystack.co/transaction/verify/{data.reference}",
-                headers={"Authorization": f"Bearer {PAYSTACK_SECRET_KEY}"}
+        response = await paystack_client.request("GET", f"/transaction/verify/{data.reference}")
+        paystack_data = response.json()
+        
+        if paystack_data.get("status") and paystack_data["data"]["status"] == "success":
+            order_filter = {"id": data.order_id, "reference": data.reference}
+            # Only a pending order becomes paid here; one cancelled meanwhile must get its stock back first
+            result = await db.orders.update_one(
+                {**order_filter, "payment_status": "pending"},
+                {"$set": {
+                    "payment_status": "paid",
+                    "status": "confirmed",
+                    "updated_at": datetime.now(timezone.utc).isoformat()
+                }}
             )
-            paystack_data = response.json()
-            
-            if paystack_data.get("status") and paystack_data["data"]["status"] == "success":
-                await db.orders.update_one(
-                    {"id": data.order_id},
-                    {"$set": {
-                        "payment_status": "paid",
-                        "status": "confirmed",
-                        "updated_at": datetime.now(timezone.utc).isoformat()
-                    }}
-                )
-                return {"status": "success", "message": "Payment verified"}
-            else:
-                return {"status": "failed", "message": "Payment verification failed"}
+            if result.modified_count == 0:
+                order = await db.orders.find_one(order_filter, {"_id": 0, "id": 1, "items": 1, "payment_status": 1})
+                if order is None:
+                    return {"status": "failed", "message": "Payment verification failed"}
+                if order["payment_status"] in REINSTATABLE_PAYMENT_STATUSES and not await apply_late_payment(order):
+                    return {"status": "review", "message": "Payment received after the order was cancelled; our team will contact you"}
+            return {"status": "success", "message": "Payment verified"}
+        else:
+            return {"status": "failed", "message": "Payment verification failed"}
+    except CircuitOpenError:
+        raise HTTPException(status_code=503, detail="Payment provider is temporarily unavailable, please retry shortly")
     except Exception as e:
         logger.error(f"Payment verification error: {e}")
         raise HTTPException(status_code=500, detail="Payment verification failed")
 
+def payment_event_id(payload: dict, body: bytes) -> str:
+    """Stable id for a Paystack event, so retried deliveries collapse onto one inbox entry"""
+    data = payload.get("data") or {}
+    if data.get("id") is not None:
+        return f"{payload.get('event')}:{data['id']}"
+    return hashlib.sha256(body).hexdigest()
+
 @api_router.post("/payments/webhook")
 async def paystack_webhook(request: Request):
+    """Verify, queue and acknowledge; the payment event worker applies the event"""
     body = await request.body()
     signature = request.headers.get("x-paystack-signature", "")
     
     # Verify signature
     expected = hmac.new(PAYSTACK_SECRET_KEY.encode(), body, hashlib.sha512).hexdigest()
-    if signature != expected:
+    if not hmac.compare_digest(signature, expected):
         raise HTTPException(status_code=401, detail="Invalid signature")
     
-    payload = await request.json()
-    event = payload.get("event")
-    data = payload.get("data", {})
-    
-    if event == "charge.success":
-        reference = data.get("reference")
-        await db.orders.update_one(
-            {"reference": reference},
-            {"$set": {
-                "payment_status": "paid",
-                "status": "confirmed",
-                "updated_at": datetime.now(timezone.utc).isoformat()
-            }}
-        )
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid payload")
     
+    payment_event_stats["received"] += 1
+    try:
+        await db.payment_events.insert_one({
+            "event_id": payment_event_id(payload, body),
+            "event": payload.get("event"),
+            "reference": (payload.get("data") or {}).get("reference"),
+            "payload": payload,
+            "status": "pending",
+            "received_at": datetime.now(timezone.utc).isoformat()
+        })
+    except DuplicateKeyError:
+        # Paystack retried an event we already hold
+        payment_event_stats["duplicates"] += 1
+        return {"status": "ok"}
+    payment_events_wakeup.set()
     return {"status": "ok"}
 
 @api_router.get("/crypto/rates")
-async def get_crypto_rates():
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                "https://api.coingecko.com/api/v3/simple/price",
-                params={
-                    "ids": "bitcoin,ethereum,tether,usd-coin",
-                    "vs_currencies": "ngn",
-                    "x_cg_demo_api_key": COINGECKO_API_KEY
-                }
-            )
-            return response.json()
-    except Exception as e:
-        logger.error(f"CoinGecko error: {e}")
-        return {
-            "bitcoin": {"ngn": 150000000},
-            "ethereum": {"ngn": 6000000},
-            "tether": {"ngn": 1600},
-            "usd-coin": {"ngn": 1600}
-        }
+async def get_crypto_rates(response: Response):
+    current = await crypto_rates.get()
+    response.headers["Cache-Control"] = "public, max-age=15"
+    return {**current["rates"], "as_of": current["as_of"], "age_seconds": current["age_seconds"], "source": current["source"]}
 
 @api_router.get("/payment-methods")
-async def get_payment_methods():
-    return {
+async def get_payment_methods(request: Request, response: Response):
+    payload = {
         "methods": [
             {"id": "paystack", "name": "Card Payment (Paystack)", "icon": "credit-card"},
             {"id": "crypto_btc", "name": "Bitcoin (BTC)", "icon": "bitcoin"},
@@ -999,6 +2927,10 @@ async def get_payment_methods():
         "crypto_wallets": CRYPTO_WALLETS,
         "bank_details": BANK_DETAILS
     }
+    not_modified = apply_etag(request, response, body_etag(payload), STATIC_CACHE_CONTROL)
+    if not_modified:
+        return not_modified
+    return payload
 
 # ==================== ADMIN ROUTES ====================
 
@@ -1008,15 +2940,17 @@ async def admin_get_orders(
     payment_status: Optional[str] = None,
     limit: int = 50,
     skip: int = 0,
+    cursor: Optional[str] = None,
+    include_total: bool = True,
     admin: dict = Depends(get_admin_user)
 ):
     query = {}
     if status: query["status"] = status
     if payment_status: query["payment_status"] = payment_status
     
-    orders = await db.orders.find(query, {"_id": 0}).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
-    total = await db.orders.count_documents(query)
-    return {"orders": orders, "total": total}
+    orders, next_cursor = await fetch_page(db.orders, query, {"_id": 0}, "created_at", limit, skip=skip, cursor=cursor)
+    total = await count_matching(db.orders, query, include_total)
+    return json_response({"orders": orders, "total": total, "next_cursor": next_cursor})
 
 @api_router.put("/admin/orders/{order_id}")
 async def admin_update_order(order_id: str, update: OrderStatusUpdate, admin: dict = Depends(get_admin_user)):
@@ -1071,6 +3005,8 @@ async def admin_confirm_payment(order_id: str, admin: dict = Depends(get_admin_u
         raise HTTPException(status_code=404, detail="Order not found")
     
     # Check if payment is awaiting confirmation
+    if order.get("payment_status") == "expired":
+        raise HTTPException(status_code=409, detail="Order expired; reinstate it to confirm a late payment")
     if order.get("payment_status") not in ["awaiting_payment", "pending"]:
         raise HTTPException(status_code=400, detail="Payment already processed")
     
@@ -1090,19 +3026,56 @@ async def admin_confirm_payment(order_id: str, admin: dict = Depends(get_admin_u
         "description": "Payment confirmed by admin"
     }
     
-    await db.orders.update_one(
-        {"id": order_id},
+    # Conditional so a payment can't be confirmed on an order the expiry job just cancelled
+    result = await db.orders.update_one(
+        {"id": order_id, "payment_status": {"$in": ["awaiting_payment", "pending"]}},
         {
             "$set": update_data,
             "$push": {"tracking_history": tracking_event}
         }
     )
+    if result.modified_count == 0:
+        current = await db.orders.find_one({"id": order_id}, {"_id": 0, "payment_status": 1})
+        if current and current.get("payment_status") == "expired":
+            raise HTTPException(status_code=409, detail="Order expired; reinstate it to confirm a late payment")
+        raise HTTPException(status_code=400, detail="Payment already processed")
     
     # Send payment confirmation email to customer
     asyncio.create_task(send_payment_confirmed_email(order))
     
     return {"message": "Payment confirmed successfully"}
 
+@api_router.post("/admin/orders/{order_id}/reinstate")
+async def admin_reinstate_order(order_id: str, admin: dict = Depends(get_admin_user)):
+    """Confirm a payment that arrived after the order expired: take its stock again and mark it paid"""
+    order = await db.orders.find_one({"id": order_id}, {"_id": 0})
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    if order.get("payment_status") not in REINSTATABLE_PAYMENT_STATUSES:
+        raise HTTPException(status_code=400, detail="Only expired or failed orders can be reinstated")
+    
+    now = datetime.now(timezone.utc).isoformat()
+    reinstated = await reinstate_order(
+        order,
+        {
+            "payment_status": "paid",
+            "status": "processing",
+            "payment_confirmed_at": now,
+            "payment_confirmed_by": admin["email"],
+            "updated_at": now
+        },
+        {"status": "payment_confirmed", "timestamp": now, "description": "Order reinstated: late payment confirmed by admin"}
+    )
+    if not reinstated:
+        short = await short_stock_names(order["items"], await get_products_by_ids(
+            list({item["product_id"] for item in order["items"]})
+        ))
+        detail = f"Insufficient stock for: {', '.join(short)}" if short else "Order is being updated; try again"
+        raise HTTPException(status_code=409, detail=detail)
+    
+    asyncio.create_task(send_payment_confirmed_email(order))
+    return {"message": "Order reinstated and payment confirmed"}
+
 async def send_payment_confirmed_email(order: dict):
     """Send payment confirmation email to customer"""
     if not RESEND_API_KEY:
@@ -1187,14 +3160,23 @@ async def get_order_tracking(order_id: str, current_user: dict = Depends(get_cur
     return order
 
 @api_router.get("/admin/customers")
-async def admin_get_customers(limit: int = 50, skip: int = 0, admin: dict = Depends(get_admin_user)):
-    customers = await db.users.find({"is_admin": {"$ne": True}}, {"_id": 0, "password": 0}).skip(skip).limit(limit).to_list(limit)
-    total = await db.users.count_documents({"is_admin": {"$ne": True}})
-    return {"customers": customers, "total": total}
+async def admin_get_customers(
+    limit: int = 50,
+    skip: int = 0,
+    cursor: Optional[str] = None,
+    include_total: bool = True,
+    admin: dict = Depends(get_admin_user)
+):
+    query = {"is_admin": {"$ne": True}}
+    customers, next_cursor = await fetch_page(
+        db.users, query, {"_id": 0, "password": 0}, "created_at", limit, skip=skip, cursor=cursor
+    )
+    total = await count_matching(db.users, query, include_total)
+    return json_response({"customers": customers, "total": total, "next_cursor": next_cursor})
 
 @api_router.get("/admin/analytics")
 async def admin_analytics(admin: dict = Depends(get_admin_user)):
-    total_orders = await db.orders.count_documents({})
+    total_orders = await count_matching(db.orders, {})
     pending_orders = await db.orders.count_documents({"status": "pending"})
     confirmed_orders = await db.orders.count_documents({"status": "confirmed"})
     
@@ -1206,7 +3188,7 @@ async def admin_analytics(admin: dict = Depends(get_admin_user)):
     revenue_result = await db.orders.aggregate(pipeline).to_list(1)
     total_revenue = revenue_result[0]["total"] if revenue_result else 0
     
-    total_products = await db.products.count_documents({})
+    total_products = await count_matching(db.products, {})
     total_customers = await db.users.count_documents({"is_admin": {"$ne": True}})
     
     # Recent orders
@@ -1222,6 +3204,55 @@ async def admin_analytics(admin: dict = Depends(get_admin_user)):
         "recent_orders": recent_orders
     }
 
+@api_router.get("/admin/indexes")
+async def admin_index_report(admin: dict = Depends(get_admin_user)):
+    state = await db.settings.find_one({"type": "index_version"}, {"_id": 0})
+    return {
+        "index_version": state.get("version", 0) if state else 0,
+        "declared_version": INDEX_VERSION,
+        "collections": await index_report()
+    }
+
+@api_router.post("/admin/indexes/apply")
+async def admin_apply_indexes(admin: dict = Depends(get_admin_user)):
+    await run_migrations()
+    version = await ensure_indexes(force=True)
+    return {"message": "Indexes applied", "index_version": version}
+
+@api_router.get("/admin/metrics")
+async def admin_metrics(admin: dict = Depends(get_admin_user)):
+    return {
+        "catalog_version": catalog_state["version"],
+        "stock_version": catalog_state["stock_version"],
+        "product_cache": product_cache.stats(),
+        "product_list_cache": product_list_cache.stats(),
+        "product_version_cache": product_version_cache.stats(),
+        "count_cache": count_cache.stats(),
+        "cart_sweeper": cart_sweep_stats,
+        "order_expiry": {
+            **order_expiry_stats,
+            "restock_unconfirmed": await db.orders.count_documents({"stock_restock_claim": {"$exists": True}}),
+            "stock_commit_pending": await db.orders.count_documents({"stock_commit_pending": True})
+        },
+        "checkout_timings": checkout_timings.stats(),
+        "http_clients": {provider.name: provider.stats() for provider in PROVIDER_CLIENTS},
+        "crypto_rates": crypto_rates.stats(),
+        "payment_events": {
+            **payment_event_stats,
+            "pending": await db.payment_events.count_documents({"status": "pending"}),
+            "orders_needing_review": await db.orders.count_documents({"payment_review": {"$exists": True}})
+        },
+        "payment_reconciliation": {
+            **reconcile_stats,
+            "backlog": await db.orders.count_documents(reconcile_window())
+        }
+    }
+
+@api_router.post("/admin/payments/reconcile")
+async def admin_reconcile_payments(admin: dict = Depends(get_admin_user)):
+    """Run payment reconciliation now instead of waiting for the next scheduled pass"""
+    return await reconcile_pending_payments()
+
 @api_router.get("/admin/settings/theme")
 async def get_theme_settings(admin: dict = Depends(get_admin_user)):
     settings = await db.settings.find_one({"type": "theme"}, {"_id": 0})
@@ -1240,7 +3271,7 @@ async def update_theme_settings(theme: ThemeSettings, admin: dict = Depends(get_
 
 @api_router.post("/products/{product_id}/reviews")
 async def create_review(product_id: str, review: ReviewCreate, current_user: dict = Depends(get_current_user)):
-    product = await db.products.find_one({"id": product_id})
+    product = await get_cached_product(product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
@@ -1271,7 +3302,11 @@ async def create_review(product_id: str, review: ReviewCreate, current_user: dic
                 review_data["verified_purchase"] = True
                 break
     
-    await db.reviews.insert_one(review_data)
+    try:
+        await db.reviews.insert_one(review_data)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="You have already reviewed this product")
+    count_cache.pop(count_cache_key(db.reviews, {"product_id": product_id}))
     
     # Update product average rating
     await update_product_rating(product_id)
@@ -1279,13 +3314,20 @@ async def create_review(product_id: str, review: ReviewCreate, current_user: dic
     return {"id": review_id, "message": "Review submitted successfully"}
 
 @api_router.get("/products/{product_id}/reviews")
-async def get_product_reviews(product_id: str, limit: int = 20, skip: int = 0):
-    reviews = await db.reviews.find(
-        {"product_id": product_id},
-        {"_id": 0}
-    ).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
+async def get_product_reviews(
+    product_id: str,
+    request: Request,
+    response: Response,
+    limit: int = 20,
+    skip: int = 0,
+    cursor: Optional[str] = None,
+    include_total: bool = True
+):
+    reviews, next_cursor = await fetch_page(
+        db.reviews, {"product_id": product_id}, {"_id": 0}, "created_at", limit, skip=skip, cursor=cursor
+    )
     
-    total = await db.reviews.count_documents({"product_id": product_id})
+    total = await count_matching(db.reviews, {"product_id": product_id}, include_total)
     
     # Get rating distribution
     pipeline = [
@@ -1305,12 +3347,18 @@ async def get_product_reviews(product_id: str, limit: int = 20, skip: int = 0):
     avg_result = await db.reviews.aggregate(avg_pipeline).to_list(1)
     avg_rating = round(avg_result[0]["avg"], 1) if avg_result else 0
     
-    return {
+    payload = {
         "reviews": reviews,
         "total": total,
+        "next_cursor": next_cursor,
         "average_rating": avg_rating,
         "distribution": distribution
     }
+    # Helpful votes don't touch the product, so there is no cheap version: hash the body
+    not_modified = apply_etag(request, response, body_etag(payload))
+    if not_modified:
+        return not_modified
+    return payload
 
 @api_router.post("/reviews/{review_id}/helpful")
 async def mark_review_helpful(review_id: str, current_user: dict = Depends(get_current_user)):
@@ -1337,6 +3385,7 @@ async def update_product_rating(product_id: str):
                 "review_count": result[0]["count"]
             }}
         )
+        await invalidate_catalog([product_id], broadcast=False)
 
 # ==================== INVENTORY ALERTS ====================
 
@@ -1344,36 +3393,144 @@ async def update_product_rating(product_id: str):
 async def get_low_stock_products(admin: dict = Depends(get_admin_user)):
     products = await db.products.find(
         {"stock": {"$lte": LOW_STOCK_THRESHOLD}},
-        {"_id": 0}
+        PRODUCT_PROJECTION
     ).sort("stock", 1).to_list(50)
-    return {"products": products, "threshold": LOW_STOCK_THRESHOLD}
+    # Individual sizes/colours can run out while the product total still looks healthy
+    variants = await db.inventory.aggregate([
+        {"$group": {
+            "_id": {"product_id": "$product_id", "size": "$size", "color": "$color"},
+            "stock": {"$sum": "$stock"}
+        }},
+        {"$match": {"stock": {"$lte": LOW_STOCK_THRESHOLD}}},
+        {"$sort": {"stock": 1}},
+        {"$limit": 50},
+        {"$project": {"_id": 0, "product_id": "$_id.product_id", "size": "$_id.size", "color": "$_id.color", "stock": 1}}
+    ]).to_list(50)
+    names = await get_products_by_ids([v["product_id"] for v in variants])
+    for variant in variants:
+        variant["product_name"] = names.get(variant["product_id"], {}).get("name")
+    return {"products": products, "variants": variants, "threshold": LOW_STOCK_THRESHOLD}
 
 @api_router.put("/admin/inventory/{product_id}")
-async def update_inventory(product_id: str, stock: int, admin: dict = Depends(get_admin_user)):
-    result = await db.products.update_one(
-        {"id": product_id},
-        {"$set": {"stock": stock, "updated_at": datetime.now(timezone.utc).isoformat()}}
+async def update_inventory(
+    product_id: str,
+    stock: int,
+    size: Optional[str] = None,
+    color: Optional[str] = None,
+    shards: int = 1,
+    admin: dict = Depends(get_admin_user)
+):
+    """Set product stock, or with size (and color) the stock of one variant split over shards counters.
+
+    On a product that tracks variants, a call without size sets the shared_stock that the untracked
+    sizes/colours sell from. The first tracked variant starts shared_stock at the product's stock,
+    so the other sizes stay on sale.
+
+    stock is what is available to sell now. It is applied as a change ($inc) to the counters rather
+    than written over them, so units held by orders still being placed stay accounted for: their
+    commit keeps them sold and a release hands back exactly what they took.
+    """
+    product = await db.products.find_one(
+        {"id": product_id}, {"_id": 0, "id": 1, "stock": 1, "shared_stock": 1, "inventory_variants": 1}
     )
-    if result.matched_count == 0:
+    if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    return {"message": "Inventory updated"}
+    now = datetime.now(timezone.utc).isoformat()
+    
+    if size is None and not tracked_variants(product):
+        await db.products.update_one(
+            {"id": product_id},
+            {"$inc": {"stock": stock - product.get("stock", 0)}, "$set": {"updated_at": now}}
+        )
+        await invalidate_catalog([product_id])
+        return {"message": "Inventory updated"}
+    
+    if not 1 <= shards <= MAX_INVENTORY_SHARDS:
+        raise HTTPException(status_code=400, detail=f"shards must be between 1 and {MAX_INVENTORY_SHARDS}")
+    if stock < 0:
+        raise HTTPException(status_code=400, detail="stock cannot be negative")
+    if size is None:
+        change = {"shared_stock": stock - product.get("shared_stock", 0)}
+        change["stock"] = change["shared_stock"]
+        fields = {"updated_at": now}
+    else:
+        variant = variant_filter(product_id, size, color)
+        current = await db.inventory.find(variant, {"_id": 0, "shard": 1, "stock": 1, "reservations": 1}).to_list(None)
+        levels = {doc["shard"]: doc.get("stock", 0) for doc in current}
+        per_shard, remainder = divmod(stock, shards)
+        operations = [
+            UpdateOne(
+                {**variant, "shard": shard},
+                {"$inc": {"stock": per_shard + (1 if shard < remainder else 0) - levels.get(shard, 0)},
+                 "$set": {"updated_at": now}},
+                upsert=True
+            )
+            for shard in range(shards)
+        ]
+        # Shards beyond the new count are emptied; ones an order still holds units on are kept
+        # (at zero) until that order commits or releases, the rest are deleted
+        operations += [
+            UpdateOne({**variant, "shard": doc["shard"]}, {"$inc": {"stock": -doc.get("stock", 0)}})
+            for doc in current if doc["shard"] >= shards and doc.get("reservations")
+        ]
+        operations.append(DeleteMany({**variant, "shard": {"$gte": shards}, "reservations": {"$in": [None, {}]}}))
+        await db.inventory.bulk_write(operations)
+        change = {"stock": stock - sum(levels.values())}
+        fields = {
+            "inventory_variants": [
+                v for v in product.get("inventory_variants") or []
+                if (v["size"], v.get("color")) != (size, color)
+            ] + [{"size": size, "color": color, "shards": shards}],
+            "updated_at": now
+        }
+        if not tracked_variants(product):
+            fields["shared_stock"] = product.get("stock", 0)
+    
+    updated = await db.products.find_one_and_update(
+        {"id": product_id},
+        {"$inc": change, "$set": fields},
+        projection={"_id": 0, "stock": 1, "shared_stock": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    await invalidate_catalog([product_id])
+    result = {"message": "Inventory updated", "shared_stock": updated["shared_stock"], "product_stock": updated["stock"]}
+    if size is not None:
+        result["variant"] = {**variant, "stock": stock, "shards": shards}
+    return result
 
 # ==================== CATEGORIES & SPORTS ====================
 
+async def get_distinct_values(field: str) -> list:
+    """distinct() over products, cached with the listing pages"""
+    cache_key = ("distinct", field)
+    values = product_list_cache.get(cache_key)
+    if values is None:
+        generation = catalog_state["generation"]
+        values = [v for v in await db.products.distinct(field) if v]
+        if generation == catalog_state["generation"]:
+            product_list_cache.set(cache_key, values)
+    return values
+
 @api_router.get("/categories")
-async def get_categories():
-    categories = await db.products.distinct("category")
-    return {"categories": categories}
+async def get_categories(request: Request, response: Response):
+    not_modified = apply_etag(request, response, catalog_etag(request, await sync_catalog_version()))
+    if not_modified:
+        return not_modified
+    return {"categories": await get_distinct_values("category")}
 
 @api_router.get("/sports")
-async def get_sports():
-    sports = await db.products.distinct("sport")
-    return {"sports": sports}
+async def get_sports(request: Request, response: Response):
+    not_modified = apply_etag(request, response, catalog_etag(request, await sync_catalog_version()))
+    if not_modified:
+        return not_modified
+    return {"sports": await get_distinct_values("sport")}
 
 @api_router.get("/collections")
-async def get_collections():
-    collections = await db.products.distinct("collection")
-    return {"collections": [c for c in collections if c]}
+async def get_collections(request: Request, response: Response):
+    not_modified = apply_etag(request, response, catalog_etag(request, await sync_catalog_version()))
+    if not_modified:
+        return not_modified
+    return {"collections": await get_distinct_values("collection")}
 
 # ==================== SEED DATA ====================
 
@@ -1465,16 +3622,532 @@ async def seed_data():
                 "updated_at": datetime.now(timezone.utc).isoformat()
             }
         ]
+        for product in sample_products:
+            product.update({"average_rating": 0, "review_count": 0, "sold_count": 0, "version": 1})
         await db.products.insert_many(sample_products)
+        await invalidate_catalog()
     
     return {"message": "Data seeded successfully"}
 
+# ==================== BACKGROUND JOBS ====================
+
+background_tasks: List[asyncio.Task] = []
+
+async def run_periodic(name: str, interval: float, job):
+    """Run job every interval seconds until cancelled; a failing run is logged and retried next time"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await job()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Background job {name} failed: {e}")
+
+def start_background_job(name: str, interval: float, job):
+    if interval > 0:
+        background_tasks.append(asyncio.create_task(run_periodic(name, interval, job)))
+
+WORKER_ID = uuid.uuid4().hex
+
+async def acquire_lease(name: str, seconds: float) -> bool:
+    """Hold a named lock in db.locks for `seconds`, so one worker runs a shared job at a time.
+
+    Re-acquiring a lease this worker already holds extends it.
+    """
+    now = datetime.now(timezone.utc)
+    try:
+        await db.locks.update_one(
+            {"name": name, "$or": [{"holder": WORKER_ID}, {"expires_at": {"$lt": now.isoformat()}}]},
+            {"$set": {"holder": WORKER_ID, "expires_at": (now + timedelta(seconds=seconds)).isoformat()}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        # The lock exists and belongs to a live lease elsewhere
+        return False
+
+async def release_lease(name: str):
+    await db.locks.delete_one({"name": name, "holder": WORKER_ID})
+
+cart_sweep_stats = {
+    "runs": 0,
+    "reclaimed_total": 0,
+    "archived_total": 0,
+    "last_reclaimed": 0,
+    "last_run_at": None,
+    "idle_days": CART_IDLE_DAYS,
+    "archive": CART_ARCHIVE
+}
+
+async def sweep_idle_carts() -> int:
+    """Delete (or archive, then delete) carts not modified for CART_IDLE_DAYS, in batches.
+
+    updated_at is an ISO string rather than a BSON date, so a TTL index can't expire carts;
+    this sweep pages the updated_at index instead.
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=CART_IDLE_DAYS)).isoformat()
+    reclaimed = 0
+    archived = 0
+    while True:
+        carts = await db.carts.find({"updated_at": {"$lt": cutoff}}).sort("updated_at", 1).to_list(CART_SWEEP_BATCH_SIZE)
+        if not carts:
+            break
+        if CART_ARCHIVE:
+            archived_at = datetime.now(timezone.utc).isoformat()
+            # Replace by _id so two workers sweeping the same batch don't archive it twice
+            await db.carts_archive.bulk_write([
+                UpdateOne({"_id": cart["_id"]}, {"$setOnInsert": {**cart, "archived_at": archived_at}}, upsert=True)
+                for cart in carts
+            ], ordered=False)
+            archived += len(carts)
+        # Re-check the cutoff so a cart touched since it was read survives
+        result = await db.carts.delete_many({"_id": {"$in": [cart["_id"] for cart in carts]}, "updated_at": {"$lt": cutoff}})
+        reclaimed += result.deleted_count
+        if len(carts) < CART_SWEEP_BATCH_SIZE:
+            break
+
+    cart_sweep_stats["runs"] += 1
+    cart_sweep_stats["reclaimed_total"] += reclaimed
+    cart_sweep_stats["archived_total"] += archived
+    cart_sweep_stats["last_reclaimed"] = reclaimed
+    cart_sweep_stats["last_run_at"] = datetime.now(timezone.utc).isoformat()
+    if reclaimed:
+        logger.info(f"Swept {reclaimed} idle carts older than {CART_IDLE_DAYS} days")
+    return reclaimed
+
+order_expiry_stats = {
+    "runs": 0,
+    "skipped_runs": 0,
+    "expired_total": 0,
+    "units_restocked_total": 0,
+    "stock_commits_retried_total": 0,
+    "last_expired": 0,
+    "last_run_at": None,
+    "expiry_hours": UNPAID_ORDER_EXPIRY_HOURS
+}
+
+async def release_expired_order_stock() -> int:
+    """Restock orders marked stock_release_pending, claiming each one before its stock is returned.
+
+    The pending flag is swapped for a stock_restock_claim token first, so a run that dies midway
+    leaves its orders claimed but unconfirmed (counted in /admin/metrics) instead of letting the
+    next run restock them a second time.
+    """
+    units = 0
+    while True:
+        candidates = await db.orders.find(
+            {"stock_release_pending": True}, {"_id": 0, "id": 1}
+        ).to_list(ORDER_EXPIRY_BATCH_SIZE)
+        if not candidates:
+            return units
+        claim = str(uuid.uuid4())
+        await db.orders.update_many(
+            {"id": {"$in": [order["id"] for order in candidates]}, "stock_release_pending": True},
+            {"$unset": {"stock_release_pending": ""}, "$set": {"stock_restock_claim": claim}}
+        )
+        orders = await db.orders.find({"stock_restock_claim": claim}, {"_id": 0, "items": 1}).to_list(None)
+        units += await restock_order_items([item for order in orders for item in order["items"]])
+        await db.orders.update_many({"stock_restock_claim": claim}, {"$unset": {"stock_restock_claim": ""}})
+
+async def commit_pending_order_stock() -> int:
+    """Retry the stock commit of orders finalize_order flagged stock_commit_pending.
+
+    Each order is claimed by clearing its flag before commit_stock runs, and flagged again if
+    the commit fails, so a commit that went through is not repeated.
+    """
+    committed = 0
+    while True:
+        order = await db.orders.find_one_and_update(
+            {"stock_commit_pending": True},
+            {"$unset": {"stock_commit_pending": ""}},
+            projection={"_id": 0, "id": 1, "items": 1}
+        )
+        if order is None:
+            return committed
+        products = await get_products_by_ids(list({item["product_id"] for item in order["items"]}))
+        try:
+            await commit_stock(order["id"], [item for item in order["items"] if item["product_id"] in products], products)
+        except Exception:
+            await db.orders.update_one({"id": order["id"]}, {"$set": {"stock_commit_pending": True}})
+            raise
+        await invalidate_catalog(list(products), broadcast=False)
+        committed += 1
+
+async def reinstate_order(order: dict, update_data: dict, tracking_event: dict) -> bool:
+    """Bring an expired or failed (cancelled) order back with update_data, taking its stock again.
+
+    Stock the expiry hasn't returned yet is simply kept; otherwise it is reserved afresh, all or
+    nothing. Returns False, leaving the order cancelled, when another reinstate or a restock run
+    holds the order or the stock has run out.
+    """
+    claim = str(uuid.uuid4())
+    claimed = await db.orders.update_one(
+        {"id": order["id"], "status": "cancelled", "payment_status": {"$in": REINSTATABLE_PAYMENT_STATUSES},
+         "reinstate_claim": {"$exists": False}, "stock_restock_claim": {"$exists": False}},
+        {"$set": {"reinstate_claim": claim}}
+    )
+    if claimed.modified_count == 0:
+        return False
+    
+    kept = await db.orders.update_one(
+        {"id": order["id"], "stock_release_pending": True}, {"$unset": {"stock_release_pending": ""}}
+    )
+    if not kept.modified_count:
+        products = await get_products_by_ids(list({item["product_id"] for item in order["items"]}))
+        items = [item for item in order["items"] if item["product_id"] in products]
+        if len(items) < len(order["items"]) or not await reserve_stock(order["id"], items, products):
+            await db.orders.update_one({"id": order["id"], "reinstate_claim": claim}, {"$unset": {"reinstate_claim": ""}})
+            return False
+        await commit_stock(order["id"], items, products)
+        await invalidate_catalog(list(products), broadcast=False)
+    
+    await db.orders.update_one(
+        {"id": order["id"], "reinstate_claim": claim},
+        {"$set": update_data, "$unset": {"reinstate_claim": "", "expired_at": "", "payment_review": ""},
+         "$push": {"tracking_history": tracking_event}}
+    )
+    return True
+
+async def apply_late_payment(order: dict) -> bool:
+    """Handle a Paystack payment that succeeded for an order already cancelled as expired or failed.
+
+    The order is reinstated as paid when its stock can be taken again; otherwise it stays
+    cancelled and is flagged payment_review for an admin to reinstate or refund. Returns whether
+    it was reinstated.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    reinstated = await reinstate_order(
+        order,
+        {"payment_status": "paid", "status": "confirmed", "updated_at": now},
+        {"status": "confirmed", "timestamp": now, "description": "Order reinstated: payment arrived after it was cancelled"}
+    )
+    if reinstated:
+        return True
+    await db.orders.update_one(
+        {"id": order["id"], "status": "cancelled", "reinstate_claim": {"$exists": False}, "payment_review": {"$exists": False}},
+        {
+            "$set": {"payment_review": "paid_after_cancellation", "updated_at": now},
+            "$push": {"tracking_history": {
+                "status": "payment_review",
+                "timestamp": now,
+                "description": "Payment arrived after the order was cancelled and its stock is gone; needs review"
+            }}
+        }
+    )
+    logger.warning(f"Order {order['id']} was paid after it was cancelled and could not be reinstated")
+    return False
+
+async def expire_unpaid_orders() -> int:
+    """Cancel awaiting_payment orders older than the payment window and give their stock back.
+
+    Pages the payment_status/created_at index in batches. A lease keeps the job to one worker
+    at a time, and each order is flipped with a status-conditional update, so an order paid or
+    confirmed in the meantime is never cancelled. Stock commits that failed at checkout are
+    retried first.
+    """
+    lease_seconds = max(ORDER_EXPIRY_INTERVAL_SECONDS, 60) * 2
+    if not await acquire_lease("order_expiry", lease_seconds):
+        order_expiry_stats["skipped_runs"] += 1
+        return 0
+    try:
+        # Before expiring anything, so an order is never restocked ahead of its own stock commit
+        commits_retried = await commit_pending_order_stock()
+        now = datetime.now(timezone.utc)
+        cutoff = (now - timedelta(hours=UNPAID_ORDER_EXPIRY_HOURS)).isoformat()
+        tracking_event = {
+            "status": "cancelled",
+            "timestamp": now.isoformat(),
+            "description": f"Order cancelled: payment not received within {UNPAID_ORDER_EXPIRY_HOURS:g} hours"
+        }
+        expired = 0
+        while True:
+            candidates = await db.orders.find(
+                {"payment_status": "awaiting_payment", "created_at": {"$lt": cutoff}}, {"_id": 0, "id": 1}
+            ).sort("created_at", 1).to_list(ORDER_EXPIRY_BATCH_SIZE)
+            if not candidates:
+                break
+            result = await db.orders.update_many(
+                {"id": {"$in": [order["id"] for order in candidates]}, "payment_status": "awaiting_payment"},
+                {
+                    "$set": {
+                        "payment_status": "expired",
+                        "status": "cancelled",
+                        "expired_at": now.isoformat(),
+                        "updated_at": now.isoformat(),
+                        "stock_release_pending": True
+                    },
+                    "$push": {"tracking_history": tracking_event}
+                }
+            )
+            expired += result.modified_count
+            await acquire_lease("order_expiry", lease_seconds)
+            if len(candidates) < ORDER_EXPIRY_BATCH_SIZE:
+                break
+        units = await release_expired_order_stock()
+    finally:
+        await release_lease("order_expiry")
+
+    order_expiry_stats["runs"] += 1
+    order_expiry_stats["expired_total"] += expired
+    order_expiry_stats["units_restocked_total"] += units
+    order_expiry_stats["stock_commits_retried_total"] += commits_retried
+    order_expiry_stats["last_expired"] = expired
+    order_expiry_stats["last_run_at"] = now.isoformat()
+    if expired:
+        logger.info(f"Expired {expired} unpaid orders and restocked {units} units")
+    return expired
+
+payment_event_stats = {
+    "received": 0,
+    "duplicates": 0,
+    "processed": 0,
+    "ignored": 0,
+    "orders_updated": 0,
+    "late_payments": 0,
+    "batches": 0,
+    "last_batch_at": None
+}
+
+payment_events_wakeup = asyncio.Event()
+
+async def process_payment_events() -> int:
+    """Apply queued webhook events in arrival order, a batch at a time.
+
+    A lease makes this single-consumer, so events for one reference are never applied out of
+    order. Updates are conditional on the order still pending, so replays write nothing; a
+    payment for an order already cancelled as expired or failed goes to apply_late_payment.
+    """
+    if not await acquire_lease("payment_events", 60):
+        return 0
+    handled = 0
+    try:
+        while True:
+            events = await db.payment_events.find(
+                {"status": "pending"}, {"_id": 0, "event_id": 1, "event": 1, "reference": 1}
+            ).sort("received_at", 1).to_list(PAYMENT_EVENT_BATCH_SIZE)
+            if not events:
+                break
+            handled_at = datetime.now(timezone.utc)
+            now = handled_at.isoformat()
+            # A BSON date, as the TTL index requires
+            expires_at = handled_at + timedelta(days=PAYMENT_EVENT_RETENTION_DAYS)
+            paid = list(dict.fromkeys(
+                e["reference"] for e in events if e["event"] == "charge.success" and e.get("reference")
+            ))
+            if paid:
+                result = await db.orders.bulk_write([
+                    UpdateOne(
+                        {"reference": reference, "payment_status": "pending"},
+                        {"$set": {"payment_status": "paid", "status": "confirmed", "updated_at": now}}
+                    )
+                    for reference in paid
+                ], ordered=False)
+                payment_event_stats["orders_updated"] += result.modified_count
+                if result.modified_count < len(paid):
+                    late = await db.orders.find(
+                        {"reference": {"$in": paid}, "payment_status": {"$in": REINSTATABLE_PAYMENT_STATUSES},
+                         "payment_review": {"$exists": False}},
+                        {"_id": 0, "id": 1, "items": 1}
+                    ).to_list(None)
+                    for order in late:
+                        await apply_late_payment(order)
+                    payment_event_stats["late_payments"] += len(late)
+            applied = [e["event_id"] for e in events if e["event"] == "charge.success" and e.get("reference")]
+            ignored = [e["event_id"] for e in events if e["event"] != "charge.success" or not e.get("reference")]
+            await db.payment_events.bulk_write([
+                UpdateMany(
+                    {"event_id": {"$in": ids}},
+                    {"$set": {"status": status, "processed_at": now, "expires_at": expires_at}}
+                )
+                for status, ids in (("processed", applied), ("ignored", ignored)) if ids
+            ], ordered=False)
+            payment_event_stats["processed"] += len(applied)
+            payment_event_stats["ignored"] += len(ignored)
+            payment_event_stats["batches"] += 1
+            payment_event_stats["last_batch_at"] = now
+            handled += len(events)
+            await acquire_lease("payment_events", 60)
+            if len(events) < PAYMENT_EVENT_BATCH_SIZE:
+                break
+    finally:
+        await release_lease("payment_events")
+    return handled
+
+async def payment_event_worker():
+    """Drain the webhook inbox whenever an event arrives, and every poll interval regardless"""
+    while True:
+        try:
+            await asyncio.wait_for(payment_events_wakeup.wait(), timeout=PAYMENT_EVENT_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        payment_events_wakeup.clear()
+        try:
+            await process_payment_events()
+        except Exception as e:
+            logger.error(f"Payment event processing failed: {e}")
+
+class RateLimiter:
+    """Spaces calls at least 1/rate seconds apart across all concurrent callers"""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._next_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next_at - now
+            self._next_at = max(now, self._next_at) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+reconcile_stats = {
+    "runs": 0,
+    "skipped_runs": 0,
+    "checked_total": 0,
+    "paid_total": 0,
+    "failed_total": 0,
+    "errors_total": 0,
+    "last_checked": 0,
+    "last_duration_seconds": 0,
+    "last_orders_per_second": 0,
+    "last_run_at": None
+}
+
+def reconcile_window() -> dict:
+    now = datetime.now(timezone.utc)
+    recheck_seconds = max(RECONCILE_RECHECK_MINUTES * 60, RECONCILE_INTERVAL_SECONDS)
+    return {
+        "payment_status": "pending",
+        "payment_method": "paystack",
+        "created_at": {
+            "$lt": (now - timedelta(minutes=RECONCILE_MIN_AGE_MINUTES)).isoformat(),
+            "$gte": (now - timedelta(hours=RECONCILE_MAX_AGE_HOURS)).isoformat()
+        },
+        # Abandoned checkouts stay pending for days; don't ask Paystack about them every run
+        "$or": [
+            {"reconciled_at": {"$exists": False}},
+            {"reconciled_at": {"$lt": (now - timedelta(seconds=recheck_seconds)).isoformat()}}
+        ]
+    }
+
+async def fetch_paystack_status(reference: str, limiter: RateLimiter, slots: asyncio.Semaphore) -> Optional[str]:
+    """Paystack's status for a transaction, or None when it couldn't be fetched"""
+    async with slots:
+        await limiter.wait()
+        try:
+            response = await paystack_client.request("GET", f"/transaction/verify/{reference}")
+            if is_provider_failure(response):
+                raise httpx.HTTPStatusError(f"HTTP {response.status_code}", request=response.request, response=response)
+            data = response.json()
+        except Exception as e:
+            logger.error(f"Reconciliation lookup failed for {reference}: {e}")
+            return None
+    if not data.get("status"):
+        # Paystack answers status: false for references it never saw (checkout never opened)
+        return "not_found"
+    return (data.get("data") or {}).get("status")
+
+async def reconcile_pending_payments() -> dict:
+    """Verify stale pending Paystack orders with the provider and apply the outcomes in bulk.
+
+    Pages the payment_status/created_at index by keyset cursor; every page is verified
+    concurrently within the rate limit and written back with one bulk_write. Failed payments
+    are cancelled and their stock handed to release_expired_order_stock.
+    """
+    if not await acquire_lease("payment_reconciliation", max(RECONCILE_INTERVAL_SECONDS, 60) * 2):
+        reconcile_stats["skipped_runs"] += 1
+        return reconcile_stats
+    started = time.monotonic()
+    limiter = RateLimiter(RECONCILE_RATE_PER_SECOND)
+    slots = asyncio.Semaphore(RECONCILE_CONCURRENCY)
+    checked = paid = failed = errors = 0
+    query = reconcile_window()
+    cursor = None
+    try:
+        while True:
+            orders, cursor = await fetch_page(
+                db.orders, query, {"_id": 0, "id": 1, "reference": 1, "created_at": 1},
+                "created_at", RECONCILE_BATCH_SIZE, cursor=cursor
+            )
+            if not orders:
+                break
+            statuses = await asyncio.gather(*(
+                fetch_paystack_status(order["reference"], limiter, slots) for order in orders
+            ))
+            now = datetime.now(timezone.utc).isoformat()
+            writes = []
+            for order, paystack_status in zip(orders, statuses):
+                # Conditional on still pending, so a webhook or verify that landed meanwhile wins
+                target = {"id": order["id"], "payment_status": "pending"}
+                if paystack_status == "success":
+                    paid += 1
+                    writes.append(UpdateOne(target, {
+                        "$set": {"payment_status": "paid", "status": "confirmed", "updated_at": now, "reconciled_at": now},
+                        "$push": {"tracking_history": {
+                            "status": "confirmed",
+                            "timestamp": now,
+                            "description": "Payment confirmed by reconciliation with Paystack"
+                        }}
+                    }))
+                elif paystack_status in ("failed", "reversed"):
+                    failed += 1
+                    writes.append(UpdateOne(target, {
+                        "$set": {
+                            "payment_status": "failed",
+                            "status": "cancelled",
+                            "stock_release_pending": True,
+                            "updated_at": now,
+                            "reconciled_at": now
+                        },
+                        "$push": {"tracking_history": {
+                            "status": "cancelled",
+                            "timestamp": now,
+                            "description": f"Order cancelled: Paystack reported the payment {paystack_status}"
+                        }}
+                    }))
+                elif paystack_status is None:
+                    errors += 1
+                else:
+                    writes.append(UpdateOne(target, {"$set": {"reconciled_at": now}}))
+            if writes:
+                await db.orders.bulk_write(writes, ordered=False)
+            checked += len(orders)
+            await acquire_lease("payment_reconciliation", max(RECONCILE_INTERVAL_SECONDS, 60) * 2)
+            if cursor is None:
+                break
+        if failed:
+            await release_expired_order_stock()
+    finally:
+        await release_lease("payment_reconciliation")
+
+    duration = time.monotonic() - started
+    reconcile_stats["runs"] += 1
+    reconcile_stats["checked_total"] += checked
+    reconcile_stats["paid_total"] += paid
+    reconcile_stats["failed_total"] += failed
+    reconcile_stats["errors_total"] += errors
+    reconcile_stats["last_checked"] = checked
+    reconcile_stats["last_duration_seconds"] = round(duration, 3)
+    reconcile_stats["last_orders_per_second"] = round(checked / duration, 2) if duration else 0
+    reconcile_stats["last_run_at"] = datetime.now(timezone.utc).isoformat()
+    if checked:
+        logger.info(f"Reconciled {checked} pending Paystack orders: {paid} paid, {failed} failed, {errors} errors")
+    return reconcile_stats
+
 # Include router and middleware
 app.include_router(api_router)
 
 # Mount static files for uploads under /api prefix so it routes correctly through ingress
 app.mount("/api/uploads", StaticFiles(directory=str(UPLOADS_DIR)), name="uploads")
 
+if BrotliMiddleware is not None:
+    app.add_middleware(BrotliMiddleware, minimum_size=COMPRESSION_MINIMUM_SIZE, gzip_fallback=True)
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=COMPRESSION_MINIMUM_SIZE)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -1483,6 +4156,52 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def startup_bootstrap_database():
+    try:
+        await bootstrap_database()
+    except Exception as e:
+        # Never keep the API down because of an index build; the admin report shows what's missing
+        logger.error(f"Database bootstrap failed: {e}")
+
+@app.on_event("startup")
+async def startup_http_clients():
+    for provider in PROVIDER_CLIENTS:
+        provider.open()
+
+@app.on_event("startup")
+async def startup_background_jobs():
+    start_background_job("cart_sweeper", CART_SWEEP_INTERVAL_SECONDS, sweep_idle_carts)
+    start_background_job("order_expiry", ORDER_EXPIRY_INTERVAL_SECONDS, expire_unpaid_orders)
+    start_background_job("crypto_rates", CRYPTO_RATE_REFRESH_SECONDS, crypto_rates.refresh_in_background)
+    background_tasks.append(asyncio.create_task(payment_event_worker()))
+    start_background_job("payment_reconciliation", RECONCILE_INTERVAL_SECONDS, reconcile_pending_payments)
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    # Let deferred work (which may defer more) finish while Mongo is still open
+    while deferred_tasks:
+        await asyncio.gather(*deferred_tasks, return_exceptions=True)
+    await asyncio.gather(*(provider.close() for provider in PROVIDER_CLIENTS))
     client.close()
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Gs Premier Fit Fan maintenance commands")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    indexes_parser = subcommands.add_parser("indexes", help="Report MongoDB indexes and their sizes")
+    indexes_parser.add_argument("--apply", action="store_true", help="Apply pending migrations and indexes first")
+    args = parser.parse_args()
+
+    async def run_indexes_command():
+        if args.apply:
+            await run_migrations()
+            await ensure_indexes(force=True)
+        print(json.dumps(await index_report(), indent=2))
+
+    if args.command == "indexes":
+        asyncio.run(run_indexes_command())
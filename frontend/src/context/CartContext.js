@@ -20,7 +20,12 @@ export const CartProvider = ({ children }) => {
 
   useEffect(() => {
     if (isAuthenticated) {
-      fetchCart();
+      const localCart = JSON.parse(localStorage.getItem('cart') || 'null');
+      if (localCart?.items?.length) {
+        mergeLocalCart(localCart.items);
+      } else {
+        fetchCart();
+      }
     } else {
       // Use local storage for non-authenticated users
       const localCart = localStorage.getItem('cart');
@@ -42,6 +47,24 @@ export const CartProvider = ({ children }) => {
     }
   };
 
+  // Move the guest cart into the account cart with one request instead of one per line
+  const mergeLocalCart = async (items) => {
+    try {
+      setLoading(true);
+      const operations = items.map(item => ({
+        op: 'add', product_id: item.product_id, quantity: item.quantity, size: item.size, color: item.color
+      }));
+      const response = await axios.post(`${API_URL}/cart/batch`, { operations });
+      localStorage.removeItem('cart');
+      setCart(response.data);
+    } catch (error) {
+      console.error('Failed to merge cart:', error);
+      await fetchCart();
+    } finally {
+      setLoading(false);
+    }
+  };
+
   const addToCart = async (productId, quantity, size, color) => {
     if (isAuthenticated) {
       try {
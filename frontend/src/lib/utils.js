@@ -49,3 +49,16 @@ export function getImageUrl(imagePath) {
   // Otherwise return as-is
   return imagePath;
 }
+
+// Random key for the Idempotency-Key header. crypto.randomUUID only exists on secure (https/localhost)
+// origins, so elsewhere build a v4-style id from crypto.getRandomValues
+export function newIdempotencyKey() {
+  if (typeof crypto.randomUUID === 'function') {
+    return crypto.randomUUID();
+  }
+  const bytes = crypto.getRandomValues(new Uint8Array(16));
+  bytes[6] = (bytes[6] & 0x0f) | 0x40;
+  bytes[8] = (bytes[8] & 0x3f) | 0x80;
+  const hex = Array.from(bytes, (b) => b.toString(16).padStart(2, '0')).join('');
+  return `${hex.slice(0, 8)}-${hex.slice(8, 12)}-${hex.slice(12, 16)}-${hex.slice(16, 20)}-${hex.slice(20)}`;
+}
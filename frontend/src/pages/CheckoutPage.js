@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useNavigate, useSearchParams } from 'react-router-dom';
 import { motion } from 'framer-motion';
 import { CreditCard, Building2, Bitcoin, Copy, Check, ArrowRight, Loader2, Clock, Eye, Package } from 'lucide-react';
@@ -11,7 +11,7 @@ import { Label } from '../components/ui/label';
 import { RadioGroup, RadioGroupItem } from '../components/ui/radio-group';
 import { useCart } from '../context/CartContext';
 import { useAuth } from '../context/AuthContext';
-import { formatPrice, API_URL } from '../lib/utils';
+import { formatPrice, API_URL, newIdempotencyKey } from '../lib/utils';
 import { toast } from 'sonner';
 
 const CheckoutPage = () => {
@@ -93,6 +93,8 @@ const CheckoutPage = () => {
       const response = await axios.post(`${API_URL}/payments/verify`, {
         reference,
         order_id: orderId,
+      }, {
+        headers: { 'Idempotency-Key': `verify-${reference}` },
       });
 
       if (response.data.status === 'success') {
@@ -100,6 +102,11 @@ const CheckoutPage = () => {
         localStorage.removeItem('pending_order_id');
         setStep(4);
         setOrderResult({ reference, status: 'paid' });
+      } else if (response.data.status === 'review') {
+        // Paid after the order was cancelled: the shop follows up, so don't invite another payment
+        toast.warning(response.data.message);
+        localStorage.removeItem('pending_order_id');
+        navigate('/account');
       } else {
         toast.error('Payment verification failed');
         setStep(3);
@@ -169,6 +176,12 @@ const CheckoutPage = () => {
   };
 
   const [processingOrder, setProcessingOrder] = useState(false);
+  // Reused when a submit is retried (double click, dropped connection) so the server creates one order.
+  // Created on first use rather than passed to useRef, which would generate a new one every render
+  const orderIdempotencyKey = useRef(null);
+  if (orderIdempotencyKey.current === null) {
+    orderIdempotencyKey.current = newIdempotencyKey();
+  }
 
   const handlePaymentSubmit = async () => {
     setLoading(true);
@@ -186,8 +199,12 @@ const CheckoutPage = () => {
         })),
       };
 
-      const response = await axios.post(`${API_URL}/orders`, orderData);
+      const response = await axios.post(`${API_URL}/orders`, orderData, {
+        headers: { 'Idempotency-Key': orderIdempotencyKey.current },
+      });
       const { order_id, reference, payment_info, payment_method, total, status, payment_status } = response.data;
+      // This order is placed; another checkout from this page is a new order
+      orderIdempotencyKey.current = newIdempotencyKey();
 
       localStorage.setItem('pending_order_id', order_id);
       setOrderResult({ order_id, reference, payment_info, payment_method, total, status, payment_status });
@@ -211,6 +228,12 @@ const CheckoutPage = () => {
         setStep(3);
       }
     } catch (error) {
+      // The server answered, so the next submit is a new attempt rather than a retry, unless
+      // it answered that the first submit with this key is still being processed
+      const stillProcessing = error.response?.status === 409 && /Idempotency-Key/.test(error.response.data?.detail || '');
+      if (error.response && !stillProcessing) {
+        orderIdempotencyKey.current = newIdempotencyKey();
+      }
       toast.error(error.response?.data?.detail || 'Failed to create order');
       setProcessingOrder(false);
     } finally {
@@ -646,12 +669,24 @@ const CheckoutPage = () => {
                           <span className="text-neutral-600">Amount (NGN)</span>
                           <span className="font-bold">{formatPrice(orderResult.payment_info?.amount_ngn)}</span>
                         </div>
-                        <div className="flex justify-between items-center">
-                          <span className="text-neutral-600">Approx. {orderResult.payment_info?.crypto_type}</span>
-                          <span className="font-mono font-bold">
-                            {getCryptoAmount(orderResult.payment_info?.amount_ngn, orderResult.payment_info?.crypto_type?.toLowerCase())}
-                          </span>
-                        </div>
+                        {orderResult.payment_info?.quote ? (
+                          <div className="flex justify-between items-center">
+                            <span className="text-neutral-600">Amount ({orderResult.payment_info?.crypto_type})</span>
+                            <span className="font-mono font-bold">{orderResult.payment_info.quote.crypto_amount}</span>
+                          </div>
+                        ) : (
+                          <div className="flex justify-between items-center">
+                            <span className="text-neutral-600">Approx. {orderResult.payment_info?.crypto_type}</span>
+                            <span className="font-mono font-bold">
+                              {getCryptoAmount(orderResult.payment_info?.amount_ngn, orderResult.payment_info?.crypto_type?.toLowerCase())}
+                            </span>
+                          </div>
+                        )}
+                        {orderResult.payment_info?.quote && (
+                          <p className="text-xs text-neutral-500">
+                            Rate locked until {new Date(orderResult.payment_info.quote.expires_at).toLocaleTimeString()}
+                          </p>
+                        )}
                       </div>
                       <p className="text-sm text-neutral-600">
                         Send the exact amount and include <strong>{orderResult.reference}</strong> in the memo if possible.
@@ -293,7 +293,7 @@ const HomePage = () => {
 
   const fetchFeaturedProducts = async () => {
     try {
-      const response = await axios.get(`${API_URL}/products?featured=true&limit=4`);
+      const response = await axios.get(`${API_URL}/products?featured=true&limit=4&view=card`);
       setFeaturedProducts(response.data.products);
     } catch (error) {
       console.error('Failed to fetch products:', error);
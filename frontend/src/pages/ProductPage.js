@@ -98,7 +98,7 @@ const ProductPage = () => {
         setSelectedSize(response.data.sizes[0]);
       }
       // Fetch related products
-      const relatedRes = await axios.get(`${API_URL}/products?sport=${response.data.sport}&limit=4`);
+      const relatedRes = await axios.get(`${API_URL}/products?sport=${response.data.sport}&limit=4&view=card`);
       setRelatedProducts(relatedRes.data.products.filter(p => p.id !== id).slice(0, 4));
     } catch (error) {
       console.error('Failed to fetch product:', error);
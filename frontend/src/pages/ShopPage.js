@@ -26,6 +26,14 @@ import { Checkbox } from '../components/ui/checkbox';
 import { Slider } from '../components/ui/slider';
 import { API_URL, formatPrice } from '../lib/utils';
 
+// Sort select value -> server-side sort option
+const SORT_OPTIONS = {
+  newest: 'newest',
+  'price-low': 'price_asc',
+  'price-high': 'price_desc',
+  name: 'name',
+};
+
 const ShopPage = () => {
   const [searchParams, setSearchParams] = useSearchParams();
   const [products, setProducts] = useState([]);
@@ -50,29 +58,10 @@ const ShopPage = () => {
   const [priceRange, setPriceRange] = useState([0, 200000]);
   const [mobileFiltersOpen, setMobileFiltersOpen] = useState(false);
 
-  useEffect(() => {
-    fetchFilters();
-  }, []);
-
   useEffect(() => {
     fetchProducts();
   }, [filters]);
 
-  const fetchFilters = async () => {
-    try {
-      const [sportsRes, categoriesRes, collectionsRes] = await Promise.all([
-        axios.get(`${API_URL}/sports`),
-        axios.get(`${API_URL}/categories`),
-        axios.get(`${API_URL}/collections`),
-      ]);
-      setSports(sportsRes.data.sports || []);
-      setCategories(categoriesRes.data.categories || []);
-      setCollections(collectionsRes.data.collections || []);
-    } catch (error) {
-      console.error('Failed to fetch filters:', error);
-    }
-  };
-
   const fetchProducts = async () => {
     try {
       setLoading(true);
@@ -84,18 +73,19 @@ const ShopPage = () => {
       if (filters.minPrice > 0) params.append('min_price', filters.minPrice);
       if (filters.maxPrice < 200000) params.append('max_price', filters.maxPrice);
       if (filters.search) params.append('search', filters.search);
-
-      const response = await axios.get(`${API_URL}/products?${params.toString()}`);
-      let productList = response.data.products || [];
-
-      // Sort
-      if (filters.sortBy === 'price-low') {
-        productList.sort((a, b) => a.price - b.price);
-      } else if (filters.sortBy === 'price-high') {
-        productList.sort((a, b) => b.price - a.price);
-      } else if (filters.sortBy === 'name') {
-        productList.sort((a, b) => a.name.localeCompare(b.name));
+      // Searches keep relevance order unless another sort is picked
+      if (!filters.search || filters.sortBy !== 'newest') {
+        params.append('sort', SORT_OPTIONS[filters.sortBy] || 'newest');
       }
+      params.append('view', 'card');
+
+      // Products and filter options (facets) come back in a single call
+      const response = await axios.get(`${API_URL}/products/browse?${params.toString()}`);
+      const productList = response.data.products || [];
+      const facets = response.data.facets || {};
+      setSports((facets.sport || []).map((facet) => facet.value));
+      setCategories((facets.category || []).map((facet) => facet.value));
+      setCollections((facets.collection || []).map((facet) => facet.value));
 
       setProducts(productList);
       setTotal(response.data.total || 0);
@@ -93,11 +93,14 @@ const AdminOrders = () => {
     }
   };
 
-  const handleConfirmPayment = async (orderId) => {
+  // Expired orders are reinstated instead, which takes their stock again before confirming
+  const handleConfirmPayment = async (orderId, reinstate = false) => {
     try {
       setConfirmingPayment(orderId);
-      await axios.post(`${API_URL}/admin/orders/${orderId}/confirm-payment`);
-      toast.success('Payment confirmed! Customer has been notified via email.');
+      await axios.post(`${API_URL}/admin/orders/${orderId}/${reinstate ? 'reinstate' : 'confirm-payment'}`);
+      toast.success(reinstate
+        ? 'Order reinstated and payment confirmed! Customer has been notified via email.'
+        : 'Payment confirmed! Customer has been notified via email.');
       fetchOrders();
       if (selectedOrder?.id === orderId) {
         setSelectedOrder({ ...selectedOrder, payment_status: 'paid', status: 'processing' });
@@ -129,6 +132,7 @@ const AdminOrders = () => {
       case 'pending': return 'bg-yellow-100 text-yellow-800';
       case 'awaiting_payment': return 'bg-orange-100 text-orange-800';
       case 'failed': return 'bg-red-100 text-red-800';
+      case 'expired': return 'bg-red-100 text-red-800';
       default: return 'bg-neutral-100 text-neutral-800';
     }
   };
@@ -139,6 +143,7 @@ const AdminOrders = () => {
       case 'pending': return 'Pending';
       case 'paid': return 'Paid';
       case 'failed': return 'Failed';
+      case 'expired': return 'Expired';
       default: return status;
     }
   };
@@ -262,6 +267,31 @@ const AdminOrders = () => {
                           )}
                         </Button>
                       )}
+                      {order.payment_review === 'paid_after_cancellation' && (
+                        <Badge className="bg-red-100 text-red-800">Paid after cancellation</Badge>
+                      )}
+                      {(order.payment_status === 'expired' || order.payment_review) && (
+                        <Button
+                          size="sm"
+                          variant="outline"
+                          onClick={() => handleConfirmPayment(order.id, true)}
+                          disabled={confirmingPayment === order.id}
+                          className="text-xs h-7 border-green-500 text-green-700 hover:bg-green-50"
+                          data-testid={`reinstate-order-${order.id}`}
+                        >
+                          {confirmingPayment === order.id ? (
+                            <>
+                              <Loader2 className="w-3 h-3 animate-spin mr-1" />
+                              Reinstating...
+                            </>
+                          ) : (
+                            <>
+                              <CheckCircle className="w-3 h-3 mr-1" />
+                              Reinstate & Confirm
+                            </>
+                          )}
+                        </Button>
+                      )}
                     </div>
                   </td>
                   <td className="p-4">
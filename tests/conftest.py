@@ -0,0 +1,29 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# server.py reads these at import time; tests never connect to them
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+
+@pytest.fixture
+def server():
+    import server as server_module
+    return server_module
+
+
+@pytest.fixture
+def db(server, monkeypatch):
+    """An in-memory database swapped in for server.db, with the catalog caches emptied"""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    database = mongomock_motor.AsyncMongoMockClient()["test_database"]
+    monkeypatch.setattr(server, "db", database)
+    monkeypatch.setitem(server.catalog_state, "version", None)
+    monkeypatch.setitem(server.catalog_state, "stock_version", None)
+    monkeypatch.setitem(server.catalog_state, "checked_at", 0.0)
+    server._clear_catalog_caches()
+    return database
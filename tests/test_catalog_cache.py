@@ -0,0 +1,48 @@
+import asyncio
+
+
+async def seed_product(db, stock: int = 10):
+    await db.products.insert_one({"id": "p1", "name": "Tee", "price": 1000, "stock": stock, "version": 1})
+
+
+def other_worker_changes_stock(server, db):
+    """Simulate another worker selling stock: the document moves and only stock_version is bumped"""
+    async def change():
+        await db.products.update_one({"id": "p1"}, {"$inc": {"stock": -3}})
+        await db.settings.update_one({"type": "catalog_version"}, {"$inc": {"stock_version": 1}}, upsert=True)
+        server.catalog_state["checked_at"] = 0.0
+    return change()
+
+
+def test_stock_change_elsewhere_expires_cached_products(server, db):
+    async def scenario():
+        await seed_product(db)
+        before = await server.get_cached_product("p1")
+        await other_worker_changes_stock(server, db)
+        after = await server.get_cached_product("p1")
+        return before, after
+
+    before, after = asyncio.run(scenario())
+    assert before["stock"] == 10
+    assert after["stock"] == 7
+
+
+def test_stock_change_keeps_product_versions_cached(server, db):
+    async def scenario():
+        await seed_product(db)
+        await server.get_product_versions(["p1"])
+        await other_worker_changes_stock(server, db)
+        await server.sync_catalog_version()
+        return server.product_version_cache.get("p1")
+
+    assert asyncio.run(scenario()) == 1
+
+
+def test_local_stock_invalidation_bumps_only_the_stock_version(server, db):
+    async def scenario():
+        await seed_product(db)
+        await server.invalidate_catalog(["p1"])
+        await server.invalidate_catalog(["p1"], broadcast=False)
+        return await db.settings.find_one({"type": "catalog_version"}, {"_id": 0, "version": 1, "stock_version": 1})
+
+    assert asyncio.run(scenario()) == {"version": 1, "stock_version": 1}
@@ -0,0 +1,78 @@
+import asyncio
+
+import httpx
+import pytest
+
+ETAG = 'W/"abc"'
+
+
+@pytest.mark.parametrize("header, matches", [
+    (None, False),
+    ("", False),
+    ('W/"abc"', True),
+    ('"abc"', True),  # weak comparison ignores the W/ prefix
+    ('W/"abd"', False),
+    ("*", True),
+    ('"x", W/"abc"', True),
+    ('"x",W/"y"', False),
+    ('  W/"abc"  ,"x"', True),
+])
+def test_etag_matches(server, header, matches):
+    assert server.etag_matches(header, ETAG) is matches
+
+
+def test_catalog_etag_varies_with_version_path_and_query(server):
+    def etag(version, url):
+        request = httpx.Request("GET", url)
+        scope = {
+            "type": "http", "method": "GET", "path": request.url.path,
+            "query_string": request.url.query, "headers": [],
+        }
+        return server.catalog_etag(server.Request(scope), version)
+
+    base = etag((1, 0), "http://t/api/products?sport=Football&limit=2")
+    assert base == etag((1, 0), "http://t/api/products?limit=2&sport=Football")
+    assert base != etag((1, 1), "http://t/api/products?sport=Football&limit=2")
+    assert base != etag((2, 0), "http://t/api/products?sport=Football&limit=2")
+    assert base != etag((1, 0), "http://t/api/products/browse?sport=Football&limit=2")
+    assert base != etag((1, 0), "http://t/api/products?sport=Basketball&limit=2")
+
+
+PRODUCT = {"id": "p1", "name": "Tee", "price": 1000, "stock": 10, "sold_count": 0, "average_rating": 0,
+           "review_count": 0, "created_at": "2026-01-01T00:00:00+00:00"}
+
+
+def revalidate_after(server, db, change):
+    """(first status, revalidation status after change, whether the ETag moved) for /products"""
+    async def scenario():
+        await db.products.insert_one(dict(PRODUCT))
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test/api") as client:
+            first = await client.get("/products")
+            etag = first.headers["etag"]
+            unchanged = await client.get("/products", headers={"If-None-Match": etag})
+            await change()
+            again = await client.get("/products", headers={"If-None-Match": etag})
+            return first.status_code, unchanged.status_code, again.status_code, again.json()
+    return asyncio.run(scenario())
+
+
+def test_stock_change_moves_the_listing_etag(server, db):
+    async def sell():
+        await db.products.update_one({"id": "p1"}, {"$inc": {"stock": -2}})
+        await server.invalidate_catalog(["p1"], broadcast=False)
+
+    first, unchanged, again, body = revalidate_after(server, db, sell)
+    assert (first, unchanged, again) == (200, 304, 200)
+    assert body["products"][0]["stock"] == 8
+
+
+def test_rating_change_moves_the_listing_etag(server, db):
+    async def review():
+        await db.reviews.insert_one({"id": "r1", "product_id": "p1", "user_id": "u1", "rating": 4})
+        await server.update_product_rating("p1")
+
+    first, unchanged, again, body = revalidate_after(server, db, review)
+    assert (first, unchanged, again) == (200, 304, 200)
+    assert body["products"][0]["average_rating"] == 4
+    assert body["products"][0]["review_count"] == 1
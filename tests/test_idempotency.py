@@ -0,0 +1,180 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+
+def keyed_request(key: str = "key-1") -> Request:
+    return Request({"type": "http", "headers": [(b"idempotency-key", key.encode())]})
+
+
+@pytest.fixture
+def keys(db):
+    asyncio.run(db.idempotency.create_index("key", unique=True))
+    return db.idempotency
+
+
+def run(server, handler, payload=None, **kwargs):
+    return server.run_idempotent(keyed_request(), "orders", "u1", payload or {"n": 1}, handler, **kwargs)
+
+
+class Handler:
+    """Counts calls; optionally waits on an event before answering"""
+
+    def __init__(self, result=None, error=None, gate=None):
+        self.calls = 0
+        self.result = result or {"ok": True}
+        self.error = error
+        self.gate = gate
+
+    async def __call__(self):
+        self.calls += 1
+        if self.gate is not None:
+            await self.gate.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def test_retry_replays_the_stored_result(server, keys):
+    handler = Handler(result={"order_id": "o1"})
+
+    async def scenario():
+        return await run(server, handler), await run(server, handler)
+
+    first, second = asyncio.run(scenario())
+
+    assert first == {"order_id": "o1"}
+    assert second.status_code == 200
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert second.body == b'{"order_id":"o1"}'
+    assert handler.calls == 1
+
+
+def test_concurrent_retry_gets_409_while_processing(server, keys):
+    async def scenario():
+        gate = asyncio.Event()
+        first = asyncio.create_task(run(server, Handler(gate=gate)))
+        await asyncio.sleep(0.01)
+        with pytest.raises(HTTPException) as error:
+            await run(server, Handler())
+        gate.set()
+        await first
+        return error.value
+
+    assert asyncio.run(scenario()).status_code == 409
+
+
+def test_reusing_a_key_with_another_body_is_rejected(server, keys):
+    async def scenario():
+        await run(server, Handler(), payload={"n": 1})
+        with pytest.raises(HTTPException) as error:
+            await run(server, Handler(), payload={"n": 2})
+        return error.value
+
+    assert asyncio.run(scenario()).status_code == 422
+
+
+def test_expired_lease_is_taken_over_and_the_stale_owner_cannot_store(server, keys, monkeypatch):
+    # Every claim's lease has already run out, so the next retry may take it over
+    monkeypatch.setattr(server, "IDEMPOTENCY_LOCK_SECONDS", -1)
+    stale = Handler(result={"from": "stale"}, gate=asyncio.Event())
+    retry = Handler(result={"from": "retry"})
+
+    async def scenario():
+        stale_task = asyncio.create_task(run(server, stale))
+        await asyncio.sleep(0.01)
+        taken_over = await run(server, retry)
+        stale.gate.set()
+        await stale_task
+        return taken_over, await run(server, Handler())
+
+    taken_over, replayed = asyncio.run(scenario())
+
+    assert taken_over == {"from": "retry"}
+    assert replayed.body == b'{"from":"retry"}'
+
+
+def test_client_errors_are_replayed_and_server_errors_free_the_key(server, keys):
+    async def scenario():
+        outcomes = []
+        for handler in (Handler(error=HTTPException(status_code=503, detail="down")),
+                        Handler(error=HTTPException(status_code=409, detail="sold out")),
+                        Handler()):
+            try:
+                outcomes.append(await run(server, handler))
+            except HTTPException as e:
+                outcomes.append(e.status_code)
+        return outcomes
+
+    down, sold_out, replayed = asyncio.run(scenario())
+
+    assert (down, sold_out) == (503, 409)
+    assert replayed.status_code == 409
+    assert replayed.body == b'{"detail":"sold out"}'
+
+
+def test_cancelled_request_frees_the_key(server, keys):
+    async def scenario():
+        task = asyncio.create_task(run(server, Handler(gate=asyncio.Event())))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return await keys.count_documents({})
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_result_stored_by_the_handler_survives_a_later_failure(server, keys):
+    async def handler():
+        await server.store_idempotent_result({"order_id": "o1"})
+        raise RuntimeError("finishing up failed")
+
+    async def scenario():
+        with pytest.raises(RuntimeError):
+            await run(server, handler)
+        return await run(server, Handler())
+
+    replayed = asyncio.run(scenario())
+    assert replayed.body == b'{"order_id":"o1"}'
+
+
+def test_failed_stock_commit_still_answers_and_is_retried(server, db, keys, monkeypatch):
+    real_commit_stock = server.commit_stock
+
+    async def failing_commit_stock(*args):
+        raise RuntimeError("commit failed")
+
+    def place(order):
+        timer = server.PhaseTimer(server.PhaseStats())
+        user = {"id": "u1", "email": "ada@example.com"}
+        return run(server, lambda: server.place_order(order, user, timer), payload=order.model_dump())
+
+    async def scenario():
+        await db.products.insert_one({"id": "p1", "name": "Tee", "price": 1000, "images": [], "stock": 5, "sold_count": 0})
+        order = server.OrderCreate(
+            shipping_address=server.ShippingAddress(
+                full_name="Ada", address="1 Road", city="Lagos", state="Lagos", phone="080", email="ada@example.com"
+            ),
+            payment_method="bank_transfer",
+            items=[server.CartItem(product_id="p1", quantity=2, size="M")]
+        )
+        monkeypatch.setattr(server, "commit_stock", failing_commit_stock)
+        placed = await place(order)
+        replayed = await place(order)
+        flagged = await db.orders.count_documents({"stock_commit_pending": True})
+        monkeypatch.setattr(server, "commit_stock", real_commit_stock)
+        retried = await server.commit_pending_order_stock()
+        product = await db.products.find_one({"id": "p1"}, {"_id": 0})
+        return placed, replayed, flagged, retried, await db.orders.count_documents({}), product
+
+    placed, replayed, flagged, retried, orders, product = asyncio.run(scenario())
+
+    assert replayed.headers["Idempotent-Replayed"] == "true"
+    assert placed["order_id"].encode() in replayed.body
+    assert orders == 1
+    assert (flagged, retried) == (1, 1)
+    assert product["stock"] == 3
+    assert not product.get("reservations")
@@ -0,0 +1,123 @@
+import asyncio
+from datetime import datetime, timezone
+
+import httpx
+import pytest
+
+
+def order(payment_status: str, status: str, reference: str = "GSP-1") -> dict:
+    return {
+        "id": "o1",
+        "reference": reference,
+        "user_email": "ada@example.com",
+        "payment_method": "paystack",
+        "payment_status": payment_status,
+        "status": status,
+        "items": [{"product_id": "p1", "product_name": "Tee", "quantity": 2, "size": "M", "color": None}],
+        "tracking_history": [],
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+async def seed(db, stock: int, **order_fields):
+    await db.products.insert_one({"id": "p1", "name": "Tee", "price": 1000, "images": [], "stock": stock, "sold_count": 0})
+    await db.orders.insert_one(order(**order_fields))
+
+
+async def deliver_charge_success(server, db, times: int = 1):
+    for attempt in range(times):
+        await db.payment_events.insert_one({
+            "event_id": f"charge.success:{attempt}",
+            "event": "charge.success",
+            "reference": "GSP-1",
+            "status": "pending",
+            "received_at": datetime.now(timezone.utc).isoformat(),
+        })
+        await server.process_payment_events()
+
+
+async def state(db):
+    return (await db.orders.find_one({"id": "o1"}, {"_id": 0}), await db.products.find_one({"id": "p1"}, {"_id": 0}))
+
+
+def test_late_payment_reinstates_a_failed_order_while_stock_lasts(server, db):
+    async def scenario():
+        # Reconciliation cancelled it and already gave the 2 units back
+        await seed(db, stock=3, payment_status="failed", status="cancelled")
+        await deliver_charge_success(server, db)
+        return await state(db)
+
+    placed, product = asyncio.run(scenario())
+
+    assert (placed["payment_status"], placed["status"]) == ("paid", "confirmed")
+    assert (product["stock"], product["sold_count"]) == (1, 2)
+    assert "payment_review" not in placed
+
+
+def test_late_payment_without_stock_is_flagged_once_and_never_oversells(server, db):
+    async def scenario():
+        await seed(db, stock=1, payment_status="failed", status="cancelled")
+        await deliver_charge_success(server, db, times=2)
+        return await state(db)
+
+    placed, product = asyncio.run(scenario())
+
+    assert (placed["payment_status"], placed["status"]) == ("failed", "cancelled")
+    assert placed["payment_review"] == "paid_after_cancellation"
+    assert [event["status"] for event in placed["tracking_history"]] == ["payment_review"]
+    assert product["stock"] == 1
+
+
+def test_flagged_order_can_be_reinstated_by_an_admin_once_restocked(server, db):
+    async def scenario():
+        await seed(db, stock=1, payment_status="failed", status="cancelled")
+        await deliver_charge_success(server, db)
+        await db.products.update_one({"id": "p1"}, {"$set": {"stock": 5}})
+        await server.admin_reinstate_order("o1", admin={"email": "admin@example.com"})
+        return await state(db)
+
+    placed, product = asyncio.run(scenario())
+
+    assert placed["payment_status"] == "paid"
+    assert "payment_review" not in placed
+    assert product["stock"] == 3
+
+
+@pytest.fixture
+def paystack_success(server, monkeypatch):
+    client = server.ProviderClient("paystack", "https://paystack.test", 5)
+    client.client = httpx.AsyncClient(
+        transport=httpx.MockTransport(lambda request: httpx.Response(200, json={"status": True, "data": {"status": "success"}})),
+        base_url=client.base_url
+    )
+    monkeypatch.setattr(server, "paystack_client", client)
+
+
+@pytest.mark.parametrize("stock, expected", [(5, "success"), (0, "review")])
+def test_verify_only_pays_pending_orders_and_routes_late_ones(server, db, paystack_success, stock, expected):
+    async def scenario():
+        await seed(db, stock=stock, payment_status="expired", status="cancelled")
+        answer = await server.verify_paystack_payment(server.PaymentVerify(reference="GSP-1", order_id="o1"))
+        return answer, *await state(db)
+
+    answer, placed, product = asyncio.run(scenario())
+
+    assert answer["status"] == expected
+    if expected == "success":
+        assert placed["payment_status"] == "paid"
+        assert product["stock"] == 3
+    else:
+        assert placed["payment_status"] == "expired"
+        assert product["stock"] == 0
+
+
+def test_verify_rejects_a_reference_from_another_order(server, db, paystack_success):
+    async def scenario():
+        await seed(db, stock=5, payment_status="pending", status="pending", reference="GSP-OTHER")
+        answer = await server.verify_paystack_payment(server.PaymentVerify(reference="GSP-1", order_id="o1"))
+        return answer, (await state(db))[0]
+
+    answer, placed = asyncio.run(scenario())
+
+    assert answer["status"] == "failed"
+    assert placed["payment_status"] == "pending"
@@ -0,0 +1,98 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+ADMIN = {"email": "admin@example.com"}
+
+
+async def seed_expired(server, db, stock: int, restocked: bool = True):
+    """A bank transfer order for 2 units that the expiry job has cancelled (and, if restocked, released)"""
+    created_at = (datetime.now(timezone.utc) - timedelta(hours=server.UNPAID_ORDER_EXPIRY_HOURS + 1)).isoformat()
+    await db.products.insert_one({"id": "p1", "name": "Tee", "price": 1000, "images": [], "stock": stock, "sold_count": 0})
+    await db.orders.insert_one({
+        "id": "o1",
+        "reference": "GSP-1",
+        "user_email": "ada@example.com",
+        "payment_method": "bank_transfer",
+        "payment_status": "awaiting_payment",
+        "status": "pending_payment",
+        "items": [{"product_id": "p1", "product_name": "Tee", "quantity": 2, "size": "M", "color": None, "item_total": 2000}],
+        "tracking_history": [],
+        "created_at": created_at,
+        "updated_at": created_at,
+    })
+    if restocked:
+        await server.expire_unpaid_orders()
+    else:
+        await db.orders.update_one(
+            {"id": "o1"}, {"$set": {"payment_status": "expired", "status": "cancelled", "stock_release_pending": True}}
+        )
+
+
+async def state(db):
+    order = await db.orders.find_one({"id": "o1"}, {"_id": 0})
+    product = await db.products.find_one({"id": "p1"}, {"_id": 0})
+    return order, product
+
+
+def test_confirming_an_expired_order_says_so(server, db):
+    async def scenario():
+        await seed_expired(server, db, stock=5)
+        with pytest.raises(HTTPException) as error:
+            await server.admin_confirm_payment("o1", admin=ADMIN)
+        return error.value
+
+    error = asyncio.run(scenario())
+    assert error.status_code == 409
+    assert error.detail.startswith("Order expired")
+
+
+def test_reinstate_takes_the_stock_again_and_confirms_payment(server, db):
+    async def scenario():
+        await seed_expired(server, db, stock=5)
+        restocked = (await state(db))[1]["stock"]
+        await server.admin_reinstate_order("o1", admin=ADMIN)
+        return restocked, *await state(db)
+
+    restocked, order, product = asyncio.run(scenario())
+
+    assert restocked == 7
+    assert (product["stock"], product["sold_count"]) == (5, 0)
+    assert not product.get("reservations")
+    assert (order["payment_status"], order["status"]) == ("paid", "processing")
+    assert "reinstate_claim" not in order
+    assert order["tracking_history"][-1]["status"] == "payment_confirmed"
+
+
+def test_reinstate_keeps_stock_the_expiry_has_not_returned(server, db):
+    async def scenario():
+        await seed_expired(server, db, stock=5, restocked=False)
+        await server.admin_reinstate_order("o1", admin=ADMIN)
+        # A restock run afterwards finds nothing to give back
+        await server.release_expired_order_stock()
+        return await state(db)
+
+    order, product = asyncio.run(scenario())
+
+    assert product["stock"] == 5
+    assert "stock_release_pending" not in order
+    assert order["payment_status"] == "paid"
+
+
+def test_reinstate_without_stock_leaves_the_order_cancelled(server, db):
+    async def scenario():
+        await seed_expired(server, db, stock=0)
+        await db.products.update_one({"id": "p1"}, {"$set": {"stock": 1}})
+        with pytest.raises(HTTPException) as error:
+            await server.admin_reinstate_order("o1", admin=ADMIN)
+        return error.value, *await state(db)
+
+    error, order, product = asyncio.run(scenario())
+
+    assert error.status_code == 409
+    assert "Tee" in error.detail
+    assert (order["payment_status"], order["status"]) == ("expired", "cancelled")
+    assert "reinstate_claim" not in order
+    assert product["stock"] == 1
@@ -0,0 +1,67 @@
+import base64
+import json
+
+import pytest
+from fastapi import HTTPException
+
+
+def raw_cursor(value) -> str:
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip("=")
+
+
+@pytest.mark.parametrize("sort_value", ["2026-01-01T00:00:00+00:00", 42, 4.5, None, ""])
+def test_cursor_round_trip(server, sort_value):
+    cursor = server.encode_cursor(sort_value, "doc-1")
+    assert "=" not in cursor
+    assert server.decode_cursor(cursor) == (sort_value, "doc-1")
+
+
+@pytest.mark.parametrize("value", [
+    [{"$regex": "(a+)+$"}, "x"],
+    [["a"], "x"],
+    ["2026", {"$ne": None}],
+    ["2026", 5],
+    ["only-one"],
+    {"sort": 1, "id": "x"},
+])
+def test_non_scalar_cursor_is_rejected(server, value):
+    with pytest.raises(HTTPException) as error:
+        server.decode_cursor(raw_cursor(value))
+    assert error.value.status_code == 400
+
+
+@pytest.mark.parametrize("cursor", ["not base64!", raw_cursor("x")[:-2], raw_cursor("not json")[3:]])
+def test_malformed_cursor_is_rejected(server, cursor):
+    with pytest.raises(HTTPException) as error:
+        server.decode_cursor(cursor)
+    assert error.value.status_code == 400
+
+
+def test_no_cursor_leaves_the_query_alone(server):
+    assert server.keyset_query({"a": 1}, "created_at", server.DESCENDING, None) == {"a": 1}
+
+
+def test_descending_keyset_breaks_ties_on_id(server):
+    cursor = server.encode_cursor("2026-01-02", "b")
+    query = server.keyset_query({"sport": "Football"}, "created_at", server.DESCENDING, cursor)
+    assert query == {"$and": [
+        {"sport": "Football"},
+        {"$or": [
+            {"created_at": {"$lt": "2026-01-02"}},
+            {"created_at": "2026-01-02", "id": {"$lt": "b"}},
+        ]},
+    ]}
+
+
+def test_ascending_keyset_without_filters(server):
+    cursor = server.encode_cursor(100, "b")
+    assert server.keyset_query({}, "price", server.ASCENDING, cursor) == {"$or": [
+        {"price": {"$gt": 100}},
+        {"price": 100, "id": {"$gt": "b"}},
+    ]}
+
+
+def test_next_page_cursor_only_for_full_pages(server):
+    docs = [{"id": "a", "price": 1}, {"id": "b", "price": 2}]
+    assert server.next_page_cursor(docs, 3, "price") is None
+    assert server.decode_cursor(server.next_page_cursor(docs, 2, "price")) == (2, "b")
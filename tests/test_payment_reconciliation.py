@@ -0,0 +1,131 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+
+# reference suffix -> what the Paystack stub answers for it
+OUTCOMES = {
+    "paid": (200, {"status": True, "data": {"status": "success"}}),
+    "failed": (200, {"status": True, "data": {"status": "failed"}}),
+    "abandoned": (200, {"status": True, "data": {"status": "abandoned"}}),
+    "unknown": (400, {"status": False, "message": "Transaction reference not found"}),
+    "down": (502, {"status": False, "message": "Bad gateway"}),
+}
+IN_WINDOW = list(OUTCOMES) * 2
+
+
+class PaystackStub:
+    """httpx MockTransport handler for /transaction/verify/{reference} that records concurrency"""
+
+    def __init__(self):
+        self.calls = []
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        reference = request.url.path.rsplit("/", 1)[-1]
+        self.calls.append(reference)
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+        finally:
+            self.in_flight -= 1
+        status_code, body = OUTCOMES[reference.rsplit("-", 1)[-1]]
+        return httpx.Response(status_code, json=body)
+
+
+@pytest.fixture
+def paystack(server, monkeypatch):
+    stub = PaystackStub()
+    client = server.ProviderClient("paystack", "https://paystack.test", 5)
+    client.client = httpx.AsyncClient(transport=httpx.MockTransport(stub), base_url=client.base_url)
+    monkeypatch.setattr(server, "paystack_client", client)
+    monkeypatch.setattr(server, "PROVIDER_MAX_RETRIES", 0)
+    monkeypatch.setattr(server, "RECONCILE_RATE_PER_SECOND", 0)
+    monkeypatch.setattr(server, "RECONCILE_CONCURRENCY", 3)
+    monkeypatch.setattr(server, "RECONCILE_BATCH_SIZE", 4)
+    return stub
+
+
+def make_order(index: int, outcome: str, age: timedelta, product_id: str) -> dict:
+    created_at = (datetime.now(timezone.utc) - age).isoformat()
+    return {
+        "id": f"order-{index}",
+        "reference": f"GSP-{index}-{outcome}",
+        "payment_method": "paystack",
+        "payment_status": "pending",
+        "status": "pending_payment",
+        "items": [{"product_id": product_id, "quantity": 2, "size": "M", "color": None}],
+        "tracking_history": [],
+        "created_at": created_at,
+        "updated_at": created_at,
+    }
+
+
+async def seed(db):
+    await db.products.insert_one({"id": "p1", "name": "Tee", "price": 1000, "stock": 10, "sold_count": 0})
+    orders = [make_order(i, outcome, timedelta(hours=1, minutes=i), "p1") for i, outcome in enumerate(IN_WINDOW)]
+    # Outside the window: too fresh, too old, or not a Paystack order
+    orders.append(make_order(90, "paid", timedelta(minutes=1), "p1"))
+    orders.append(make_order(91, "paid", timedelta(hours=100), "p1"))
+    orders.append({**make_order(92, "paid", timedelta(hours=1), "p1"), "payment_method": "bank_transfer"})
+    await db.orders.insert_many(orders)
+
+
+def test_reconcile_pages_through_the_window_and_applies_outcomes(server, db, paystack, monkeypatch):
+    bulk_writes = []
+    collection_type = type(db.orders)
+    real_bulk_write = collection_type.bulk_write
+
+    async def counting_bulk_write(self, requests, *args, **kwargs):
+        if self.name == "orders":
+            bulk_writes.append(len(requests))
+        return await real_bulk_write(self, requests, *args, **kwargs)
+
+    monkeypatch.setattr(collection_type, "bulk_write", counting_bulk_write)
+
+    async def scenario():
+        await seed(db)
+        stats = await server.reconcile_pending_payments()
+        orders = {o["id"]: o for o in await db.orders.find({}, {"_id": 0}).to_list(None)}
+        product = await db.products.find_one({"id": "p1"}, {"_id": 0})
+        return stats, orders, product
+
+    stats, orders, product = asyncio.run(scenario())
+
+    # Ten orders in the window, paged four at a time, each looked up exactly once
+    assert sorted(paystack.calls) == sorted(f"GSP-{i}-{outcome}" for i, outcome in enumerate(IN_WINDOW))
+    assert 1 < paystack.peak_in_flight <= 3
+    assert bulk_writes == [4, 3, 1]  # one bulk write per page; lookup errors write nothing
+    assert stats["last_checked"] == 10
+    assert (stats["paid_total"], stats["failed_total"], stats["errors_total"]) == (2, 2, 2)
+
+    assert orders["order-0"]["payment_status"] == "paid"
+    assert orders["order-0"]["status"] == "confirmed"
+    assert orders["order-1"]["payment_status"] == "failed"
+    assert orders["order-1"]["status"] == "cancelled"
+    assert "stock_release_pending" not in orders["order-1"]
+    assert orders["order-2"]["payment_status"] == "pending"
+    assert "reconciled_at" in orders["order-2"]
+    assert "reconciled_at" in orders["order-3"]
+    assert "reconciled_at" not in orders["order-4"]
+    assert all(orders[f"order-{i}"]["payment_status"] == "pending" for i in (90, 91, 92))
+
+    # Both failed orders (2 units each) gave their stock back
+    assert product["stock"] == 14
+
+
+def test_reconcile_skips_orders_checked_recently(server, db, paystack):
+    async def scenario():
+        await seed(db)
+        await server.reconcile_pending_payments()
+        paystack.calls.clear()
+        return await server.reconcile_pending_payments()
+
+    stats = asyncio.run(scenario())
+
+    # Only the lookups that errored are retried; answered ones wait for RECONCILE_RECHECK_MINUTES
+    assert sorted(paystack.calls) == ["GSP-4-down", "GSP-9-down"]
+    assert stats["last_checked"] == 2
@@ -0,0 +1,56 @@
+import asyncio
+
+import httpx
+
+
+def make_products():
+    products = []
+    for i in range(5):
+        products.append({
+            "id": f"p{i}",
+            "name": f"Jersey {i}",
+            "price": 10000 * (i + 1),
+            "sport": "Football" if i < 3 else "Basketball",
+            "category": "jerseys",
+            "colors": ["Black", "Red"] if i % 2 else ["White"],
+            "sizes": ["M", "L"],
+            "images": ["a.jpg", "b.jpg"],
+            "stock": 10,
+            "featured": False,
+            "created_at": f"2026-01-0{i + 1}T00:00:00+00:00",
+        })
+    return products
+
+
+def browse_two_pages(server, db, params: dict):
+    async def scenario():
+        await db.products.insert_many(make_products())
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test/api") as client:
+            first = (await client.get("/products/browse", params=params)).json()
+            second = (await client.get("/products/browse", params={**params, "cursor": first["next_cursor"]})).json()
+            return first, second
+    return asyncio.run(scenario())
+
+
+def test_browse_pages_by_cursor_with_facets(server, db):
+    first, second = browse_two_pages(server, db, {"sport": "Football", "limit": 2})
+
+    assert [p["id"] for p in first["products"]] == ["p2", "p1"]
+    assert first["total"] == 3
+    # Card view: first image only
+    assert first["products"][0]["images"] == ["a.jpg"]
+    # The sport facet ignores the sport filter; the others respect it
+    assert first["facets"]["sport"] == [{"value": "Basketball", "count": 2}, {"value": "Football", "count": 3}]
+    assert {"value": "Red", "count": 1} in first["facets"]["color"]
+
+    assert [p["id"] for p in second["products"]] == ["p0"]
+    assert second["next_cursor"] is None
+
+
+def test_facet_pipeline_leaves_the_page_to_an_indexed_find(server):
+    pipeline = server.build_browse_pipeline({"sport": "Football", "search": None})
+    facets = pipeline[-1]["$facet"]
+    assert "products" not in facets
+    assert "total" not in facets
+    assert set(facets) == {"price", *server.BROWSE_FACETS}
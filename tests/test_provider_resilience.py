@@ -0,0 +1,218 @@
+import asyncio
+
+import httpx
+import pytest
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(server, monkeypatch):
+    fake = Clock()
+    monkeypatch.setattr(server.time, "monotonic", fake)
+    return fake
+
+
+def test_breaker_opens_half_opens_and_closes(server, clock):
+    breaker = server.CircuitBreaker(threshold=3, reset_seconds=30)
+
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.opened_count == 1
+
+    # Open: calls are refused until the reset period has passed
+    clock.now += 29
+    assert not breaker.allow()
+    assert breaker.rejected == 1
+
+    # Half open: exactly one probe goes through
+    clock.now += 1
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.consecutive_failures == 0
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens_the_circuit(server, clock):
+    breaker = server.CircuitBreaker(threshold=1, reset_seconds=10)
+    breaker.record_failure()
+    clock.now += 10
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.opened_count == 2
+    assert not breaker.allow()
+
+
+def test_cancelled_probe_frees_the_slot(server, clock):
+    breaker = server.CircuitBreaker(threshold=1, reset_seconds=10)
+    breaker.record_failure()
+    clock.now += 10
+    assert breaker.allow()
+    breaker.release_probe()
+    assert breaker.allow()
+
+
+def test_failures_while_open_do_not_push_the_reset_back(server, clock):
+    breaker = server.CircuitBreaker(threshold=1, reset_seconds=10)
+    breaker.record_failure()
+    # A call that was already in flight when the circuit opened fails afterwards
+    clock.now += 5
+    breaker.record_failure()
+    assert breaker.opened_count == 1
+    clock.now += 5
+    assert breaker.allow() == "probe"
+
+
+def test_cancelled_ordinary_call_keeps_the_probe_slot(server, monkeypatch):
+    monkeypatch.setattr(server, "PROVIDER_FAILURE_THRESHOLD", 1)
+    gate = asyncio.Event()
+
+    async def handler(request):
+        if request.url.path == "/fail":
+            return httpx.Response(503)
+        await gate.wait()
+        return httpx.Response(200)
+
+    client = provider(server, handler, monkeypatch)
+
+    async def scenario():
+        ordinary = asyncio.create_task(client.request("GET", "/slow"))
+        await asyncio.sleep(0.01)
+        await client.request("POST", "/fail")
+        # Age the open circuit rather than patch the clock, which the event loop shares
+        client.breaker.opened_at -= server.PROVIDER_CIRCUIT_RESET_SECONDS
+        probe = asyncio.create_task(client.request("GET", "/slow"))
+        await asyncio.sleep(0.01)
+        ordinary.cancel()
+        await asyncio.gather(ordinary, return_exceptions=True)
+        second_probe = client.breaker.allow()
+        gate.set()
+        await probe
+        return second_probe
+
+    assert asyncio.run(scenario()) is None
+    assert client.breaker.state == "closed"
+
+
+def test_successes_reset_the_failure_count(server):
+    breaker = server.CircuitBreaker(threshold=2, reset_seconds=10)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+
+def test_retry_budget_runs_out_and_refills_from_successes(server):
+    budget = server.RetryBudget(ratio=0.5, reserve=2)
+    assert budget.withdraw()
+    assert budget.withdraw()
+    assert not budget.withdraw()
+
+    budget.deposit()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert budget.withdraw()
+
+    for _ in range(100):
+        budget.deposit()
+    assert budget.tokens == 10
+
+
+def provider(server, handler, monkeypatch, retry_budget: float = 0):
+    monkeypatch.setattr(server, "PROVIDER_RETRY_BACKOFF_SECONDS", 0)
+    client = server.ProviderClient("stub", "https://provider.test", 5)
+    client.client = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url=client.base_url)
+    client.retry_budget = server.RetryBudget(ratio=0.5, reserve=retry_budget)
+    return client
+
+
+def test_failed_calls_earn_no_retry_budget(server, monkeypatch):
+    client = provider(server, lambda request: httpx.Response(503), monkeypatch, retry_budget=1)
+
+    async def scenario():
+        return [await client.request("GET", "/") for _ in range(3)]
+
+    responses = asyncio.run(scenario())
+
+    # The one reserved token buys a single retry; the failures themselves never add to it
+    assert [r.status_code for r in responses] == [503, 503, 503]
+    assert client.retries == 1
+    assert client.requests == 4
+    assert client.retry_budget.tokens == 0
+
+
+def test_open_circuit_fails_fast_without_calling_the_provider(server, monkeypatch):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(502)
+
+    monkeypatch.setattr(server, "PROVIDER_FAILURE_THRESHOLD", 2)
+    client = provider(server, handler, monkeypatch)
+
+    async def scenario():
+        await client.request("GET", "/")
+        await client.request("GET", "/")
+        with pytest.raises(server.CircuitOpenError):
+            await client.request("GET", "/")
+
+    asyncio.run(scenario())
+    assert len(calls) == 2
+    assert client.stats()["circuit"]["state"] == "open"
+
+
+def test_client_wires_base_url_headers_and_timeouts_and_counts_calls(server, monkeypatch):
+    seen = []
+
+    def handler(request):
+        seen.append(request)
+        if request.url.path.endswith("/down"):
+            raise httpx.ConnectError("refused", request=request)
+        return httpx.Response(200, json={"ok": True})
+
+    # open() builds the real client; only the transport underneath it is swapped
+    real_client = httpx.AsyncClient
+    monkeypatch.setattr(
+        server.httpx, "AsyncClient", lambda **kwargs: real_client(transport=httpx.MockTransport(handler), **kwargs)
+    )
+    client = server.ProviderClient("stub", "https://provider.test/v1", 7, headers={"Authorization": "Bearer key"})
+
+    async def scenario():
+        await client.request("GET", "/things")
+        with pytest.raises(httpx.ConnectError):
+            await client.request("POST", "/down")
+        stats = client.stats()
+        opened = client.client
+        await client.close()
+        return stats, opened
+
+    stats, opened = asyncio.run(scenario())
+
+    assert str(seen[0].url) == "https://provider.test/v1/things"
+    assert seen[0].headers["Authorization"] == "Bearer key"
+    timeout = seen[0].extensions["timeout"]
+    assert (timeout["read"], timeout["connect"]) == (7, 5.0)
+    assert stats["base_url"] == "https://provider.test/v1"
+    assert stats["open"] is True
+    assert (stats["requests"], stats["errors"], stats["in_flight"], stats["peak_in_flight"]) == (2, 1, 0, 1)
+    assert stats["circuit"]["consecutive_failures"] == 1
+    assert opened.is_closed
+    assert client.client is None
+    assert client.stats()["open"] is False
@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+
+def product(product_id: str, stock: int) -> dict:
+    return {"id": product_id, "name": f"Jersey {product_id}", "price": 1000, "images": [], "stock": stock, "sold_count": 0}
+
+
+def line(product_id: str, quantity: int, size: str = "M") -> dict:
+    return {"product_id": product_id, "quantity": quantity, "size": size, "color": None}
+
+
+async def seed(db, *products):
+    await db.products.insert_many([dict(p) for p in products])
+    return {p["id"]: p for p in products}
+
+
+async def stored(db, product_id: str) -> dict:
+    return await db.products.find_one({"id": product_id}, {"_id": 0})
+
+
+def test_reserve_decrements_only_while_stock_lasts(server, db):
+    async def scenario():
+        products = await seed(db, product("p1", 5))
+        first = await server.reserve_stock("o1", [line("p1", 3)], products)
+        after_first = await stored(db, "p1")
+        second = await server.reserve_stock("o2", [line("p1", 3)], products)
+        return first, after_first, second, await stored(db, "p1")
+
+    first, after_first, second, after_second = asyncio.run(scenario())
+
+    assert first is True
+    assert after_first["stock"] == 2
+    assert after_first["sold_count"] == 3
+    assert after_first["reservations"] == {"o1": 3}
+    assert second is False
+    assert after_second == after_first
+
+
+def test_short_line_rolls_back_the_whole_order(server, db):
+    async def scenario():
+        products = await seed(db, product("p1", 5), product("p2", 1))
+        reserved = await server.reserve_stock("o1", [line("p1", 2), line("p2", 2)], products)
+        return reserved, await stored(db, "p1"), await stored(db, "p2")
+
+    reserved, p1, p2 = asyncio.run(scenario())
+
+    assert reserved is False
+    assert (p1["stock"], p1["sold_count"]) == (5, 0)
+    assert (p2["stock"], p2["sold_count"]) == (1, 0)
+    assert not p1.get("reservations") and not p2.get("reservations")
+
+
+def test_failed_order_insert_releases_the_reservation(server, db, monkeypatch):
+    collection_type = type(db.orders)
+    insert_one = collection_type.insert_one
+
+    async def fail_order_insert(collection, document, *args, **kwargs):
+        if collection.name == "orders":
+            raise RuntimeError("write failed")
+        return await insert_one(collection, document, *args, **kwargs)
+
+    async def scenario():
+        await seed(db, product("p1", 4))
+        monkeypatch.setattr(collection_type, "insert_one", fail_order_insert)
+        order = server.OrderCreate(
+            shipping_address=server.ShippingAddress(
+                full_name="Ada", address="1 Road", city="Lagos", state="Lagos", phone="080", email="ada@example.com"
+            ),
+            payment_method="bank_transfer",
+            items=[server.CartItem(product_id="p1", quantity=3, size="M")]
+        )
+        with pytest.raises(RuntimeError):
+            await server.place_order(order, {"id": "u1", "email": "ada@example.com"}, server.PhaseTimer(server.PhaseStats()))
+        return await stored(db, "p1")
+
+    p1 = asyncio.run(scenario())
+
+    assert (p1["stock"], p1["sold_count"]) == (4, 0)
+    assert not p1.get("reservations")
+
+
+def test_commit_keeps_the_sale_and_drops_the_tags(server, db):
+    async def scenario():
+        products = await seed(db, product("p1", 5), product("p2", 5))
+        items = [line("p1", 2), line("p2", 1)]
+        await server.reserve_stock("o1", items, products)
+        await server.commit_stock("o1", items, products)
+        # Releasing after the commit finds no tags and must not give the stock back
+        await server.release_stock("o1", items, products)
+        return await stored(db, "p1"), await stored(db, "p2")
+
+    p1, p2 = asyncio.run(scenario())
+
+    assert (p1["stock"], p1["sold_count"]) == (3, 2)
+    assert (p2["stock"], p2["sold_count"]) == (4, 1)
+    assert not p1.get("reservations") and not p2.get("reservations")
@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+
+
+def tracked_product(stock: int, shared_stock: int = 0, shards: int = 2) -> dict:
+    return {
+        "id": "p1", "name": "Jersey", "price": 1000, "images": [], "stock": stock, "sold_count": 0,
+        "shared_stock": shared_stock, "inventory_variants": [{"size": "M", "color": None, "shards": shards}]
+    }
+
+
+def line(quantity: int, size: str = "M") -> dict:
+    return {"product_id": "p1", "quantity": quantity, "size": size, "color": None}
+
+
+async def seed(db, product: dict, shard_stock: list) -> dict:
+    await db.products.insert_one(dict(product))
+    await db.inventory.insert_many([
+        {"product_id": "p1", "size": "M", "color": None, "shard": shard, "stock": stock}
+        for shard, stock in enumerate(shard_stock)
+    ])
+    return {"p1": product}
+
+
+async def shards(db) -> dict:
+    docs = await db.inventory.find({"product_id": "p1"}, {"_id": 0}).to_list(None)
+    return {doc["shard"]: doc for doc in docs}
+
+
+async def stored(db) -> dict:
+    return await db.products.find_one({"id": "p1"}, {"_id": 0})
+
+
+@pytest.fixture
+def pick_shard(server, monkeypatch):
+    """Make reserve_variant_stock try the given shard first"""
+    def pick(shard: int):
+        monkeypatch.setattr(server.random, "randrange", lambda n: shard)
+    return pick
+
+
+def test_short_shard_falls_back_to_the_others(server, db, pick_shard):
+    pick_shard(0)
+
+    async def scenario():
+        products = await seed(db, tracked_product(6), [1, 5])
+        reserved = await server.reserve_stock("o1", [line(3)], products)
+        return reserved, await shards(db)
+
+    reserved, docs = asyncio.run(scenario())
+
+    assert reserved is True
+    assert docs[0]["stock"] + docs[1]["stock"] == 3
+    assert sum(doc.get("reservations", {}).get("o1", 0) for doc in docs.values()) == 3
+
+
+def test_partial_drain_is_rolled_back(server, db, pick_shard):
+    pick_shard(0)
+
+    async def scenario():
+        products = await seed(db, tracked_product(3), [2, 1])
+        reserved = await server.reserve_stock("o1", [line(4)], products)
+        return reserved, await shards(db)
+
+    reserved, docs = asyncio.run(scenario())
+
+    assert reserved is False
+    assert (docs[0]["stock"], docs[1]["stock"]) == (2, 1)
+    assert not any(doc.get("reservations") for doc in docs.values())
+
+
+def test_untracked_sizes_sell_from_shared_stock(server, db):
+    async def scenario():
+        products = await seed(db, tracked_product(10, shared_stock=4), [3, 3])
+        reserved = await server.reserve_stock("o1", [line(3, size="L")], products)
+        return reserved, await stored(db), await shards(db)
+
+    reserved, product, docs = asyncio.run(scenario())
+
+    assert reserved is True
+    assert (product["shared_stock"], product["stock"], product["sold_count"]) == (1, 7, 3)
+    assert (docs[0]["stock"], docs[1]["stock"]) == (3, 3)
+
+
+def test_restock_returns_variant_units_to_shard_zero(server, db):
+    async def scenario():
+        await seed(db, {**tracked_product(4), "sold_count": 5}, [2, 2])
+        returned = await server.restock_order_items([line(2), line(1, size="L")])
+        return returned, await stored(db), await shards(db)
+
+    returned, product, docs = asyncio.run(scenario())
+
+    assert returned == 3
+    assert (docs[0]["stock"], docs[1]["stock"]) == (4, 2)
+    assert (product["stock"], product["shared_stock"], product["sold_count"]) == (7, 1, 2)
+
+
+@pytest.mark.parametrize("outcome", ["commit", "release"])
+def test_inventory_update_keeps_in_flight_reservations_consistent(server, db, pick_shard, outcome):
+    pick_shard(1)
+
+    async def scenario():
+        products = await seed(db, tracked_product(6), [3, 3])
+        await server.reserve_stock("o1", [line(2)], products)
+        # The admin recounts while the order is still being placed, and drops to one shard
+        await server.update_inventory("p1", stock=10, size="M", shards=1, admin={})
+        if outcome == "commit":
+            await server.commit_stock("o1", [line(2)], products)
+        else:
+            await server.release_stock("o1", [line(2)], products)
+        return await stored(db), await shards(db)
+
+    product, docs = asyncio.run(scenario())
+
+    variant_stock = sum(doc["stock"] for doc in docs.values())
+    assert variant_stock == (10 if outcome == "commit" else 12)
+    assert product["stock"] == variant_stock
+    assert not any(doc.get("reservations") for doc in docs.values())